@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django import forms
-from .models import UserAcueducto, HistoricoLectura
+from .models import UserAcueducto, HistoricoLectura, Ruta, TrabajoFacturacion, EnvioFactura, AnomaliaLectura
 
 # This local form might be redundant if the main UserAcueductoForm from forms.py is sufficient.
 # For now, let's update it as per the field rename.
@@ -55,5 +55,28 @@ class HistoricoLecturaAdmin(admin.ModelAdmin):
     list_filter = ('fecha_lectura',)
     search_fields = ('usuario__contrato', 'usuario__name')
 
+@admin.register(Ruta)
+class RutaAdmin(admin.ModelAdmin):
+    list_display = ('nombre', 'lector', 'activa', 'lecturas_completadas', 'total_ordenes', 'fecha_creacion')
+    list_filter = ('activa', 'lector')
+    search_fields = ('nombre',)
+    # Los contadores los mantienen las señales y el comando reconciliar_rutas
+    readonly_fields = ('total_ordenes', 'lecturas_completadas')
 
+@admin.register(TrabajoFacturacion)
+class TrabajoFacturacionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tipo', 'estado', 'procesadas', 'fallidas', 'total', 'fecha_creacion', 'fecha_finalizacion')
+    list_filter = ('tipo', 'estado')
 
+@admin.register(EnvioFactura)
+class EnvioFacturaAdmin(admin.ModelAdmin):
+    list_display = ('email', 'usuario', 'enviado', 'intentos', 'trabajo', 'fecha')
+    list_filter = ('enviado', 'trabajo')
+    search_fields = ('email', 'usuario__contrato')
+
+@admin.register(AnomaliaLectura)
+class AnomaliaLecturaAdmin(admin.ModelAdmin):
+    list_display = ('usuario', 'tipo', 'fecha', 'consumo', 'referencia', 'fecha_deteccion')
+    list_filter = ('tipo', 'fecha')
+    search_fields = ('usuario__contrato',)
+    list_select_related = ('usuario',)
@@ -0,0 +1,129 @@
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import ConsumoMensual, UserAcueducto
+
+# Tablero de analítica de todo el acueducto. Cada panel es una sola consulta agrupada en SQL
+# (la base de datos devuelve unas pocas filas por zona, categoría y mes, nunca los usuarios ni
+# las lecturas); los totales por zona, por categoría y por mes se suman en Python sobre esas
+# filas. El resultado se guarda en la caché de Django durante ANALITICA_CACHE_SEGUNDOS.
+
+MESES_POR_DEFECTO = 12
+MESES_MAX = 60
+_CENTAVOS = Decimal('0.01')
+
+
+def _cache_segundos() -> int:
+    return getattr(settings, 'ANALITICA_CACHE_SEGUNDOS', 300)
+
+
+def primer_mes(meses: int, hoy=None) -> date:
+    """Primer día del mes que queda `meses` meses atrás contando el actual"""
+    hoy = hoy or timezone.localdate()
+    numero = hoy.year * 12 + hoy.month - 1 - (meses - 1)
+    return date(numero // 12, numero % 12 + 1, 1)
+
+
+def panel_cartera() -> list[dict]:
+    """Usuarios, crédito y otros gastos por zona y categoría: una consulta"""
+    return list(
+        UserAcueducto.objects.order_by().values('zona', 'categoria').annotate(
+            usuarios=Count('id'),
+            credito=Sum('credito'),
+            otros_gastos=Sum('otros_gastos_valor'),
+        ).order_by('zona', 'categoria')
+    )
+
+
+def panel_consumo(desde: date) -> list[dict]:
+    """
+    Consumo (sin los negativos) y usuarios con lectura por mes, zona y categoría desde el mes
+    de `desde`, de la tabla de consumo mensual: una consulta. Hay una fila de ConsumoMensual
+    por usuario y mes, así que contar filas es contar usuarios leídos.
+    """
+    return list(
+        ConsumoMensual.objects.filter(periodo__gte=desde).order_by().values(
+            'periodo', zona=F('usuario__zona'), categoria=F('usuario__categoria')
+        ).annotate(
+            consumo=Sum('consumo', filter=Q(consumo__gt=0)),
+            lecturas=Count('id'),
+        ).order_by('periodo', 'zona', 'categoria')
+    )
+
+
+def _cobertura(lecturas, usuarios):
+    return round(lecturas / usuarios, 4) if usuarios else None
+
+
+def _sumar(filas, clave, campos):
+    totales = {}
+    for fila in filas:
+        total = totales.setdefault(fila[clave], dict.fromkeys(campos, 0))
+        for campo in campos:
+            total[campo] += fila[campo] or 0
+    return totales
+
+
+def calcular_tablero(meses: int = MESES_POR_DEFECTO) -> dict:
+    """
+    Datos del tablero para los últimos `meses` meses en dos consultas. La cobertura de
+    lecturas de un mes es la fracción de los usuarios actuales de la zona y categoría que
+    tienen lectura en ese mes.
+    """
+    desde = primer_mes(meses)
+    cartera = panel_cartera()
+    consumo = panel_consumo(desde)
+
+    usuarios_grupo = {(fila['zona'], fila['categoria']): fila['usuarios'] for fila in cartera}
+    for fila in cartera:
+        # En SQLite la suma de un DecimalField pierde la escala; los importes van en centavos
+        fila['credito'] = Decimal(fila['credito'] or 0).quantize(_CENTAVOS)
+        fila['otros_gastos'] = Decimal(fila['otros_gastos'] or 0).quantize(_CENTAVOS)
+    for fila in consumo:
+        fila['consumo'] = round(fila['consumo'] or 0.0, 3)
+        fila['usuarios'] = usuarios_grupo.get((fila['zona'], fila['categoria']), 0)
+        fila['cobertura'] = _cobertura(fila['lecturas'], fila['usuarios'])
+
+    campos_cartera = ('usuarios', 'credito', 'otros_gastos')
+    total_usuarios = sum(usuarios_grupo.values())
+    por_mes = _sumar(consumo, 'periodo', ('consumo', 'lecturas'))
+    return {
+        'generado': timezone.now(),
+        'desde': desde,
+        'meses': meses,
+        'totales': {
+            campo: sum(fila[campo] for fila in cartera) for campo in campos_cartera
+        },
+        'zonas': [
+            {'zona': zona, **total}
+            for zona, total in sorted(_sumar(cartera, 'zona', campos_cartera).items())
+        ],
+        'categorias': [
+            {'categoria': categoria, **total}
+            for categoria, total in sorted(_sumar(cartera, 'categoria', campos_cartera).items())
+        ],
+        'cartera': cartera,
+        'consumo_mensual': [
+            {
+                'periodo': periodo, 'consumo': round(total['consumo'], 3), 'lecturas': total['lecturas'],
+                'cobertura': _cobertura(total['lecturas'], total_usuarios),
+            }
+            for periodo, total in sorted(por_mes.items())
+        ],
+        'consumo': consumo,
+    }
+
+
+def tablero(meses: int = MESES_POR_DEFECTO) -> dict:
+    """calcular_tablero() guardado en caché ANALITICA_CACHE_SEGUNDOS; 0 la desactiva"""
+    meses = min(max(int(meses), 1), MESES_MAX)
+    segundos = _cache_segundos()
+    if segundos <= 0:
+        return calcular_tablero(meses)
+    return cache.get_or_set(f'analitica:tablero:{meses}', lambda: calcular_tablero(meses), segundos)
+
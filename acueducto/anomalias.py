@@ -0,0 +1,127 @@
+from collections import Counter, deque
+from datetime import timedelta
+from statistics import median
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import AnomaliaLectura, HistoricoLectura, UserAcueducto
+
+# Detección de lecturas sospechosas de fuga o de falla del medidor. La pasada completa recorre
+# las lecturas de todos los usuarios en una sola consulta ordenada por usuario y fecha, por
+# bloques: solo guarda el estado del usuario en curso (su última lectura y una ventana de
+# VENTANA_MEDIANA consumos), así que la memoria no crece con el número de lecturas.
+# - consumo_negativo: la lectura es menor que la anterior (medidor cambiado, reiniciado o mal leído)
+# - pico: el consumo supera FACTOR_PICO veces la mediana de los consumos anteriores (posible fuga)
+# - medidor_sin_lectura: fecha_ultima_lectura tiene más de DIAS_SIN_LECTURA días
+
+FACTOR_PICO = 5
+VENTANA_MEDIANA = 6
+# Consumos anteriores necesarios para buscar picos
+MINIMO_HISTORIA = 3
+# Mediana mínima (m³) contra la que se comparan los picos: con consumos casi nulos cualquier
+# consumo sería un pico
+MEDIANA_MINIMA = 1.0
+DIAS_SIN_LECTURA = 60
+TAMANO_LOTE = 2000
+
+
+class _Serie:
+    """Estado de la serie de lecturas de un usuario durante la pasada"""
+    __slots__ = ('anterior', 'consumos')
+
+    def __init__(self):
+        self.anterior = None
+        self.consumos = deque(maxlen=VENTANA_MEDIANA)
+
+    def revisar(self, usuario_id, lectura_id, fecha, lectura) -> list[AnomaliaLectura]:
+        """Agrega una lectura a la serie y devuelve sus anomalías (sin guardar)"""
+        anterior, self.anterior = self.anterior, lectura
+        if anterior is None:
+            return []
+        consumo = round(lectura - anterior, 3)
+        if consumo < 0:
+            # El consumo negativo no entra en la ventana: no es un consumo real
+            return [AnomaliaLectura(
+                usuario_id=usuario_id, lectura_id=lectura_id, tipo='consumo_negativo', fecha=fecha, consumo=consumo,
+                detalle=f'La lectura {lectura:g} es menor que la anterior ({anterior:g})',
+            )]
+        anomalias = []
+        if len(self.consumos) >= MINIMO_HISTORIA:
+            mediana = median(self.consumos)
+            if consumo > FACTOR_PICO * max(mediana, MEDIANA_MINIMA):
+                anomalias.append(AnomaliaLectura(
+                    usuario_id=usuario_id, lectura_id=lectura_id, tipo='pico', fecha=fecha, consumo=consumo,
+                    referencia=mediana, detalle=f'Consumo de {consumo:g} m³ frente a una mediana de {mediana:g} m³',
+                ))
+        self.consumos.append(consumo)
+        return anomalias
+
+
+def medidores_sin_lectura(usuarios=None, hoy=None):
+    """Anomalías (sin guardar) de los usuarios cuya última lectura tiene más de DIAS_SIN_LECTURA días"""
+    hoy = hoy or timezone.localdate()
+    usuarios = UserAcueducto.objects.all() if usuarios is None else usuarios
+    for usuario_id, fecha in usuarios.filter(
+        fecha_ultima_lectura__lt=hoy - timedelta(days=DIAS_SIN_LECTURA)
+    ).order_by('pk').values_list('pk', 'fecha_ultima_lectura').iterator(chunk_size=TAMANO_LOTE):
+        dias = (hoy - fecha).days
+        yield AnomaliaLectura(
+            usuario_id=usuario_id, tipo='medidor_sin_lectura', fecha=fecha, referencia=dias,
+            detalle=f'Sin lectura desde el {fecha:%d/%m/%Y} ({dias} días)',
+        )
+
+
+def _anomalias_lecturas(usuarios=None):
+    lecturas = HistoricoLectura.objects.all()
+    if usuarios is not None:
+        lecturas = lecturas.filter(usuario__in=usuarios)
+    serie, usuario_actual = None, None
+    for lectura_id, usuario_id, fecha, lectura in lecturas.order_by('usuario_id', 'fecha_lectura', 'id').values_list(
+        'id', 'usuario_id', 'fecha_lectura', 'lectura'
+    ).iterator(chunk_size=TAMANO_LOTE):
+        if usuario_id != usuario_actual:
+            serie, usuario_actual = _Serie(), usuario_id
+        yield from serie.revisar(usuario_id, lectura_id, fecha, lectura)
+
+
+def detectar_anomalias(usuarios=None, hoy=None) -> Counter:
+    """
+    Pasada completa sobre las lecturas de todos los usuarios (o del queryset `usuarios`):
+    reemplaza sus anomalías guardadas por las que encuentra, en lotes de TAMANO_LOTE.
+    Devuelve el número de anomalías por tipo.
+    """
+    anteriores = AnomaliaLectura.objects.all()
+    if usuarios is not None:
+        anteriores = anteriores.filter(usuario__in=usuarios)
+    conteo = Counter()
+    lote = []
+    with transaction.atomic():
+        anteriores.delete()
+        for fuente in (_anomalias_lecturas(usuarios), medidores_sin_lectura(usuarios, hoy)):
+            for anomalia in fuente:
+                conteo[anomalia.tipo] += 1
+                lote.append(anomalia)
+                if len(lote) >= TAMANO_LOTE:
+                    AnomaliaLectura.objects.bulk_create(lote)
+                    lote.clear()
+        AnomaliaLectura.objects.bulk_create(lote)
+    return conteo
+
+
+def revisar_lectura(historico: HistoricoLectura) -> list[AnomaliaLectura]:
+    """
+    Revisa una lectura recién registrada contra las VENTANA_MEDIANA + 1 anteriores del usuario
+    (una consulta) y guarda sus anomalías. Las devuelve para advertir al lector.
+    """
+    anteriores = HistoricoLectura.objects.filter(usuario_id=historico.usuario_id).filter(
+        Q(fecha_lectura__lt=historico.fecha_lectura) | Q(fecha_lectura=historico.fecha_lectura, id__lt=historico.pk)
+    ).order_by('-fecha_lectura', '-id').values_list('lectura', flat=True)[:VENTANA_MEDIANA + 1]
+    serie = _Serie()
+    for lectura in reversed(list(anteriores)):
+        serie.revisar(historico.usuario_id, None, None, lectura)
+    anomalias = serie.revisar(historico.usuario_id, historico.pk, historico.fecha_lectura, historico.lectura)
+    if anomalias:
+        AnomaliaLectura.objects.bulk_create(anomalias)
+    return anomalias
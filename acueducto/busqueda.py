@@ -0,0 +1,174 @@
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import UserAcueducto
+
+# Índice de búsqueda de usuarios: tabla virtual FTS5 de SQLite con el tokenizador trigram,
+# que resuelve búsquedas por subcadena (como icontains) sin recorrer la tabla de usuarios.
+# Se mantiene con triggers sobre acueducto_useracueducto, así también la actualizan los
+# bulk_create() y update() que no disparan señales de Django. En otros motores, o con un
+# SQLite sin FTS5, la búsqueda vuelve a icontains.
+
+TABLA_BUSQUEDA = 'acueducto_busqueda_usuario'
+# El tokenizador trigram no encuentra términos de menos de tres caracteres
+MIN_CARACTERES_INDICE = 3
+CAMPOS_BUSQUEDA = ('contrato', 'address', 'name', 'lastname', 'numero_de_medidor')
+
+_VALORES_NUEVOS = (
+    "new.contrato, new.address, new.name || ' ' || new.lastname, coalesce(new.numero_de_medidor, '')"
+)
+
+SQL_INDICE = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_BUSQUEDA}
+        USING fts5(contrato, address, nombre, numero_de_medidor, tokenize='trigram')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA_BUSQUEDA}_ai AFTER INSERT ON acueducto_useracueducto BEGIN
+        INSERT INTO {TABLA_BUSQUEDA}(rowid, contrato, address, nombre, numero_de_medidor)
+        VALUES (new.id, {_VALORES_NUEVOS});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA_BUSQUEDA}_ad AFTER DELETE ON acueducto_useracueducto BEGIN
+        DELETE FROM {TABLA_BUSQUEDA} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLA_BUSQUEDA}_au
+        AFTER UPDATE OF id, contrato, address, name, lastname, numero_de_medidor ON acueducto_useracueducto BEGIN
+        DELETE FROM {TABLA_BUSQUEDA} WHERE rowid = old.id;
+        INSERT INTO {TABLA_BUSQUEDA}(rowid, contrato, address, nombre, numero_de_medidor)
+        VALUES (new.id, {_VALORES_NUEVOS});
+    END""",
+]
+_OBJETOS_INDICE = [TABLA_BUSQUEDA, f'{TABLA_BUSQUEDA}_ai', f'{TABLA_BUSQUEDA}_ad', f'{TABLA_BUSQUEDA}_au']
+
+# Coincidencias que se ordenan por relevancia. Ordenar todo el resultado (p. ej. con bm25)
+# obliga a puntuar cada coincidencia: un término común como "calle" cuesta decenas de ms con
+# 100k usuarios, mientras que leer las primeras N coincidencias del índice toma ~1 ms.
+VENTANA_CANDIDATOS = 200
+
+_disponible = {}
+
+
+def instalar_indice(using='default') -> bool:
+    """
+    Crea la tabla FTS5 y sus triggers si faltan, y la reconstruye si hubo que crear algo.
+    Se llama en post_migrate porque cuando una migración reconstruye acueducto_useracueducto
+    (ALTER en SQLite = copiar la tabla) los triggers se pierden con la tabla vieja.
+    """
+    connection = connections[using]
+    _disponible.pop(using, None)
+    if connection.vendor != 'sqlite' or 'acueducto_useracueducto' not in connection.introspection.table_names():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name IN (%s)" % ', '.join(['%s'] * len(_OBJETOS_INDICE)),
+            _OBJETOS_INDICE
+        )
+        existentes = {fila[0] for fila in cursor.fetchall()}
+        if existentes == set(_OBJETOS_INDICE):
+            return False
+        try:
+            for sql in SQL_INDICE:
+                cursor.execute(sql)
+        except DatabaseError:
+            # SQLite compilado sin FTS5 o sin el tokenizador trigram (anterior a 3.34)
+            return False
+    reconstruir_indice(using)
+    return True
+
+
+def reconstruir_indice(using='default') -> int:
+    """Vuelve a cargar el índice desde acueducto_useracueducto; devuelve los usuarios indexados"""
+    if not indice_disponible(using):
+        return 0
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA_BUSQUEDA}")
+        cursor.execute(
+            f"""INSERT INTO {TABLA_BUSQUEDA}(rowid, contrato, address, nombre, numero_de_medidor)
+                SELECT id, contrato, address, name || ' ' || lastname, coalesce(numero_de_medidor, '')
+                FROM acueducto_useracueducto"""
+        )
+        cursor.execute(f"SELECT count(*) FROM {TABLA_BUSQUEDA}")
+        return cursor.fetchone()[0]
+
+
+def indice_disponible(using='default') -> bool:
+    if using not in _disponible:
+        connection = connections[using]
+        _disponible[using] = (
+            connection.vendor == 'sqlite'
+            and TABLA_BUSQUEDA in connection.introspection.table_names()
+        )
+    return _disponible[using]
+
+
+def _expresion_fts(texto: str) -> str:
+    # Como frase entre comillas el texto se busca como subcadena, sin sintaxis de consulta FTS5
+    return '"%s"' % texto.replace('"', '""')
+
+
+def _usa_indice(texto: str) -> bool:
+    return len(texto) >= MIN_CARACTERES_INDICE and indice_disponible()
+
+
+def filtrar_usuarios(usuarios, texto: str):
+    """Filtra un queryset de UserAcueducto por contrato, dirección, nombre o medidor"""
+    texto = texto.strip()
+    if not texto:
+        return usuarios
+    if _usa_indice(texto):
+        return usuarios.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {TABLA_BUSQUEDA} WHERE {TABLA_BUSQUEDA} MATCH %s",
+            [_expresion_fts(texto)]
+        ))
+    condicion = Q()
+    for campo in CAMPOS_BUSQUEDA:
+        condicion |= Q(**{f'{campo}__icontains': texto})
+    return usuarios.filter(condicion)
+
+
+def _relevancia(texto, contrato, numero_de_medidor):
+    texto = texto.lower()
+    contrato = contrato.lower()
+    if contrato == texto:
+        return 0
+    if contrato.startswith(texto):
+        return 1
+    if texto in contrato or texto in numero_de_medidor.lower():
+        return 2
+    # Coincide en la dirección o el nombre
+    return 3
+
+
+def buscar_usuarios(texto: str, limite: int = 10) -> list:
+    """
+    Usuarios que coinciden con `texto`, los más relevantes primero: contrato exacto, contrato
+    que empieza por el texto, coincidencia en contrato o medidor y por último en dirección o
+    nombre. Se ordenan las primeras VENTANA_CANDIDATOS coincidencias del índice, más el contrato
+    exacto que se busca aparte por su índice único.
+    """
+    texto = texto.strip()
+    if not texto:
+        return []
+
+    if _usa_indice(texto):
+        with connections['default'].cursor() as cursor:
+            cursor.execute(
+                f"""SELECT rowid, contrato, numero_de_medidor FROM {TABLA_BUSQUEDA}
+                    WHERE {TABLA_BUSQUEDA} MATCH %s LIMIT %s""",
+                [_expresion_fts(texto), VENTANA_CANDIDATOS]
+            )
+            candidatos = {fila[0]: (fila[1], fila[2]) for fila in cursor.fetchall()}
+    else:
+        candidatos = {
+            fila[0]: (fila[1], fila[2] or '')
+            for fila in filtrar_usuarios(UserAcueducto.objects.all(), texto)
+            .values_list('id', 'contrato', 'numero_de_medidor')[:VENTANA_CANDIDATOS]
+        }
+    exacto = UserAcueducto.objects.filter(contrato=texto).values_list('id', 'contrato').first()
+    if exacto:
+        candidatos[exacto[0]] = (exacto[1], '')
+
+    ids = sorted(
+        candidatos,
+        key=lambda id_usuario: (_relevancia(texto, *candidatos[id_usuario]), candidatos[id_usuario][0])
+    )[:limite]
+    por_id = UserAcueducto.objects.in_bulk(ids)
+    return [por_id[id_usuario] for id_usuario in ids if id_usuario in por_id]
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+
+# Caché en disco de PDFs de facturas direccionada por contenido: la clave es un hash de
+# todo lo que cambia el PDF (datos del usuario, últimas lecturas, período, fecha de
+# emisión y versión de la plantilla), así que una entrada nunca queda desactualizada;
+# a lo sumo queda huérfana hasta que la desaloja el LRU o la invalidación por señales.
+# Estructura: <FACTURAS_CACHE_DIR>/<usuario_id>/<sha256>.pdf
+
+_lock = threading.Lock()
+_tamano_estimado = None
+_version_plantilla = (None, None)
+
+
+def _directorio():
+    return str(settings.FACTURAS_CACHE_DIR)
+
+
+def _max_bytes():
+    return getattr(settings, 'FACTURAS_CACHE_MAX_BYTES', 0)
+
+
+def cache_habilitada() -> bool:
+    return bool(getattr(settings, 'FACTURAS_CACHE_DIR', None)) and _max_bytes() > 0
+
+
+def version_plantilla(recursos, firma) -> str:
+    """Hash del contenido de la plantilla y los estáticos de la factura; se recalcula solo si cambia `firma`"""
+    global _version_plantilla
+    firma_guardada, version = _version_plantilla
+    if firma_guardada != firma:
+        digest = hashlib.sha256()
+        for ruta in recursos:
+            if os.path.exists(ruta):
+                with open(ruta, 'rb') as recurso:
+                    digest.update(recurso.read())
+        version = digest.hexdigest()
+        _version_plantilla = (firma, version)
+    return version
+
+
+def clave_factura(usuario, historico_lecturas, fecha_emision, periodo_facturacion, version, liquidacion=None,
+                  consumos_mensuales=()) -> str:
+    """
+    Clave de la factura a partir de los datos que aparecen en el PDF. `liquidacion` lleva los
+    valores que dependen de la tarifa (settings), que no están en el usuario ni en las lecturas;
+    `consumos_mensuales` los meses del gráfico.
+    """
+    # La plantilla solo muestra la fecha de emisión, no la hora
+    if isinstance(fecha_emision, datetime):
+        fecha_emision = fecha_emision.date()
+    partes = [version, str(periodo_facturacion), str(fecha_emision)]
+    partes.extend(
+        f'{campo.attname}={getattr(usuario, campo.attname)!r}'
+        for campo in usuario._meta.concrete_fields
+    )
+    partes.extend(
+        f'lectura={lectura.pk}|{lectura.fecha_lectura}|{lectura.lectura!r}'
+        for lectura in historico_lecturas
+    )
+    partes.extend(
+        f'consumo={consumo.periodo}|{consumo.lectura!r}|{consumo.consumo!r}'
+        for consumo in consumos_mensuales
+    )
+    if liquidacion is not None:
+        partes.append(f'liquidacion={tuple(liquidacion)!r}')
+    return hashlib.sha256('\n'.join(partes).encode('utf-8')).hexdigest()
+
+
+def _ruta(usuario_id, clave):
+    return os.path.join(_directorio(), str(usuario_id), f'{clave}.pdf')
+
+
+def _marcar_uso(ruta):
+    # mtime con la hora de alta resolución: la del sistema de archivos puede repetirse entre escrituras seguidas
+    ahora = time.time_ns()
+    os.utime(ruta, ns=(ahora, ahora))
+
+
+def obtener(usuario_id, clave):
+    """Devuelve los bytes del PDF cacheado o None; un acierto lo marca como usado recientemente"""
+    ruta = _ruta(usuario_id, clave)
+    try:
+        with open(ruta, 'rb') as pdf:
+            contenido = pdf.read()
+        _marcar_uso(ruta)
+    except OSError:
+        return None
+    return contenido
+
+
+def guardar(usuario_id, clave, pdf_bytes):
+    """Guarda el PDF y desaloja los menos usados si la caché supera FACTURAS_CACHE_MAX_BYTES"""
+    global _tamano_estimado
+    ruta = _ruta(usuario_id, clave)
+    temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(temporal, 'wb') as pdf:
+            pdf.write(pdf_bytes)
+        # os.replace es atómico: otro proceso del pool nunca lee un PDF a medio escribir
+        os.replace(temporal, ruta)
+        _marcar_uso(ruta)
+    except OSError:
+        # Una caché que no se puede escribir no debe impedir entregar la factura
+        if os.path.exists(temporal):
+            os.unlink(temporal)
+        return
+
+    with _lock:
+        if _tamano_estimado is None:
+            _tamano_estimado = _tamano_total()
+        else:
+            _tamano_estimado += len(pdf_bytes)
+        if _tamano_estimado > _max_bytes():
+            _tamano_estimado = _desalojar(_max_bytes())
+
+
+def _entradas():
+    entradas = []
+    for raiz, _, archivos in os.walk(_directorio()):
+        for nombre in archivos:
+            if not nombre.endswith('.pdf'):
+                continue
+            try:
+                stat = os.stat(os.path.join(raiz, nombre))
+            except OSError:
+                continue
+            entradas.append((stat.st_mtime_ns, stat.st_size, os.path.join(raiz, nombre)))
+    return entradas
+
+
+def _tamano_total():
+    return sum(tamano for _, tamano, _ in _entradas())
+
+
+def _desalojar(max_bytes):
+    """Borra los PDFs usados hace más tiempo hasta quedar dentro del límite; devuelve el tamaño final"""
+    entradas = sorted(_entradas())
+    total = sum(tamano for _, tamano, _ in entradas)
+    for _, tamano, ruta in entradas:
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(ruta)
+        except OSError:
+            continue
+        total -= tamano
+    return total
+
+
+def invalidar_usuario(usuario_id):
+    """Elimina los PDFs cacheados de un usuario (lo llaman las señales de UserAcueducto e HistoricoLectura)"""
+    global _tamano_estimado
+    if not cache_habilitada() or usuario_id is None:
+        return
+    shutil.rmtree(os.path.join(_directorio(), str(usuario_id)), ignore_errors=True)
+    with _lock:
+        # Se recalcula en el próximo guardado
+        _tamano_estimado = None
+
+
+def limpiar():
+    global _tamano_estimado
+    shutil.rmtree(_directorio(), ignore_errors=True)
+    with _lock:
+        _tamano_estimado = None
@@ -0,0 +1,138 @@
+from datetime import date
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import OuterRef, Subquery
+
+from .models import ConsumoMensual, HistoricoLectura, UserAcueducto
+
+# Tabla materializada de consumo mensual (ConsumoMensual). Una lectura nueva del mes en curso
+# solo toca la fila de su mes: dos consultas (una sola para la lectura de hoy que registra
+# registrar_lectura_service). Una lectura atrasada, editada o eliminada, y los
+# lotes de lecturas, recalculan desde su mes las filas de los usuarios afectados con
+# recalcular_consumos, que hace las mismas pocas consultas para uno o para miles de usuarios.
+
+# Usuarios por bloque al recalcular muchos usuarios (toda la tabla o un lote importado)
+USUARIOS_POR_BLOQUE = 2000
+TAMANO_LOTE = 1000
+
+
+def inicio_mes(fecha) -> date:
+    return date(fecha.year, fecha.month, 1)
+
+
+def _consumo(lectura, anterior):
+    # Las lecturas tienen a lo sumo tres decimales; se descarta el error de la resta en float
+    return round(lectura - anterior, 3) if anterior is not None else None
+
+
+def registrar_lectura(lectura: HistoricoLectura):
+    """Actualiza el mes de una lectura recién creada"""
+    periodo = inicio_mes(lectura.fecha_lectura)
+    ultimos = list(ConsumoMensual.objects.filter(usuario_id=lectura.usuario_id).order_by('-periodo')[:2])
+    if ultimos and ultimos[0].periodo > periodo:
+        # Lectura atrasada: también cambia el consumo del mes siguiente
+        recalcular_consumos([lectura.usuario_id], lectura.fecha_lectura)
+        return
+
+    if ultimos and ultimos[0].periodo == periodo:
+        actual = ultimos[0]
+        if lectura.fecha_lectura < actual.fecha_lectura:
+            # No es la última lectura del mes: el mes no cambia
+            return
+        anterior = ultimos[1].lectura if len(ultimos) > 1 else None
+        ConsumoMensual.objects.filter(pk=actual.pk).update(
+            lectura=lectura.lectura, fecha_lectura=lectura.fecha_lectura, consumo=_consumo(lectura.lectura, anterior)
+        )
+        return
+
+    anterior = ultimos[0].lectura if ultimos else None
+    try:
+        with transaction.atomic():
+            ConsumoMensual.objects.create(
+                usuario_id=lectura.usuario_id, periodo=periodo, lectura=lectura.lectura,
+                fecha_lectura=lectura.fecha_lectura, consumo=_consumo(lectura.lectura, anterior)
+            )
+    except IntegrityError:
+        # Otra lectura del mismo usuario creó el mes entre la consulta y el insert
+        recalcular_consumos([lectura.usuario_id], lectura.fecha_lectura)
+
+
+def registrar_lectura_actual(lectura: HistoricoLectura):
+    """
+    Variante de registrar_lectura para la lectura de hoy, que es la más reciente del usuario:
+    un solo INSERT ... ON CONFLICT crea o actualiza la fila de su mes y toma el consumo de la
+    lectura del último mes anterior en la misma sentencia. Fuera de SQLite usa registrar_lectura.
+    """
+    if connection.vendor != 'sqlite':
+        registrar_lectura(lectura)
+        return
+    tabla = connection.ops.quote_name(ConsumoMensual._meta.db_table)
+    periodo = inicio_mes(lectura.fecha_lectura)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {tabla} (usuario_id, periodo, lectura, fecha_lectura, consumo)
+            VALUES (%s, %s, %s, %s, ROUND(%s - (
+                SELECT lectura FROM {tabla} WHERE usuario_id = %s AND periodo < %s
+                ORDER BY periodo DESC LIMIT 1
+            ), 3))
+            ON CONFLICT (usuario_id, periodo) DO UPDATE SET
+                lectura = excluded.lectura, fecha_lectura = excluded.fecha_lectura, consumo = excluded.consumo
+            WHERE excluded.fecha_lectura >= {tabla}.fecha_lectura
+            """,
+            [lectura.usuario_id, periodo, lectura.lectura, lectura.fecha_lectura,
+             lectura.lectura, lectura.usuario_id, periodo],
+        )
+
+
+def recalcular_consumos(usuario_ids=None, desde=None) -> int:
+    """
+    Vuelve a calcular desde HistoricoLectura las filas de ConsumoMensual de `usuario_ids`
+    (todos si es None) por bloques de USUARIOS_POR_BLOQUE a partir del mes de `desde`
+    (todo el histórico si es None). Devuelve el número de filas escritas.
+    """
+    if usuario_ids is None:
+        usuario_ids = UserAcueducto.objects.order_by('pk').values_list('pk', flat=True)
+    usuario_ids = sorted(set(usuario_ids))
+    if len(usuario_ids) > USUARIOS_POR_BLOQUE:
+        return sum(
+            recalcular_consumos(usuario_ids[inicio:inicio + USUARIOS_POR_BLOQUE], desde)
+            for inicio in range(0, len(usuario_ids), USUARIOS_POR_BLOQUE)
+        )
+    if not usuario_ids:
+        return 0
+    lecturas = HistoricoLectura.objects.filter(usuario_id__in=usuario_ids)
+    filas = ConsumoMensual.objects.filter(usuario_id__in=usuario_ids)
+    anteriores = {}
+    if desde is not None:
+        periodo_desde = inicio_mes(desde)
+        lecturas = lecturas.filter(fecha_lectura__gte=periodo_desde)
+        filas = filas.filter(periodo__gte=periodo_desde)
+        # Lectura del último mes anterior de cada usuario, de la misma tabla
+        ultima_anterior = ConsumoMensual.objects.filter(
+            usuario=OuterRef('pk'), periodo__lt=periodo_desde
+        ).order_by('-periodo').values('lectura')[:1]
+        anteriores = dict(
+            UserAcueducto.objects.filter(pk__in=usuario_ids)
+            .annotate(lectura_anterior=Subquery(ultima_anterior)).values_list('pk', 'lectura_anterior')
+        )
+
+    # Ordenadas por usuario y fecha: la última fila de cada (usuario, mes) es la lectura del mes
+    ultimas = {}
+    for usuario_id, fecha_lectura, lectura in lecturas.order_by('usuario_id', 'fecha_lectura', 'id').values_list(
+        'usuario_id', 'fecha_lectura', 'lectura'
+    ).iterator(chunk_size=TAMANO_LOTE):
+        ultimas[usuario_id, inicio_mes(fecha_lectura)] = (fecha_lectura, lectura)
+
+    nuevas = []
+    for (usuario_id, periodo), (fecha_lectura, lectura) in ultimas.items():
+        nuevas.append(ConsumoMensual(
+            usuario_id=usuario_id, periodo=periodo, lectura=lectura, fecha_lectura=fecha_lectura,
+            consumo=_consumo(lectura, anteriores.get(usuario_id))
+        ))
+        anteriores[usuario_id] = lectura
+
+    with transaction.atomic():
+        filas.delete()
+        ConsumoMensual.objects.bulk_create(nuevas, batch_size=TAMANO_LOTE)
+    return len(nuevas)
@@ -0,0 +1,171 @@
+import csv
+import io
+import re
+import zipfile
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from .models import ConsumoMensual, HistoricoLectura, UserAcueducto
+from . import facturacion
+from .consumos import inicio_mes
+from .utils import ZipStreamBuffer
+
+# Exportaciones en CSV y XLSX que se generan mientras se envían: las filas salen de la base de
+# datos con .iterator(chunk_size=TAMANO_BLOQUE) y se entregan en trozos de FILAS_POR_TROZO filas,
+# así que la memoria no depende del número de usuarios ni de lecturas. El XLSX se escribe a
+# mano (XML de la hoja dentro de un ZIP sin seek, como el ZIP de facturas) para no agregar una
+# dependencia.
+
+TAMANO_BLOQUE = 2000
+FILAS_POR_TROZO = 500
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def filas_usuarios(desde=None):
+    """Todos los usuarios ordenados por contrato (`desde` no aplica)"""
+    yield ('Contrato', 'Nombre', 'Apellido', 'Email', 'Teléfono', 'Dirección', 'Categoría', 'Zona',
+           'Número de medidor', 'Lectura', 'Fecha última lectura', 'Crédito', 'Otros gastos')
+    yield from UserAcueducto.objects.order_by('contrato').values_list(
+        'contrato', 'name', 'lastname', 'email', 'phone', 'address', 'categoria', 'zona',
+        'numero_de_medidor', 'lectura', 'fecha_ultima_lectura', 'credito', 'otros_gastos_valor',
+    ).iterator(chunk_size=TAMANO_BLOQUE)
+
+
+def filas_lecturas(desde=None):
+    """Histórico completo (o desde la fecha `desde`) ordenado por usuario y fecha"""
+    yield ('Contrato', 'Fecha lectura', 'Lectura', 'Registrada')
+    lecturas = HistoricoLectura.objects.all()
+    if desde is not None:
+        lecturas = lecturas.filter(fecha_lectura__gte=desde)
+    yield from lecturas.order_by('usuario_id', 'fecha_lectura', 'id').values_list(
+        'usuario__contrato', 'fecha_lectura', 'lectura', 'fecha_creacion',
+    ).iterator(chunk_size=TAMANO_BLOQUE)
+
+
+def filas_facturacion(desde=None):
+    """
+    Valor facturado de cada usuario en cada mes de la tabla de consumo mensual, con la tarifa
+    de su categoría (facturacion.tarifa): cargo fijo más el valor del consumo del mes.
+    """
+    yield ('Contrato', 'Categoría', 'Mes', 'Lectura', 'Consumo', 'Cargo fijo', 'Valor m³', 'Valor consumo', 'Total')
+    consumos = ConsumoMensual.objects.all()
+    if desde is not None:
+        consumos = consumos.filter(periodo__gte=inicio_mes(desde))
+    tarifas = {}
+    for contrato, categoria, periodo, lectura, consumo in consumos.order_by('usuario_id', 'periodo').values_list(
+        'usuario__contrato', 'usuario__categoria', 'periodo', 'lectura', 'consumo',
+    ).iterator(chunk_size=TAMANO_BLOQUE):
+        if categoria not in tarifas:
+            tarifas[categoria] = facturacion.tarifa(categoria)
+        cargo_fijo, valor_m3 = tarifas[categoria]
+        valor = facturacion.valor_consumo(consumo, valor_m3)
+        yield (contrato, categoria, f'{periodo:%Y-%m}', lectura, consumo, cargo_fijo, valor_m3, valor, cargo_fijo + valor)
+
+
+EXPORTACIONES = {
+    'usuarios': filas_usuarios,
+    'lecturas': filas_lecturas,
+    'facturacion': filas_facturacion,
+}
+
+
+def _trozos(filas):
+    trozo = []
+    for fila in filas:
+        trozo.append(fila)
+        if len(trozo) >= FILAS_POR_TROZO:
+            yield trozo
+            trozo = []
+    if trozo:
+        yield trozo
+
+
+def csv_stream(filas):
+    """Texto CSV por trozos; empieza con BOM para que Excel reconozca el UTF-8"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    for trozo in _trozos(filas):
+        writer.writerows(trozo)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+# Caracteres de control que XML no admite
+_CONTROL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_XLSX_ESTATICOS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _celda_xlsx(valor) -> str:
+    if valor is None:
+        return '<c/>'
+    if isinstance(valor, (int, float, Decimal)) and not isinstance(valor, bool):
+        return f'<c><v>{valor}</v></c>'
+    texto = escape(_CONTROL_XML.sub('', str(valor)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def xlsx_stream(filas, hoja='Datos'):
+    """Bytes de un libro XLSX de una hoja por trozos; números como números y el resto como texto"""
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for nombre, contenido in _XLSX_ESTATICOS.items():
+            zip_file.writestr(nombre, contenido)
+        zip_file.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(hoja)}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+        ))
+        # force_zip64: el tamaño de la hoja no se conoce al abrir la entrada y puede pasar de 2 GB
+        with zip_file.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as hoja_xml:
+            hoja_xml.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            yield buffer.pop()
+            for trozo in _trozos(filas):
+                hoja_xml.write(''.join(
+                    f'<row>{"".join(map(_celda_xlsx, fila))}</row>' for fila in trozo
+                ).encode('utf-8'))
+                yield buffer.pop()
+            hoja_xml.write(b'</sheetData></worksheet>')
+        yield buffer.pop()
+    yield buffer.pop() # Directorio central
+
+
+def exportar(tipo: str, formato: str = 'csv', desde=None):
+    """Generador con el contenido de la exportación `tipo` (EXPORTACIONES) en `formato` (FORMATOS)"""
+    if tipo not in EXPORTACIONES:
+        raise ValueError(f'Exportación desconocida: {tipo}')
+    if formato not in FORMATOS:
+        raise ValueError(f'Formato desconocido: {formato}')
+    filas = EXPORTACIONES[tipo](desde)
+    return csv_stream(filas) if formato == 'csv' else xlsx_stream(filas, hoja=tipo.capitalize())
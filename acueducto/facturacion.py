@@ -0,0 +1,213 @@
+import math
+from array import array
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import compress, count, islice
+from operator import ne, sub
+
+from django.conf import settings
+from django.db.models import CharField, ExpressionWrapper, Field, IntegerField, Value
+from django.db.models.functions import Cast, Substr
+
+from .models import HistoricoLectura, UserAcueducto
+
+# Motor de facturación: las lecturas de todos los usuarios se cargan en columnas paralelas
+# (array de usuario, período y lectura) ordenadas por usuario y fecha, y el consumo de cada
+# período sale de restar la columna de lecturas desplazada una fila, en una sola pasada con
+# map() sobre los arrays; solo se corrige la primera fila de cada usuario, que no tiene
+# lectura anterior. La tarifa depende de la categoría del usuario (settings.FACTURACION_TARIFAS).
+# Lo usan las facturas (utils.contexto_factura), el histórico de lecturas y los reportes.
+
+# Filas que se traen de la base de datos por bloque al cargar las columnas
+TAMANO_BLOQUE = 20000
+SIN_CONSUMO = math.nan
+_CENTAVOS = Decimal('0.01')
+
+Liquidacion = namedtuple('Liquidacion', [
+    'lectura_actual', 'lectura_anterior', 'consumo', 'cargo_fijo', 'valor_m3',
+    'valor_consumo', 'credito', 'otros_gastos', 'total',
+])
+
+
+def tarifa(categoria: str) -> tuple[Decimal, Decimal]:
+    """(cargo fijo, valor por m³) de la categoría; las categorías sin tarifa usan la residencial"""
+    tarifas = settings.FACTURACION_TARIFAS
+    valores = tarifas.get(categoria) or tarifas['residencial']
+    return Decimal(str(valores['cargo_fijo'])), Decimal(str(valores['valor_m3']))
+
+
+def periodo(fecha) -> int:
+    """Período de facturación (mes) de una fecha, como meses desde el año 0"""
+    return fecha.year * 12 + fecha.month - 1
+
+
+def fecha_periodo(numero: int) -> tuple[int, int]:
+    """(año, mes) de un período devuelto por periodo()"""
+    return numero // 12, numero % 12 + 1
+
+
+class Columnas:
+    """
+    Lecturas en columnas paralelas ordenadas por usuario y fecha. `inicios` tiene la primera
+    fila de cada usuario, en el mismo orden que `usuario_ids`.
+    """
+
+    def __init__(self):
+        self.usuario = array('q')
+        self.periodo = array('l')
+        self.lectura = array('d')
+        self.inicios = []
+        self.usuario_ids = []
+
+    def __len__(self):
+        return len(self.lectura)
+
+    def extender(self, filas):
+        """Agrega filas (usuario_id, periodo, lectura) ya ordenadas por usuario y fecha"""
+        filas = list(filas)
+        if not filas:
+            return
+        usuarios, periodos, lecturas = zip(*filas)
+        self.usuario.extend(usuarios)
+        self.periodo.extend(periodos)
+        self.lectura.extend(lecturas)
+
+    def indexar(self):
+        """Calcula `inicios` y `usuario_ids` comparando la columna de usuarios consigo misma desplazada"""
+        if not self.usuario:
+            self.inicios, self.usuario_ids = [], []
+            return self
+        cambios = compress(count(1), map(ne, islice(self.usuario, 1, None), self.usuario))
+        self.inicios = [0, *cambios]
+        self.usuario_ids = [self.usuario[inicio] for inicio in self.inicios]
+        return self
+
+    @classmethod
+    def desde_lecturas(cls, lecturas):
+        """Columnas de lecturas ya cargadas (instancias de HistoricoLectura, en cualquier orden)"""
+        columnas = cls()
+        ordenadas = sorted(lecturas, key=lambda lectura: (lectura.usuario_id, lectura.fecha_lectura))
+        columnas.extender((lectura.usuario_id, periodo(lectura.fecha_lectura), lectura.lectura) for lectura in ordenadas)
+        return columnas.indexar()
+
+    def consumos(self) -> array:
+        """Consumo de cada fila frente a la lectura anterior del mismo usuario (NaN en la primera)"""
+        consumos = array('d', [SIN_CONSUMO])
+        consumos.extend(map(sub, islice(self.lectura, 1, None), self.lectura))
+        for inicio in self.inicios:
+            consumos[inicio] = SIN_CONSUMO
+        return consumos
+
+
+# Año y mes de fecha_lectura a partir del texto ISO (AAAA-MM-DD): en SQLite Extract* son
+# funciones Python que se llaman por fila
+_texto_fecha = Cast('fecha_lectura', CharField())
+_anio_fecha = Cast(Substr(_texto_fecha, 1, 4), IntegerField())
+_mes_fecha = Cast(Substr(_texto_fecha, 6, 2), IntegerField())
+# Con un Field genérico como tipo de salida Django no agrega un conversor int() por fila;
+# la base de datos ya devuelve un entero
+_periodo_fecha = ExpressionWrapper(_anio_fecha * Value(12) + _mes_fecha - Value(1), output_field=Field())
+
+
+def cargar_columnas(usuarios=None, desde=None) -> Columnas:
+    """
+    Lecturas de todos los usuarios (o del queryset `usuarios`) desde la fecha `desde`, en una
+    consulta recorrida por bloques de TAMANO_BLOQUE filas. El período se calcula en SQL: las
+    columnas resultantes no tienen conversores de Django, que son lo más caro por fila.
+    """
+    lecturas = HistoricoLectura.objects.all()
+    if usuarios is not None:
+        lecturas = lecturas.filter(usuario__in=usuarios)
+    if desde is not None:
+        lecturas = lecturas.filter(fecha_lectura__gte=desde)
+    filas = lecturas.order_by('usuario_id', 'fecha_lectura', 'id').values_list(
+        'usuario_id',
+        _periodo_fecha,
+        'lectura',
+    ).iterator(chunk_size=TAMANO_BLOQUE)
+
+    columnas = Columnas()
+    while bloque := list(islice(filas, TAMANO_BLOQUE)):
+        columnas.extender(bloque)
+    return columnas.indexar()
+
+
+def _dinero(valor) -> Decimal:
+    return Decimal(valor).quantize(_CENTAVOS, rounding=ROUND_HALF_UP)
+
+
+def valor_consumo(consumo, valor_m3: Decimal) -> Decimal:
+    """Valor de un consumo en m³; un consumo negativo (medidor cambiado o reiniciado) o desconocido no se cobra"""
+    return _dinero(Decimal(repr(max(consumo, 0.0))) * valor_m3) if consumo is not None else _dinero(0)
+
+
+def _liquidar(lectura_actual, lectura_anterior, consumo, categoria, credito, otros_gastos) -> Liquidacion:
+    cargo_fijo, valor_m3 = tarifa(categoria)
+    credito, otros_gastos = _dinero(credito or 0), _dinero(otros_gastos or 0)
+    valor = valor_consumo(consumo, valor_m3)
+    return Liquidacion(
+        lectura_actual, lectura_anterior, consumo, cargo_fijo, valor_m3, valor,
+        credito, otros_gastos, cargo_fijo + valor + credito + otros_gastos,
+    )
+
+
+def liquidar(columnas: Columnas, usuarios) -> dict:
+    """
+    Liquidación del último período de cada usuario: `usuarios` son instancias (o filas con
+    id, lectura, categoria, credito y otros_gastos_valor). Devuelve {usuario_id: Liquidacion}.
+    La lectura actual es la última del histórico; sin histórico, la del usuario.
+    """
+    consumos = columnas.consumos()
+    finales = [fin - 1 for fin in islice(columnas.inicios, 1, None)]
+    if columnas.inicios:
+        finales.append(len(columnas) - 1)
+    ultima = dict(zip(columnas.usuario_ids, finales))
+
+    liquidaciones = {}
+    for usuario in usuarios:
+        fila = ultima.get(usuario.id)
+        if fila is None:
+            lectura_actual, lectura_anterior, consumo = usuario.lectura, None, None
+        else:
+            lectura_actual = columnas.lectura[fila]
+            consumo = consumos[fila]
+            if math.isnan(consumo):
+                lectura_anterior = consumo = None
+            else:
+                # Las lecturas tienen a lo sumo tres decimales; se descarta el error de la resta en float
+                lectura_anterior, consumo = columnas.lectura[fila - 1], round(consumo, 3)
+        liquidaciones[usuario.id] = _liquidar(
+            lectura_actual, lectura_anterior, consumo, usuario.categoria, usuario.credito, usuario.otros_gastos_valor
+        )
+    return liquidaciones
+
+
+def liquidar_usuario(usuario, lecturas) -> Liquidacion:
+    """Liquidación de un usuario con sus lecturas ya cargadas (p. ej. las de la factura)"""
+    return liquidar(Columnas.desde_lecturas(lecturas), [usuario])[usuario.id]
+
+
+def liquidar_todos(usuarios=None, desde=None) -> dict:
+    """Liquidación de todos los usuarios (o del queryset `usuarios`) en dos consultas"""
+    columnas = cargar_columnas(usuarios, desde)
+    if usuarios is None:
+        usuarios = UserAcueducto.objects.all()
+    usuarios = usuarios.only('id', 'lectura', 'categoria', 'credito', 'otros_gastos_valor')
+    return liquidar(columnas, usuarios.iterator(chunk_size=TAMANO_BLOQUE))
+
+
+def consumo_por_periodo(columnas: Columnas, categorias: dict | None = None) -> dict:
+    """
+    Consumo total por período: {periodo: m³}, o {(categoria, periodo): m³} si se pasa
+    `categorias` {usuario_id: categoria}. Los consumos negativos no suman.
+    """
+    totales = {}
+    consumos = columnas.consumos()
+    if categorias is None:
+        claves = columnas.periodo
+    else:
+        claves = zip(map(categorias.get, columnas.usuario), columnas.periodo)
+    for clave, consumo in zip(claves, consumos):
+        if consumo > 0:
+            totales[clave] = totales.get(clave, 0.0) + consumo
+    return totales
@@ -7,13 +7,16 @@ class UserAcueductoForm(forms.ModelForm):
         fields = [
             'contrato', 'fecha_ultima_lectura', 'name', 'lastname', 'email', 'phone',
             'address', 'lectura', 'categoria', 'zona', 'credito',
-            'credito_descripcion', 'otros_gastos_valor', 'otros_gastos_descripcion'
+            'credito_descripcion', 'otros_gastos_valor', 'otros_gastos_descripcion',
+            'latitud', 'longitud'
         ]
         widgets = {
             'fecha_ultima_lectura': forms.DateInput(attrs={'type': 'date'}),
             'lectura': forms.NumberInput(attrs={'step': 'any'}), # Allows decimal input
             'credito': forms.NumberInput(attrs={'step': 'any'}),
             'otros_gastos_valor': forms.NumberInput(attrs={'step': 'any'}),
+            'latitud': forms.NumberInput(attrs={'step': 'any'}),
+            'longitud': forms.NumberInput(attrs={'step': 'any'}),
         }
 
     def __init__(self, *args, **kwargs):
@@ -26,7 +29,8 @@ class UserAcueductoForm(forms.ModelForm):
         optional_fields = [
             'fecha_ultima_lectura', 'phone', 'address', 'lectura', 'zona',
             'credito', 'credito_descripcion',
-            'otros_gastos_valor', 'otros_gastos_descripcion'
+            'otros_gastos_valor', 'otros_gastos_descripcion',
+            'latitud', 'longitud'
         ]
         # Fields that are mandatory
         required_fields = ['contrato', 'name', 'lastname', 'email', 'categoria']
@@ -0,0 +1,347 @@
+import csv
+import itertools
+import unicodedata
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .models import ConsumoMensual, HistoricoLectura, UserAcueducto
+from . import consumos as consumos_mensuales
+
+# Importación masiva de usuarios y de lecturas históricas desde CSV. El archivo se lee fila por
+# fila y se procesa en lotes de TAMANO_LOTE: cada fila se valida con los campos del modelo (sin
+# consultas) y la unicidad de contrato, email y número de medidor se comprueba contra conjuntos,
+# los del archivo y los que devuelven tres consultas por lote. Cada lote se guarda en su
+# transacción con bulk_create y un UPDATE por contrato existente (executemany), así que un
+# error de una fila no detiene la importación: queda en el resumen con su número de fila.
+
+TAMANO_LOTE = 1000
+# Errores que se guardan en el resumen; el resto solo se cuenta
+MAX_ERRORES = 1000
+
+# Encabezados aceptados (sin tildes, en minúsculas y con _ en lugar de espacios) para cada
+# campo de UserAcueducto; incluye los de la exportación de usuarios
+COLUMNAS_USUARIO = {
+    'contrato': 'contrato',
+    'nombre': 'name', 'name': 'name',
+    'apellido': 'lastname', 'lastname': 'lastname',
+    'email': 'email', 'correo': 'email',
+    'telefono': 'phone', 'phone': 'phone',
+    'direccion': 'address', 'address': 'address',
+    'categoria': 'categoria',
+    'zona': 'zona',
+    'numero_de_medidor': 'numero_de_medidor', 'medidor': 'numero_de_medidor',
+    'lectura': 'lectura',
+    'fecha_ultima_lectura': 'fecha_ultima_lectura',
+    'credito': 'credito', 'credito_descripcion': 'credito_descripcion',
+    'otros_gastos': 'otros_gastos_valor', 'otros_gastos_valor': 'otros_gastos_valor',
+    'otros_gastos_descripcion': 'otros_gastos_descripcion',
+    'latitud': 'latitud', 'longitud': 'longitud',
+}
+# Columnas sin las que no se puede crear un usuario (email es único y no admite vacíos)
+OBLIGATORIAS_USUARIO = ('contrato', 'name', 'lastname', 'email')
+COLUMNAS_LECTURA = {
+    'contrato': 'contrato',
+    'fecha_lectura': 'fecha_lectura', 'fecha': 'fecha_lectura',
+    'lectura': 'lectura',
+}
+_CAMPOS_NUMERICOS = (models.FloatField, models.DecimalField)
+
+
+def _normalizar(encabezado: str) -> str:
+    sin_tildes = unicodedata.normalize('NFKD', encabezado).encode('ascii', 'ignore').decode('ascii')
+    return '_'.join(sin_tildes.strip().lower().split())
+
+
+def leer_csv(archivo, columnas: dict, obligatorias=('contrato',)):
+    """
+    Recorre un CSV de texto (separado por comas o por punto y coma, según el encabezado) y
+    produce (número de fila, {campo: valor}) con los encabezados traducidos por `columnas`;
+    las columnas desconocidas se ignoran. Todas las filas traen todos los campos del
+    encabezado ('' si la fila es más corta). Lanza ValueError si falta alguna de `obligatorias`.
+    """
+    primera = archivo.readline()
+    separador = ';' if primera.count(';') > primera.count(',') else ','
+    lector = csv.reader(itertools.chain([primera], archivo), delimiter=separador)
+    encabezados = [columnas.get(_normalizar(encabezado)) for encabezado in next(lector, [])]
+    faltantes = [campo for campo in obligatorias if campo not in encabezados]
+    if faltantes:
+        raise ValueError(f'Faltan columnas obligatorias: {", ".join(faltantes)}')
+    posiciones = [(campo, posicion) for posicion, campo in enumerate(encabezados) if campo]
+    for numero, valores in enumerate(lector, start=2):
+        if not any(valor.strip() for valor in valores):
+            continue
+        yield numero, {
+            campo: valores[posicion].strip() if posicion < len(valores) else ''
+            for campo, posicion in posiciones
+        }
+
+
+def _decimal(valor: str) -> str:
+    # Decimales con coma (1500,50), como los exporta Excel en español
+    return valor.replace(',', '.') if ',' in valor and '.' not in valor else valor
+
+
+def _limpiar_usuario(datos: dict) -> dict:
+    """Valores de UserAcueducto validados con los campos del modelo; lanza ValidationError"""
+    limpios, errores = {}, []
+    for nombre, valor in datos.items():
+        campo = UserAcueducto._meta.get_field(nombre)
+        if nombre == 'categoria':
+            valor = valor.lower()
+        if valor == '':
+            valor = None if campo.null else (campo.get_default() if campo.has_default() else '')
+        elif isinstance(campo, _CAMPOS_NUMERICOS):
+            valor = _decimal(valor)
+        try:
+            limpios[nombre] = campo.clean(valor, None)
+        except ValidationError as e:
+            errores.extend(f'{nombre}: {mensaje}' for mensaje in e.messages)
+    if errores:
+        raise ValidationError(errores)
+    return limpios
+
+
+def _nuevo_resumen() -> dict:
+    return {'filas': 0, 'creados': 0, 'actualizados': 0, 'duplicados': 0, 'con_error': 0, 'errores': []}
+
+
+def _registrar_error(resumen, fila, contrato, error):
+    resumen['con_error'] += 1
+    if len(resumen['errores']) < MAX_ERRORES:
+        resumen['errores'].append({'fila': fila, 'contrato': contrato, 'error': error})
+
+
+class _Unicos:
+    """Dueño (contrato) de cada valor único visto en el archivo, para email y medidor"""
+
+    def __init__(self):
+        self.email = {}
+        self.numero_de_medidor = {}
+
+
+def _actualizar_usuarios(cambios: list, campos: list):
+    """
+    UPDATE de una fila por usuario con executemany. bulk_update arma un CASE por campo con
+    un WHEN por fila, y construir esas expresiones cuesta más que la escritura.
+    """
+    campos = [UserAcueducto._meta.get_field(campo) for campo in campos]
+    nombre = connection.ops.quote_name
+    sql = (
+        f'UPDATE {nombre(UserAcueducto._meta.db_table)} '
+        f'SET {", ".join(f"{nombre(campo.column)} = %s" for campo in campos)} '
+        f'WHERE {nombre(UserAcueducto._meta.pk.column)} = %s'
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [campo.get_db_prep_save(datos[campo.name], connection) for campo in campos] + [pk]
+            for pk, datos in cambios
+        ])
+
+
+def _importar_lote_usuarios(lote, resumen, vistos: _Unicos, actualizar: bool):
+    # Tres consultas por lote para los valores únicos que ya están en la base de datos
+    contratos = [datos['contrato'] for _, datos in lote]
+    existentes = dict(UserAcueducto.objects.filter(contrato__in=contratos).values_list('contrato', 'id'))
+    en_base = {
+        campo: dict(UserAcueducto.objects.filter(**{f'{campo}__in': [
+            datos[campo] for _, datos in lote if datos.get(campo)
+        ]}).values_list(campo, 'contrato'))
+        for campo in ('email', 'numero_de_medidor')
+    }
+
+    nuevos, cambios = [], []
+    for fila, datos in lote:
+        contrato = datos['contrato']
+        if contrato in existentes and not actualizar:
+            _registrar_error(resumen, fila, contrato, 'El contrato ya existe')
+            continue
+        conflictos = []
+        for campo in ('email', 'numero_de_medidor'):
+            valor = datos.get(campo)
+            dueno = valor and (getattr(vistos, campo).get(valor) or en_base[campo].get(valor))
+            if dueno and dueno != contrato:
+                conflictos.append(f'{campo}: {valor} ya pertenece al contrato {dueno}')
+        if conflictos:
+            _registrar_error(resumen, fila, contrato, '; '.join(conflictos))
+            continue
+        for campo in ('email', 'numero_de_medidor'):
+            if datos.get(campo):
+                getattr(vistos, campo)[datos[campo]] = contrato
+        if contrato in existentes:
+            cambios.append((fila, existentes[contrato], datos))
+        else:
+            nuevos.append((fila, UserAcueducto(**datos)))
+
+    # Se actualizan solo las columnas del archivo
+    campos = sorted({campo for _, datos in lote for campo in datos} - {'contrato'})
+    try:
+        with transaction.atomic():
+            _guardar_usuarios(nuevos, cambios, campos)
+    except IntegrityError:
+        # Una restricción que las validaciones no cubren (p. ej. dos contratos existentes que
+        # intercambian email): se guarda fila por fila para informar solo las que fallan
+        creados = actualizados = 0
+        for fila, usuario in nuevos:
+            try:
+                with transaction.atomic():
+                    _guardar_usuarios([(fila, usuario)], [], campos)
+                creados += 1
+            except IntegrityError as e:
+                _registrar_error(resumen, fila, usuario.contrato, f'No se pudo guardar: {e}')
+        for fila, pk, datos in cambios:
+            try:
+                with transaction.atomic():
+                    _guardar_usuarios([], [(fila, pk, datos)], campos)
+                actualizados += 1
+            except IntegrityError as e:
+                _registrar_error(resumen, fila, datos['contrato'], f'No se pudo guardar: {e}')
+    else:
+        creados, actualizados = len(nuevos), len(cambios)
+    resumen['creados'] += creados
+    resumen['actualizados'] += actualizados
+
+
+def _guardar_usuarios(nuevos: list, cambios: list, campos: list):
+    UserAcueducto.objects.bulk_create([usuario for _, usuario in nuevos])
+    if cambios and campos:
+        _actualizar_usuarios([(pk, datos) for _, pk, datos in cambios], campos)
+
+
+def importar_usuarios(archivo, actualizar: bool = False, progreso=None) -> dict:
+    """
+    Crea los usuarios de un CSV con encabezados (COLUMNAS_USUARIO). Con `actualizar`, un
+    contrato que ya existe se actualiza con las columnas del archivo (upsert por contrato);
+    sin él es un error de esa fila. `progreso(resumen)` se llama después de cada lote.
+    Devuelve {'filas', 'creados', 'actualizados', 'duplicados', 'con_error', 'errores'}.
+    """
+    resumen = _nuevo_resumen()
+    vistos = _Unicos()
+    contratos_archivo = set()
+    lote = []
+    for fila, datos in leer_csv(archivo, COLUMNAS_USUARIO, OBLIGATORIAS_USUARIO):
+        resumen['filas'] += 1
+        contrato = datos.get('contrato', '')
+        if contrato in contratos_archivo:
+            _registrar_error(resumen, fila, contrato, 'Contrato repetido en el archivo')
+            continue
+        try:
+            datos = _limpiar_usuario(datos)
+        except ValidationError as e:
+            _registrar_error(resumen, fila, contrato, '; '.join(e.messages))
+            continue
+        contratos_archivo.add(contrato)
+        lote.append((fila, datos))
+        if len(lote) >= TAMANO_LOTE:
+            _importar_lote_usuarios(lote, resumen, vistos, actualizar)
+            lote.clear()
+            if progreso:
+                progreso(resumen)
+    if lote:
+        _importar_lote_usuarios(lote, resumen, vistos, actualizar)
+    if progreso:
+        progreso(resumen)
+    return resumen
+
+
+def _fecha(valor: str) -> date:
+    for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(valor, formato).date()
+        except ValueError:
+            continue
+    raise ValueError('fecha_lectura inválida (AAAA-MM-DD o DD/MM/AAAA)')
+
+
+def _limpiar_lectura(datos: dict, hoy: date) -> tuple[date, float]:
+    fecha_lectura = _fecha(datos.get('fecha_lectura', ''))
+    if fecha_lectura > hoy:
+        raise ValueError('fecha_lectura no puede ser futura')
+    try:
+        lectura = float(_decimal(datos.get('lectura', '')))
+    except ValueError:
+        raise ValueError('lectura debe ser un número')
+    return fecha_lectura, lectura
+
+
+def _importar_lote_lecturas(lote, resumen, desde: dict):
+    usuarios = dict(UserAcueducto.objects.filter(
+        contrato__in={contrato for _, contrato, _, _ in lote}
+    ).values_list('contrato', 'id'))
+    # Una lectura del mismo usuario y fecha que ya está guardada no se vuelve a importar
+    guardadas = set(HistoricoLectura.objects.filter(
+        usuario_id__in=usuarios.values(),
+        fecha_lectura__in={fecha for _, _, fecha, _ in lote},
+    ).values_list('usuario_id', 'fecha_lectura'))
+
+    nuevas = []
+    for fila, contrato, fecha_lectura, lectura in lote:
+        if contrato not in usuarios:
+            _registrar_error(resumen, fila, contrato, 'Usuario no encontrado')
+            continue
+        usuario_id = usuarios[contrato]
+        if (usuario_id, fecha_lectura) in guardadas:
+            resumen['duplicados'] += 1
+            continue
+        guardadas.add((usuario_id, fecha_lectura))
+        nuevas.append(HistoricoLectura(usuario_id=usuario_id, fecha_lectura=fecha_lectura, lectura=lectura))
+        desde[usuario_id] = min(fecha_lectura, desde.get(usuario_id, fecha_lectura))
+
+    with transaction.atomic():
+        HistoricoLectura.objects.bulk_create(nuevas)
+    resumen['creados'] += len(nuevas)
+
+
+def _actualizar_ultimas_lecturas(usuario_ids: list):
+    """
+    Copia a UserAcueducto la lectura del último mes de ConsumoMensual (la lectura más reciente
+    del histórico) cuando no es anterior a su fecha_ultima_lectura: un UPDATE por bloque.
+    """
+    ultimo_mes = ConsumoMensual.objects.filter(usuario=OuterRef('pk')).order_by('-periodo')
+    fecha = Subquery(ultimo_mes.values('fecha_lectura')[:1])
+    for inicio in range(0, len(usuario_ids), consumos_mensuales.USUARIOS_POR_BLOQUE):
+        UserAcueducto.objects.filter(
+            Q(fecha_ultima_lectura__isnull=True) | Q(fecha_ultima_lectura__lte=fecha),
+            pk__in=usuario_ids[inicio:inicio + consumos_mensuales.USUARIOS_POR_BLOQUE],
+        ).update(lectura=Subquery(ultimo_mes.values('lectura')[:1]), fecha_ultima_lectura=fecha)
+
+
+def importar_lecturas(archivo, progreso=None) -> dict:
+    """
+    Importa lecturas históricas de un CSV con las columnas contrato, fecha_lectura y lectura.
+    Al terminar recalcula el consumo mensual de los usuarios y, desde él, su última lectura
+    (bulk_create no dispara las señales). Devuelve el mismo resumen que importar_usuarios;
+    'duplicados' son las lecturas que ya estaban guardadas para ese usuario y fecha.
+    """
+    resumen = _nuevo_resumen()
+    hoy = timezone.localdate()
+    # Fecha más antigua importada de cada usuario
+    desde = {}
+    lote = []
+    for fila, datos in leer_csv(archivo, COLUMNAS_LECTURA):
+        resumen['filas'] += 1
+        contrato = datos.get('contrato', '')
+        try:
+            fecha_lectura, lectura = _limpiar_lectura(datos, hoy)
+        except ValueError as e:
+            _registrar_error(resumen, fila, contrato, str(e))
+            continue
+        lote.append((fila, contrato, fecha_lectura, lectura))
+        if len(lote) >= TAMANO_LOTE:
+            _importar_lote_lecturas(lote, resumen, desde)
+            lote.clear()
+            if progreso:
+                progreso(resumen)
+    if lote:
+        _importar_lote_lecturas(lote, resumen, desde)
+
+    if desde:
+        with transaction.atomic():
+            consumos_mensuales.recalcular_consumos(list(desde), min(desde.values()))
+            _actualizar_ultimas_lecturas(sorted(desde))
+    if progreso:
+        progreso(resumen)
+    return resumen
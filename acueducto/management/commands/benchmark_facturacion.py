@@ -0,0 +1,103 @@
+import time
+import tracemalloc
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Prefetch
+
+from acueducto.models import HistoricoLectura, UserAcueducto
+from acueducto import facturacion
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el tiempo y la memoria pico de liquidar a todos los usuarios: el cálculo anterior '
+        '(lecturas como instancias del modelo y el consumo restando lectura por lectura, como '
+        'los filtros calcular_consumo y sub) frente al motor columnar de facturacion.py. Los '
+        'usuarios y lecturas de prueba se crean en una transacción que se revierte al terminar.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=100000, help='Usuarios de prueba')
+        parser.add_argument('--periodos', type=int, default=24, help='Lecturas mensuales por usuario')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._crear_datos(max(1, options['usuarios']), max(2, options['periodos']))
+                self._comparar()
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _crear_datos(self, cantidad, periodos):
+        inicio = time.perf_counter()
+        usuarios = UserAcueducto.objects.bulk_create([
+            UserAcueducto(
+                contrato=f'BENCH-{i:07d}', name='Usuario', lastname=f'{i}', email=f'bench{i}@example.com',
+                categoria='comercial' if i % 5 == 0 else 'residencial', lectura=periodos * 20.0,
+                credito=i % 3 * 1000, otros_gastos_valor=0,
+            )
+            for i in range(cantidad)
+        ], batch_size=2000)
+        if usuarios[0].pk is None:
+            usuarios = list(UserAcueducto.objects.filter(contrato__startswith='BENCH-').order_by('contrato'))
+        hoy = date.today()
+        lecturas = []
+        for usuario in usuarios:
+            acumulado = 0.0
+            for j in range(periodos):
+                mes = hoy.year * 12 + hoy.month - 1 - (periodos - 1 - j)
+                acumulado += 10 + (usuario.pk * 7 + j * 3) % 21
+                lecturas.append(HistoricoLectura(usuario=usuario, lectura=acumulado, fecha_lectura=date(mes // 12, mes % 12 + 1, 1)))
+            if len(lecturas) >= 50000:
+                HistoricoLectura.objects.bulk_create(lecturas, batch_size=5000)
+                lecturas.clear()
+        HistoricoLectura.objects.bulk_create(lecturas, batch_size=5000)
+        self.stdout.write(f'{cantidad} usuarios x {periodos} lecturas creados en {time.perf_counter() - inicio:.1f} s')
+
+    def _comparar(self):
+        usuarios = UserAcueducto.objects.filter(contrato__startswith='BENCH-')
+
+        def _anterior():
+            # Cada usuario con sus lecturas como instancias; consumo y total fila por fila
+            lecturas = Prefetch('lecturas', queryset=HistoricoLectura.objects.order_by('-fecha_lectura'))
+            resultados = {}
+            for usuario in usuarios.prefetch_related(lecturas).iterator(chunk_size=2000):
+                historico = list(usuario.lecturas.all())
+                consumos = [actual.lectura - anterior.lectura for actual, anterior in zip(historico, historico[1:])]
+                consumo = consumos[0] if consumos else 0
+                cargo_fijo, valor_m3 = facturacion.tarifa(usuario.categoria)
+                resultados[usuario.id] = (consumos, cargo_fijo + valor_m3 * Decimal(repr(max(consumo, 0)))
+                                          + usuario.credito + usuario.otros_gastos_valor)
+            return resultados
+
+        def _motor():
+            columnas = facturacion.cargar_columnas(usuarios)
+            filas = usuarios.only('id', 'lectura', 'categoria', 'credito', 'otros_gastos_valor')
+            categorias = dict(usuarios.values_list('id', 'categoria'))
+            return (facturacion.liquidar(columnas, filas.iterator(chunk_size=facturacion.TAMANO_BLOQUE)),
+                    facturacion.consumo_por_periodo(columnas, categorias))
+
+        resultados = []
+        for nombre, funcion in (('Instancias fila por fila', _anterior), ('Motor columnar', _motor)):
+            # El tiempo se mide sin tracemalloc, que hace más lento el código que asigna memoria
+            inicio = time.perf_counter()
+            funcion()
+            ms = (time.perf_counter() - inicio) * 1000
+            tracemalloc.start()
+            funcion()
+            _, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            resultados.append((ms, pico))
+            self.stdout.write(f'  {nombre:<26} {ms:10.0f} ms {pico / 1024 / 1024:9.1f} MB pico')
+        (ms_anterior, pico_anterior), (ms_motor, pico_motor) = resultados
+        self.stdout.write(self.style.SUCCESS(
+            f'Tiempo {ms_anterior / max(ms_motor, 0.001):.1f}x menor, memoria pico {pico_anterior / max(pico_motor, 1):.1f}x menor'
+        ))
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import get_template
+from weasyprint import CSS, HTML # type: ignore
+from weasyprint.text.fonts import FontConfiguration # type: ignore
+
+from acueducto.models import UserAcueducto
+from acueducto import utils
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el tiempo por factura de generar_pdf_factura (PDF en memoria con el contexto '
+        'de render cacheado) frente a compilar estilos y fuentes en cada factura y frente al '
+        'flujo anterior con NamedTemporaryFile (escribir, releer y borrar el archivo), y el '
+        'tiempo de servir la misma factura desde la caché de PDFs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contrato', help='Contrato a facturar (por defecto el primero)')
+        parser.add_argument('--iteraciones', type=int, default=20, help='Facturas a renderizar por estrategia')
+
+    def handle(self, *args, **options):
+        if options['contrato']:
+            usuario = UserAcueducto.objects.filter(contrato=options['contrato']).first()
+        else:
+            usuario = UserAcueducto.objects.order_by('contrato').first()
+        if usuario is None:
+            raise CommandError('No hay usuarios para facturar')
+
+        iteraciones = max(1, options['iteraciones'])
+        base_url = settings.BASE_DIR / 'acueducto' / 'static'
+        kwargs = {
+            'usuario': usuario,
+            'fecha_emision': datetime.now(),
+            'periodo_facturacion': 'Benchmark',
+            'base_url': base_url,
+            'usar_cache': False,
+        }
+
+        # Una factura de calentamiento para que Pango y las fuentes ya estén cargados
+        pdf_bytes = utils.generar_pdf_factura(**kwargs)
+
+        css_path = os.path.join(os.path.dirname(utils.__file__), 'static', 'factura.css')
+
+        def _html_factura():
+            # El mismo contexto que generar_pdf_factura, para que todas las variantes rendericen la misma factura
+            html = get_template('factura_template.html').render(utils.contexto_factura(
+                usuario, kwargs['fecha_emision'], kwargs['periodo_facturacion']
+            ))
+            return HTML(string=html, base_url=str(base_url))
+
+        def _sin_cache(target=None):
+            # Estilos, fuentes e imágenes se compilan de nuevo para cada factura
+            font_config = FontConfiguration()
+            css = CSS(filename=css_path, font_config=font_config)
+            return _html_factura().write_pdf(target, stylesheets=[css], font_config=font_config)
+
+        def _en_memoria():
+            utils.generar_pdf_factura(**kwargs)
+
+        def _desde_cache():
+            utils.generar_pdf_factura(**{**kwargs, 'usar_cache': True})
+
+        def _archivo_temporal():
+            # Reproduce el flujo anterior: render sin cache a disco, releer el archivo y borrarlo
+            pdf_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
+            _sin_cache(pdf_file.name)
+            with open(pdf_file.name, 'rb') as pdf:
+                pdf.read()
+            os.unlink(pdf_file.name)
+
+        def _solo_io():
+            # Solo el viaje por el sistema de archivos, sin render
+            pdf_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
+            pdf_file.write(pdf_bytes)
+            pdf_file.close()
+            with open(pdf_file.name, 'rb') as pdf:
+                pdf.read()
+            os.unlink(pdf_file.name)
+
+        # Llena la caché para que _desde_cache mida solo aciertos
+        _desde_cache()
+
+        resultados = [
+            ('Archivo temporal', self._medir(_archivo_temporal, iteraciones)),
+            ('En memoria sin contexto cacheado', self._medir(_sin_cache, iteraciones)),
+            ('En memoria', self._medir(_en_memoria, iteraciones)),
+            ('Solo I/O de archivo temporal', self._medir(_solo_io, iteraciones)),
+            ('Desde caché de PDFs', self._medir(_desde_cache, iteraciones)),
+        ]
+
+        self.stdout.write(f'Factura de {usuario.contrato}: {len(pdf_bytes)} bytes, {iteraciones} iteraciones')
+        for nombre, ms in resultados:
+            self.stdout.write(f'  {nombre:<34} {ms:8.2f} ms/factura')
+        ahorro_io = resultados[0][1] - resultados[1][1]
+        ahorro_contexto = resultados[1][1] - resultados[2][1]
+        self.stdout.write(self.style.SUCCESS(f'Ahorro por factura sin archivo temporal: {ahorro_io:.2f} ms'))
+        self.stdout.write(self.style.SUCCESS(f'Ahorro por factura con contexto cacheado: {ahorro_contexto:.2f} ms'))
+
+    def _medir(self, funcion, iteraciones):
+        inicio = time.perf_counter()
+        for _ in range(iteraciones):
+            funcion()
+        return (time.perf_counter() - inicio) * 1000 / iteraciones
@@ -0,0 +1,109 @@
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from acueducto.models import HistoricoLectura, OrdenRuta, Ruta, UserAcueducto
+from acueducto import services
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide consultas, memoria pico y tiempo de cargar los datos de la toma de lectura para '
+        'una ruta de prueba: el contexto anterior (prefetch de todo el histórico de cada '
+        'usuario) frente a las órdenes con values() y el historial bajo demanda. La ruta y sus '
+        'usuarios se crean dentro de una transacción que se revierte al terminar.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paradas', type=int, default=2000, help='Usuarios en la ruta de prueba')
+        parser.add_argument('--lecturas', type=int, default=24, help='Lecturas en el histórico de cada usuario')
+        parser.add_argument('--iteraciones', type=int, default=5, help='Cargas a medir por estrategia')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                ruta = self._crear_ruta(max(1, options['paradas']), max(1, options['lecturas']))
+                self._comparar(ruta, max(1, options['iteraciones']))
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _crear_ruta(self, paradas, lecturas):
+        usuarios = UserAcueducto.objects.bulk_create([
+            UserAcueducto(
+                contrato=f'BENCH-{i:06d}', name='Usuario', lastname=f'{i}', address=f'Calle {i}',
+                email=f'bench{i}@example.com', zona='A', lectura=lecturas * 10,
+                fecha_ultima_lectura=date.today(),
+            )
+            for i in range(paradas)
+        ], batch_size=500)
+        if usuarios[0].pk is None:
+            usuarios = list(UserAcueducto.objects.filter(contrato__startswith='BENCH-').order_by('contrato'))
+        HistoricoLectura.objects.bulk_create([
+            HistoricoLectura(usuario=usuario, lectura=j * 10, fecha_lectura=date.today() - timedelta(days=30 * (lecturas - j)))
+            for usuario in usuarios
+            for j in range(1, lecturas + 1)
+        ], batch_size=2000)
+        # Se desactivan las demás rutas (se revierte al terminar) para que la de prueba sea la activa
+        Ruta.objects.filter(activa=True).update(activa=False)
+        ruta = Ruta.objects.create(nombre='Benchmark')
+        OrdenRuta.objects.bulk_create(
+            [OrdenRuta(ruta=ruta, usuario=usuario, orden=i) for i, usuario in enumerate(usuarios, 1)],
+            batch_size=2000
+        )
+        return ruta
+
+    def _comparar(self, ruta, iteraciones):
+        def _anterior():
+            # Contexto previo: la ruta con todas sus órdenes, usuarios y el histórico completo
+            ruta_activa = Ruta.objects.filter(activa=True).prefetch_related(
+                'ordenruta_set__usuario', 'ordenruta_set__usuario__lecturas'
+            ).first()
+            for orden in ruta_activa.ordenruta_set.all():
+                ultima = orden.usuario.lecturas.first()
+                (orden.usuario.id, orden.usuario.address, orden.usuario.contrato, orden.lectura_tomada,
+                 ultima and (ultima.lectura, ultima.fecha_lectura))
+
+        def _actual():
+            ruta_activa = services.ruta_activa_vista_service()
+            for orden in services.ordenes_ruta_vista_service(ruta_activa):
+                (orden['usuario_id'], orden['address'], orden['contrato'], orden['lectura_tomada'],
+                 orden['ultima_lectura'], orden['fecha_ultima_lectura'])
+
+        def _historial():
+            # Lo que cuesta abrir el historial de un usuario
+            services.historial_lecturas_service(ruta.ordenruta_set.values_list('usuario_id', flat=True).first())
+
+        total_lecturas = HistoricoLectura.objects.filter(usuario__ordenruta__ruta=ruta).count()
+        self.stdout.write(f'Ruta de {ruta.ordenruta_set.count()} paradas y {total_lecturas} lecturas, {iteraciones} iteraciones')
+        resultados = []
+        for nombre, funcion in (('Prefetch de históricos', _anterior), ('values() sin históricos', _actual),
+                                ('Historial de un usuario', _historial)):
+            resultados.append(self._medir(funcion, iteraciones))
+            consultas, pico, ms = resultados[-1]
+            self.stdout.write(f'  {nombre:<26} {consultas:3d} consultas {pico / 1024 / 1024:8.2f} MB pico {ms:9.2f} ms')
+        (_, pico_anterior, ms_anterior), (_, pico_actual, ms_actual) = resultados[:2]
+        self.stdout.write(self.style.SUCCESS(
+            f'Memoria pico {pico_anterior / max(pico_actual, 1):.1f}x menor, '
+            f'tiempo {ms_anterior / max(ms_actual, 0.001):.1f}x menor'
+        ))
+
+    def _medir(self, funcion, iteraciones):
+        with CaptureQueriesContext(connection) as consultas:
+            funcion()
+        tracemalloc.start()
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        inicio = time.perf_counter()
+        for _ in range(iteraciones):
+            funcion()
+        return len(consultas), pico, (time.perf_counter() - inicio) * 1000 / iteraciones
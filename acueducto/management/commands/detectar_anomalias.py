@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from acueducto import anomalias
+from acueducto.models import AnomaliaLectura, UserAcueducto
+
+
+class Command(BaseCommand):
+    help = (
+        'Busca consumos negativos, picos de consumo y medidores sin lectura en el histórico de '
+        'lecturas y reemplaza las anomalías guardadas (AnomaliaLectura).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contrato', action='append', default=[], help='Solo este contrato (se puede repetir)')
+
+    def handle(self, *args, **options):
+        usuarios = None
+        if options['contrato']:
+            usuarios = UserAcueducto.objects.filter(contrato__in=options['contrato'])
+        inicio = time.perf_counter()
+        conteo = anomalias.detectar_anomalias(usuarios)
+        for tipo, nombre in AnomaliaLectura.TIPO_CHOICES:
+            self.stdout.write(f'  {nombre:<22} {conteo[tipo]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{sum(conteo.values())} anomalías encontradas en {time.perf_counter() - inicio:.1f} s'
+        ))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from acueducto import importacion
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa usuarios o lecturas históricas desde un CSV con encabezados, por lotes. '
+        'Las filas con error no detienen la importación: se listan al final con su número de fila.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('tipo', choices=['usuarios', 'lecturas'])
+        parser.add_argument('archivo', help='Archivo CSV (UTF-8, separado por comas o punto y coma)')
+        parser.add_argument('--actualizar', action='store_true',
+                            help='Actualiza los usuarios cuyo contrato ya existe en lugar de informar un error')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        try:
+            with open(options['archivo'], encoding='utf-8-sig', newline='') as archivo:
+                if options['tipo'] == 'usuarios':
+                    resumen = importacion.importar_usuarios(archivo, actualizar=options['actualizar'])
+                else:
+                    resumen = importacion.importar_lecturas(archivo)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for error in resumen['errores']:
+            self.stderr.write(f'  Fila {error["fila"]} ({error["contrato"]}): {error["error"]}')
+        if resumen['con_error'] > len(resumen['errores']):
+            self.stderr.write(f'  ... y {resumen["con_error"] - len(resumen["errores"])} errores más')
+        self.stdout.write(self.style.SUCCESS(
+            f'{resumen["filas"]} filas en {time.perf_counter() - inicio:.1f} s: {resumen["creados"]} creadas, '
+            f'{resumen["actualizados"]} actualizadas, {resumen["duplicados"]} ya registradas, '
+            f'{resumen["con_error"]} con error'
+        ))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from acueducto import services
+
+
+class Command(BaseCommand):
+    help = 'Procesa los trabajos de facturación en cola (ZIP de facturas y envíos por email).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true', help='Procesa los trabajos pendientes y termina')
+        parser.add_argument('--intervalo', type=float, default=2.0, help='Segundos de espera cuando no hay trabajos')
+
+    def handle(self, *args, **options):
+        while True:
+            trabajo = services.tomar_siguiente_trabajo()
+            if trabajo is None:
+                if options['una_vez']:
+                    return
+                time.sleep(options['intervalo'])
+                continue
+
+            self.stdout.write(f'Procesando {trabajo}')
+            trabajo = services.ejecutar_trabajo(trabajo)
+            if trabajo.estado == 'completado':
+                self.stdout.write(self.style.SUCCESS(f'{trabajo} ({trabajo.procesadas}/{trabajo.total})'))
+            else:
+                self.stdout.write(self.style.ERROR(f'{trabajo}: {trabajo.mensaje}'))
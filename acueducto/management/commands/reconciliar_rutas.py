@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from acueducto import services
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los contadores de avance (total de órdenes y lecturas completadas) de las rutas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--activas', action='store_true', help='Solo las rutas activas')
+
+    def handle(self, *args, **options):
+        corregidas = services.reconciliar_contadores_rutas(solo_activas=options['activas'])
+        self.stdout.write(self.style.SUCCESS(f'{corregidas} rutas con contadores corregidos'))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from acueducto import consumos
+from acueducto.models import UserAcueducto
+
+
+class Command(BaseCommand):
+    help = 'Recalcula la tabla de consumo mensual (ConsumoMensual) desde el histórico de lecturas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contrato', action='append', default=[], help='Solo este contrato (se puede repetir)')
+
+    def handle(self, *args, **options):
+        usuario_ids = None
+        if options['contrato']:
+            usuario_ids = list(
+                UserAcueducto.objects.filter(contrato__in=options['contrato']).values_list('pk', flat=True)
+            )
+        inicio = time.perf_counter()
+        filas = consumos.recalcular_consumos(usuario_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'{filas} meses de consumo calculados en {time.perf_counter() - inicio:.1f} s'
+        ))
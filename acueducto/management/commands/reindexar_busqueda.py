@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from acueducto import busqueda
+
+
+class Command(BaseCommand):
+    help = 'Crea (si falta) y reconstruye el índice de búsqueda de usuarios por contrato, dirección, nombre y medidor.'
+
+    def handle(self, *args, **options):
+        busqueda.instalar_indice()
+        if not busqueda.indice_disponible():
+            raise CommandError('El motor de base de datos no soporta el índice FTS5 trigram; la búsqueda usa icontains')
+        total = busqueda.reconstruir_indice()
+        self.stdout.write(self.style.SUCCESS(f'{total} usuarios indexados'))
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.1 on 2026-10-18 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('acueducto', '0009_useracueducto_numero_de_medidor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoFacturacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('zip_facturas', 'ZIP con todas las facturas'), ('email_factura', 'Envío de factura por email')], max_length=30)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('completado', 'Completado'), ('fallido', 'Fallido')], db_index=True, default='pendiente', max_length=20)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('total', models.IntegerField(default=0)),
+                ('procesadas', models.IntegerField(default=0)),
+                ('fallidas', models.IntegerField(default=0)),
+                ('errores', models.JSONField(blank=True, default=list)),
+                ('mensaje', models.TextField(blank=True)),
+                ('archivo', models.FileField(blank=True, upload_to='trabajos/')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_finalizacion', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['fecha_creacion'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='useracueducto',
+            name='fecha_ultima_lectura',
+            field=models.DateField(blank=True, null=True, verbose_name='Fecha Última Lectura'),
+        ),
+    ]
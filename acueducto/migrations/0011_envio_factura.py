@@ -0,0 +1,35 @@
+# Generated by Django 4.2.1 on 2026-10-18 16:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('acueducto', '0010_trabajofacturacion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trabajofacturacion',
+            name='tipo',
+            field=models.CharField(choices=[('zip_facturas', 'ZIP con todas las facturas'), ('email_factura', 'Envío de factura por email'), ('email_masivo', 'Envío masivo de facturas por email')], max_length=30),
+        ),
+        migrations.CreateModel(
+            name='EnvioFactura',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=100)),
+                ('enviado', models.BooleanField(default=False)),
+                ('intentos', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('trabajo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='envios', to='acueducto.trabajofacturacion')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='envios_factura', to='acueducto.useracueducto')),
+            ],
+            options={
+                'ordering': ['-fecha'],
+            },
+        ),
+    ]
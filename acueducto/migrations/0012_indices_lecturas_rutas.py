@@ -0,0 +1,33 @@
+# Generated by Django 4.2.1 on 2026-10-18 16:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('acueducto', '0011_envio_factura'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historicolectura',
+            index=models.Index(fields=['usuario', '-fecha_lectura'], name='historico_usuario_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ordenruta',
+            index=models.Index(fields=['ruta', 'usuario', 'orden'], name='ordenruta_ruta_usuario_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ordenruta',
+            index=models.Index(fields=['ruta', 'lectura_tomada'], name='ordenruta_ruta_tomada_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ordenruta',
+            index=models.Index(condition=models.Q(('lectura_tomada', False)), fields=['ruta', 'orden'], name='ordenruta_pendientes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ruta',
+            index=models.Index(condition=models.Q(('activa', True)), fields=['id'], name='ruta_activa_idx'),
+        ),
+    ]
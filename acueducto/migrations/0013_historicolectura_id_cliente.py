@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('acueducto', '0012_indices_lecturas_rutas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicolectura',
+            name='id_cliente',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
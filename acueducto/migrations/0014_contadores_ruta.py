@@ -0,0 +1,40 @@
+# Generated by Django 4.2.1 on 2026-10-18 16:29
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def calcular_contadores(apps, schema_editor):
+    Ruta = apps.get_model('acueducto', 'Ruta')
+    OrdenRuta = apps.get_model('acueducto', 'OrdenRuta')
+
+    def conteo(**filtros):
+        ordenes = (
+            OrdenRuta.objects.filter(ruta=OuterRef('pk'), **filtros)
+            .order_by().values('ruta').annotate(total=Count('pk')).values('total')
+        )
+        return Coalesce(Subquery(ordenes, output_field=IntegerField()), Value(0))
+
+    Ruta.objects.update(total_ordenes=conteo(), lecturas_completadas=conteo(lectura_tomada=True))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('acueducto', '0013_historicolectura_id_cliente'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ruta',
+            name='lecturas_completadas',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ruta',
+            name='total_ordenes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(calcular_contadores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.1 on 2026-10-18 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('acueducto', '0014_contadores_ruta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='useracueducto',
+            name='latitud',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='useracueducto',
+            name='longitud',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.1 on 2026-10-18 16:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('acueducto', '0015_ubicacion_usuario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ruta',
+            name='lector',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rutas', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.1 on 2026-10-18 16:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+from datetime import date
+
+
+def calcular_consumos(apps, schema_editor):
+    HistoricoLectura = apps.get_model('acueducto', 'HistoricoLectura')
+    ConsumoMensual = apps.get_model('acueducto', 'ConsumoMensual')
+
+    # Última lectura de cada usuario y mes; el orden por usuario y fecha deja la más reciente
+    ultimas = {}
+    for usuario_id, fecha_lectura, lectura in HistoricoLectura.objects.order_by(
+        'usuario_id', 'fecha_lectura', 'id'
+    ).values_list('usuario_id', 'fecha_lectura', 'lectura').iterator(chunk_size=2000):
+        ultimas[usuario_id, date(fecha_lectura.year, fecha_lectura.month, 1)] = (fecha_lectura, lectura)
+
+    anteriores = {}
+    filas = []
+    for (usuario_id, periodo), (fecha_lectura, lectura) in ultimas.items():
+        anterior = anteriores.get(usuario_id)
+        filas.append(ConsumoMensual(
+            usuario_id=usuario_id, periodo=periodo, lectura=lectura, fecha_lectura=fecha_lectura,
+            consumo=round(lectura - anterior, 3) if anterior is not None else None
+        ))
+        anteriores[usuario_id] = lectura
+    ConsumoMensual.objects.bulk_create(filas, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('acueducto', '0016_ruta_lector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumoMensual',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.DateField(help_text='Primer día del mes')),
+                ('lectura', models.FloatField()),
+                ('fecha_lectura', models.DateField()),
+                ('consumo', models.FloatField(blank=True, null=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumos_mensuales', to='acueducto.useracueducto')),
+            ],
+            options={
+                'ordering': ['-periodo'],
+                'unique_together': {('usuario', 'periodo')},
+            },
+        ),
+        migrations.RunPython(calcular_consumos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.1 on 2026-10-18 17:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('acueducto', '0017_consumo_mensual'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnomaliaLectura',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('consumo_negativo', 'Consumo negativo'), ('pico', 'Pico de consumo'), ('medidor_sin_lectura', 'Medidor sin lectura')], db_index=True, max_length=30)),
+                ('fecha', models.DateField()),
+                ('consumo', models.FloatField(blank=True, null=True)),
+                ('referencia', models.FloatField(blank=True, null=True)),
+                ('detalle', models.CharField(max_length=255)),
+                ('fecha_deteccion', models.DateTimeField(auto_now_add=True)),
+                ('lectura', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='anomalias', to='acueducto.historicolectura')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anomalias', to='acueducto.useracueducto')),
+            ],
+            options={
+                'ordering': ['-fecha'],
+            },
+        ),
+    ]
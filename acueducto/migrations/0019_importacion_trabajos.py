@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('acueducto', '0018_anomalia_lectura'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trabajofacturacion',
+            name='tipo',
+            field=models.CharField(choices=[('zip_facturas', 'ZIP con todas las facturas'), ('email_factura', 'Envío de factura por email'), ('email_masivo', 'Envío masivo de facturas por email'), ('importar_usuarios', 'Importación de usuarios'), ('importar_lecturas', 'Importación de lecturas')], max_length=30),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 
 # Create your models here.
@@ -23,6 +24,9 @@ class UserAcueducto(models.Model):
     otros_gastos_valor = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     otros_gastos_descripcion = models.TextField(blank=True)
     numero_de_medidor = models.CharField(max_length=50, blank=True, null=True, unique=True)
+    # Ubicación del medidor (opcional); la usa el ordenamiento automático de rutas
+    latitud = models.FloatField(blank=True, null=True)
+    longitud = models.FloatField(blank=True, null=True)
 
     def __str__(self):
         return f"{self.name} {self.lastname} - {self.contrato}"
@@ -32,41 +36,111 @@ class HistoricoLectura(models.Model):
     fecha_lectura = models.DateField()
     lectura = models.FloatField()
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    # Identificador que asigna el dispositivo del lector a cada lectura tomada sin conexión;
+    # permite reenviar un lote sin duplicar lecturas
+    id_cliente = models.CharField(max_length=64, unique=True, null=True, blank=True)
     
     class Meta:
         ordering = ['-fecha_lectura']
+        indexes = [
+            # Historial de un usuario (toma de lectura, facturas, histórico): filtra por usuario y ordena por fecha
+            models.Index(fields=['usuario', '-fecha_lectura'], name='historico_usuario_fecha_idx'),
+        ]
         
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Mes guardado: si al editar la lectura cambia de mes, las señales recalculan los dos
+        instancia._fecha_lectura_guardada = instancia.__dict__.get('fecha_lectura')
+        return instancia
+
     def __str__(self):
         return f"Lectura {self.usuario.contrato} - {self.fecha_lectura}"
 
+class ConsumoMensual(models.Model):
+    """
+    Consumo de un usuario en un mes, materializado a partir de HistoricoLectura: la última
+    lectura del mes y la diferencia con la del último mes anterior con lecturas. Lo mantienen
+    las señales de HistoricoLectura (acueducto/consumos.py); el comando reconstruir_consumos
+    lo vuelve a calcular desde las lecturas.
+    """
+    usuario = models.ForeignKey(UserAcueducto, on_delete=models.CASCADE, related_name='consumos_mensuales')
+    periodo = models.DateField(help_text='Primer día del mes')
+    lectura = models.FloatField()
+    fecha_lectura = models.DateField()
+    consumo = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-periodo']
+        # El índice único también sirve los últimos meses de un usuario (historial, facturas)
+        unique_together = [['usuario', 'periodo']]
+
+    def __str__(self):
+        return f"Consumo {self.usuario_id} - {self.periodo:%Y-%m}"
+
 class Ruta(models.Model):
     nombre = models.CharField(max_length=100)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_finalizacion = models.DateTimeField(null=True, blank=True)
     usuarios = models.ManyToManyField(UserAcueducto, through='OrdenRuta')
     activa = models.BooleanField(default=True)
+    # Lector que trabaja la ruta; las rutas sin lector las ve cualquier lector que no tenga una propia.
+    # La ruta de un lector se busca por el índice de la FK (lector_id)
+    lector = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name='rutas'
+    )
+    # Contadores de avance desnormalizados: los mantienen las señales de OrdenRuta y
+    # services.marcar_lecturas_tomadas con F(); el comando reconciliar_rutas los recalcula
+    total_ordenes = models.PositiveIntegerField(default=0)
+    lecturas_completadas = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Solo hay una o pocas rutas activas entre muchas finalizadas: índice parcial
+            models.Index(fields=['id'], condition=models.Q(activa=True), name='ruta_activa_idx'),
+        ]
 
     def __str__(self):
         estado = "Activa" if self.activa else "Finalizada"
         return f"Ruta {self.nombre} - {estado} ({self.fecha_creacion.strftime('%d/%m/%Y')})"
 
+    CONTADORES = ('total_ordenes', 'lecturas_completadas')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._contadores_leidos = instancia._valores_contadores()
+        return instancia
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._contadores_leidos = self._valores_contadores()
+
+    def _valores_contadores(self):
+        # Sin getattr: un contador diferido no se consulta
+        return tuple(self.__dict__.get(campo) for campo in self.CONTADORES)
+
+    def save(self, *args, **kwargs):
+        # Los contadores solo cambian con UPDATE ... F(): un save() completo de una instancia
+        # leída antes de marcar lecturas no debe pisarlos con los valores viejos. Si quien
+        # guarda cambió los contadores, tiene que pedirlo con update_fields
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            if self._valores_contadores() != getattr(self, '_contadores_leidos', self._valores_contadores()):
+                raise ValueError(
+                    'Los contadores de la ruta no se guardan con save() completo: '
+                    'use save(update_fields=[...]) o el comando reconciliar_rutas'
+                )
+            kwargs['update_fields'] = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key and campo.name not in self.CONTADORES
+            ]
+        super().save(*args, **kwargs)
+        self._contadores_leidos = self._valores_contadores()
+
     def porcentaje_completado(self):
-        if hasattr(self, 'total_ordenes') and hasattr(self, 'lecturas_completadas_count'):
-            # Using annotated fields
-            if self.total_ordenes == 0:
-                return 0
-            # Ensure counts are not None, though Count should return 0
-            total_ordenes = self.total_ordenes if self.total_ordenes is not None else 0
-            lecturas_completadas_count = self.lecturas_completadas_count if self.lecturas_completadas_count is not None else 0
-            if total_ordenes == 0: # Double check after potential None conversion
-                return 0
-            return int((lecturas_completadas_count / total_ordenes) * 100)
-        else: # Fallback for cases where annotation is not used
-            total_lecturas = self.ordenruta_set.count()
-            if total_lecturas == 0:
-                return 0
-            lecturas_completadas = self.ordenruta_set.filter(lectura_tomada=True).count()
-            return int((lecturas_completadas / total_lecturas) * 100)
+        if self.total_ordenes == 0:
+            return 0
+        return int((self.lecturas_completadas / self.total_ordenes) * 100)
 
 class OrdenRuta(models.Model):
     ruta = models.ForeignKey(Ruta, on_delete=models.CASCADE)
@@ -77,12 +151,108 @@ class OrdenRuta(models.Model):
     class Meta:
         ordering = ['orden']
         unique_together = [['ruta', 'orden']]
+        indexes = [
+            # Orden de un usuario dentro de la ruta activa; `orden` al final sirve el ORDER BY por
+            # defecto, si no SQLite prefiere el índice único (ruta, orden) y filtra fila a fila
+            models.Index(fields=['ruta', 'usuario', 'orden'], name='ordenruta_ruta_usuario_idx'),
+            # Conteos de avance de la ruta (total y lecturas tomadas) sin leer la tabla
+            models.Index(fields=['ruta', 'lectura_tomada'], name='ordenruta_ruta_tomada_idx'),
+            # Lecturas pendientes de una ruta: Django compila lectura_tomada=False como
+            # NOT lectura_tomada, que un índice compuesto no puede buscar; el parcial sí
+            models.Index(fields=['ruta', 'orden'], condition=models.Q(lectura_tomada=False), name='ordenruta_pendientes_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Valor leído de la base: la señal post_save solo ajusta el contador de la ruta si cambió
+        instancia._lectura_tomada_guardada = instancia.__dict__.get('lectura_tomada')
+        return instancia
 
     def __str__(self):
         return f"{self.ruta} - {self.usuario.contrato} (Orden: {self.orden})"
 
+class TrabajoFacturacion(models.Model):
+    """Trabajo en segundo plano (ZIP de facturas, envío por email o importación) que procesa el comando procesar_trabajos."""
+    TIPO_CHOICES = [
+        ('zip_facturas', 'ZIP con todas las facturas'),
+        ('email_factura', 'Envío de factura por email'),
+        ('email_masivo', 'Envío masivo de facturas por email'),
+        ('importar_usuarios', 'Importación de usuarios'),
+        ('importar_lecturas', 'Importación de lecturas'),
+    ]
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('en_proceso', 'En proceso'),
+        ('completado', 'Completado'),
+        ('fallido', 'Fallido'),
+    ]
+
+    tipo = models.CharField(max_length=30, choices=TIPO_CHOICES)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente', db_index=True)
+    parametros = models.JSONField(default=dict, blank=True)
+    total = models.IntegerField(default=0)
+    procesadas = models.IntegerField(default=0)
+    fallidas = models.IntegerField(default=0)
+    errores = models.JSONField(default=list, blank=True)
+    mensaje = models.TextField(blank=True)
+    archivo = models.FileField(upload_to='trabajos/', blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_finalizacion = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        ordering = ['fecha_creacion']
 
+    def __str__(self):
+        return f"{self.get_tipo_display()} #{self.id} - {self.get_estado_display()}"
+
+    def porcentaje_completado(self):
+        if not self.total:
+            return 100 if self.estado == 'completado' else 0
+        return int(((self.procesadas + self.fallidas) / self.total) * 100)
 
+class EnvioFactura(models.Model):
+    """Resultado del envío de una factura por email a un destinatario en un envío masivo."""
+    trabajo = models.ForeignKey(TrabajoFacturacion, on_delete=models.CASCADE, null=True, blank=True, related_name='envios')
+    usuario = models.ForeignKey(UserAcueducto, on_delete=models.CASCADE, related_name='envios_factura')
+    email = models.EmailField(max_length=100)
+    enviado = models.BooleanField(default=False)
+    intentos = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    fecha = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        ordering = ['-fecha']
 
+    def __str__(self):
+        estado = "Enviado" if self.enviado else "Fallido"
+        return f"{self.email} - {estado} ({self.usuario.contrato})"
+
+class AnomaliaLectura(models.Model):
+    """
+    Lectura sospechosa de fuga o falla del medidor, marcada por acueducto/anomalias.py: la
+    pasada completa (comando detectar_anomalias) y la revisión de cada lectura tomada.
+    """
+    TIPO_CHOICES = [
+        ('consumo_negativo', 'Consumo negativo'),
+        ('pico', 'Pico de consumo'),
+        ('medidor_sin_lectura', 'Medidor sin lectura'),
+    ]
+
+    usuario = models.ForeignKey(UserAcueducto, on_delete=models.CASCADE, related_name='anomalias')
+    # Vacía en los medidores sin lectura
+    lectura = models.ForeignKey(HistoricoLectura, on_delete=models.CASCADE, null=True, blank=True, related_name='anomalias')
+    tipo = models.CharField(max_length=30, choices=TIPO_CHOICES, db_index=True)
+    fecha = models.DateField()
+    consumo = models.FloatField(null=True, blank=True)
+    # Mediana de los consumos anteriores (picos) o días sin lectura (medidores sin lectura)
+    referencia = models.FloatField(null=True, blank=True)
+    detalle = models.CharField(max_length=255)
+    fecha_deteccion = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-fecha']
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} - {self.usuario_id} ({self.fecha})"
@@ -0,0 +1,233 @@
+import math
+import re
+import time
+from collections import defaultdict
+
+# Planificación del orden de una ruta de lectura. Los usuarios se agrupan por zona y dentro
+# de cada zona se ordenan con vecino más cercano + 2-opt sobre coordenadas:
+#  - latitud/longitud del usuario si las tiene (proyectadas a metros);
+#  - si no, la dirección en nomenclatura urbana ("Calle 12 # 34-56"), que da una posición en
+#    la cuadrícula: las calles crecen en un eje y las carreras en el otro;
+#  - las direcciones que no se pueden interpretar van al final de su zona en orden natural.
+# Todo es Python puro con una cuadrícula espacial para buscar vecinos, así 10k paradas se
+# ordenan en pocos segundos.
+
+# Tipos de vía: los que corren como calles dan la coordenada y, los que corren como carreras la x
+_VIAS = {
+    'calle': 'calle', 'cl': 'calle', 'cll': 'calle', 'clle': 'calle',
+    'diagonal': 'calle', 'dg': 'calle', 'diag': 'calle',
+    'avenida calle': 'calle', 'ac': 'calle', 'av calle': 'calle',
+    'carrera': 'carrera', 'cra': 'carrera', 'kra': 'carrera', 'kr': 'carrera', 'cr': 'carrera', 'carr': 'carrera',
+    'transversal': 'carrera', 'tv': 'carrera', 'tr': 'carrera', 'trans': 'carrera',
+    'avenida carrera': 'carrera', 'ak': 'carrera', 'av carrera': 'carrera',
+}
+_PATRON_DIRECCION = re.compile(
+    r'^\s*(?P<via>%s)\.?\s+(?P<principal>\d+)\s*(?P<letra>[a-z])?\s*(?:bis\s*)?'
+    r'(?:#|no\.?|n[°º]|numero|número)?\s*(?P<cruce>\d+)\s*(?:[a-z]\b)?\s*(?:bis\s*)?-\s*(?P<placa>\d+)'
+    % '|'.join(sorted((re.escape(via) for via in _VIAS), key=len, reverse=True)),
+    re.IGNORECASE
+)
+
+METROS_POR_GRADO_LATITUD = 110540
+METROS_POR_GRADO_LONGITUD = 111320
+# Vecinos más cercanos de cada parada que se prueban en el 2-opt
+VECINOS_2OPT = 8
+# Tope de tiempo de las mejoras 2-opt por grupo; el recorrido del vecino más cercano ya es válido
+SEGUNDOS_MAXIMOS_2OPT = 2.0
+
+
+def posicion_direccion(direccion: str):
+    """
+    Posición (x, y) en la cuadrícula de una dirección en nomenclatura urbana, en cuadras, o
+    None si no se reconoce. "Calle 12 # 34-56" queda en x=34.56, y=12; "Carrera 34 # 12-56"
+    en x=34, y=12.56. La letra de la vía ("Calle 12B") la desplaza una fracción de cuadra.
+    """
+    coincidencia = _PATRON_DIRECCION.match(direccion or '')
+    if not coincidencia:
+        return None
+    via = _VIAS[' '.join(coincidencia.group('via').lower().split())]
+    principal = int(coincidencia.group('principal'))
+    letra = coincidencia.group('letra')
+    if letra:
+        principal += (ord(letra.lower()) - ord('a') + 1) / 10
+    cruce = int(coincidencia.group('cruce')) + int(coincidencia.group('placa')) / 100
+    return (cruce, principal) if via == 'calle' else (principal, cruce)
+
+
+def _posicion_geografica(latitud, longitud, latitud_referencia):
+    return (
+        longitud * METROS_POR_GRADO_LONGITUD * math.cos(math.radians(latitud_referencia)),
+        latitud * METROS_POR_GRADO_LATITUD,
+    )
+
+
+def _clave_natural(texto: str):
+    return [(0, int(parte), '') if parte.isdigit() else (1, 0, parte) for parte in re.split(r'(\d+)', (texto or '').lower()) if parte]
+
+
+class _Cuadricula:
+    """Índice espacial: celdas de tamaño fijo con los puntos que caen en cada una."""
+
+    def __init__(self, puntos):
+        self.puntos = puntos
+        xs = [x for x, _ in puntos]
+        ys = [y for _, y in puntos]
+        self.min_x, self.min_y = min(xs), min(ys)
+        ancho, alto = max(xs) - self.min_x, max(ys) - self.min_y
+        # Unos dos puntos por celda en promedio
+        self.tamano = max(ancho, alto, 1e-9) / max(1, math.sqrt(len(puntos) / 2))
+        self.max_radio = int(max(ancho, alto) / self.tamano) + 1
+        self.celdas = defaultdict(set)
+        for indice, punto in enumerate(puntos):
+            self.celdas[self.celda(punto)].add(indice)
+
+    def celda(self, punto):
+        return int((punto[0] - self.min_x) / self.tamano), int((punto[1] - self.min_y) / self.tamano)
+
+    def quitar(self, indice):
+        celda = self.celda(self.puntos[indice])
+        contenido = self.celdas[celda]
+        contenido.discard(indice)
+        if not contenido:
+            del self.celdas[celda]
+
+    def _anillo(self, cx, cy, radio):
+        if radio == 0:
+            yield cx, cy
+            return
+        for dx in range(-radio, radio + 1):
+            yield cx + dx, cy - radio
+            yield cx + dx, cy + radio
+        for dy in range(-radio + 1, radio):
+            yield cx - radio, cy + dy
+            yield cx + radio, cy + dy
+
+    def mas_cercanos(self, punto, cantidad, excluir=None):
+        """Los `cantidad` índices más cercanos a `punto` (de menor a mayor distancia)"""
+        cx, cy = self.celda(punto)
+        encontrados = []
+        for radio in range(self.max_radio + 1):
+            for celda in self._anillo(cx, cy, radio):
+                for indice in self.celdas.get(celda, ()):
+                    if indice != excluir:
+                        otro = self.puntos[indice]
+                        encontrados.append((math.hypot(otro[0] - punto[0], otro[1] - punto[1]), indice))
+            # Lo que está más allá de este anillo dista al menos radio * tamano
+            if len(encontrados) >= cantidad:
+                encontrados.sort()
+                if encontrados[cantidad - 1][0] <= radio * self.tamano:
+                    break
+        encontrados.sort()
+        return [indice for _, indice in encontrados[:cantidad]]
+
+
+def _vecino_mas_cercano(puntos):
+    cuadricula = _Cuadricula(puntos)
+    # Se empieza por la esquina de menor (y, x) de la zona
+    actual = min(range(len(puntos)), key=lambda indice: (puntos[indice][1], puntos[indice][0]))
+    cuadricula.quitar(actual)
+    recorrido = [actual]
+    for _ in range(len(puntos) - 1):
+        actual = cuadricula.mas_cercanos(puntos[actual], 1)[0]
+        cuadricula.quitar(actual)
+        recorrido.append(actual)
+    return recorrido
+
+
+def _dos_opt(recorrido, puntos, segundos_maximos):
+    """
+    Mejora un recorrido abierto invirtiendo tramos mientras acorte el total. Solo se prueban
+    uniones con los VECINOS_2OPT puntos más cercanos de cada parada, lo que evita el O(n²)
+    por pasada del 2-opt completo.
+    """
+    n = len(recorrido)
+    if n < 4:
+        return recorrido
+    cuadricula = _Cuadricula(puntos)
+    vecinos = [cuadricula.mas_cercanos(punto, VECINOS_2OPT, excluir=indice) for indice, punto in enumerate(puntos)]
+
+    def distancia(a, b):
+        return math.hypot(puntos[a][0] - puntos[b][0], puntos[a][1] - puntos[b][1])
+
+    posicion = [0] * n
+    for indice, parada in enumerate(recorrido):
+        posicion[parada] = indice
+
+    limite = time.monotonic() + segundos_maximos
+    mejora = True
+    while mejora and time.monotonic() < limite:
+        mejora = False
+        for i in range(n - 1):
+            a, b = recorrido[i], recorrido[i + 1]
+            distancia_ab = distancia(a, b)
+            for c in vecinos[a]:
+                distancia_ac = distancia(a, c)
+                if distancia_ac >= distancia_ab:
+                    break
+                # Aristas (p, p+1) y (q, q+1) se reemplazan por (p, q) y (p+1, q+1)
+                p, q = sorted((i, posicion[c]))
+                if q - p < 2:
+                    continue
+                inicio, fin = recorrido[p + 1], recorrido[q]
+                delta = distancia_ac - distancia(recorrido[p], inicio)
+                # En un recorrido abierto el tramo puede llegar hasta el final: sin arista (q, q+1)
+                if q + 1 < n:
+                    delta += distancia(inicio, recorrido[q + 1]) - distancia(fin, recorrido[q + 1])
+                if delta < -1e-9:
+                    recorrido[p + 1:q + 1] = recorrido[q:p:-1]
+                    for indice in range(p + 1, q + 1):
+                        posicion[recorrido[indice]] = indice
+                    mejora = True
+                    break
+            if time.monotonic() >= limite:
+                break
+    return recorrido
+
+
+def ordenar_puntos(puntos, segundos_maximos=SEGUNDOS_MAXIMOS_2OPT) -> list[int]:
+    """Índices de `puntos` [(x, y), ...] en el orden de un recorrido corto que empieza en una esquina"""
+    if len(puntos) <= 2:
+        return sorted(range(len(puntos)), key=lambda indice: (puntos[indice][1], puntos[indice][0]))
+    return _dos_opt(_vecino_mas_cercano(puntos), puntos, segundos_maximos)
+
+
+def longitud_recorrido(puntos, orden) -> float:
+    return sum(
+        math.hypot(puntos[a][0] - puntos[b][0], puntos[a][1] - puntos[b][1])
+        for a, b in zip(orden, orden[1:])
+    )
+
+
+def ordenar_usuarios(usuarios) -> list:
+    """
+    Propone el orden de visita de `usuarios` (instancias de UserAcueducto con zona, address,
+    latitud y longitud): por zona y dentro de cada zona primero los usuarios con coordenadas,
+    luego los de dirección en nomenclatura y al final los de dirección no reconocida.
+    """
+    por_zona = defaultdict(list)
+    for usuario in usuarios:
+        por_zona[usuario.zona or ''].append(usuario)
+
+    ordenados = []
+    # Zonas en orden natural; los usuarios sin zona al final
+    for zona in sorted(por_zona, key=lambda zona: (zona == '', _clave_natural(zona))):
+        con_coordenadas, en_cuadricula, sin_posicion = [], [], []
+        for usuario in por_zona[zona]:
+            if usuario.latitud is not None and usuario.longitud is not None:
+                con_coordenadas.append(usuario)
+            else:
+                posicion = posicion_direccion(usuario.address)
+                if posicion is None:
+                    sin_posicion.append(usuario)
+                else:
+                    en_cuadricula.append((usuario, posicion))
+
+        if con_coordenadas:
+            referencia = sum(usuario.latitud for usuario in con_coordenadas) / len(con_coordenadas)
+            puntos = [_posicion_geografica(usuario.latitud, usuario.longitud, referencia) for usuario in con_coordenadas]
+            ordenados.extend(con_coordenadas[indice] for indice in ordenar_puntos(puntos))
+        if en_cuadricula:
+            puntos = [posicion for _, posicion in en_cuadricula]
+            ordenados.extend(en_cuadricula[indice][0] for indice in ordenar_puntos(puntos))
+        ordenados.extend(sorted(sin_posicion, key=lambda usuario: (_clave_natural(usuario.address), usuario.contrato)))
+    return ordenados
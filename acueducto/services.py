@@ -1,78 +1,432 @@
 from io import BytesIO
 import zipfile
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
+import time
 import json # Added for json.loads in one of the moved functions
+import hashlib
+import atexit
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import get_connection
 from django.shortcuts import get_object_or_404
 from django.utils import timezone # For finalizar_ruta_service
-from django.db.models import Q # May be needed by moved logic
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Prefetch, Q, Subquery, Value # May be needed by moved logic
+from django.db.models.functions import Coalesce
 
-from .models import UserAcueducto, Ruta, OrdenRuta, HistoricoLectura
+from .models import UserAcueducto, Ruta, OrdenRuta, HistoricoLectura, TrabajoFacturacion, EnvioFactura, ConsumoMensual
 from . import utils # For PDF generation, formatear_fecha_espanol
+from . import busqueda as busqueda_usuarios
+from . import rutas as planificacion_rutas
+from . import facturacion
+from . import consumos as consumos_mensuales
+from . import importacion
 
 # Placeholder for service functions to be added
 
-def generar_zip_todas_facturas_service(periodo_inicio_str: str, periodo_fin_str: str) -> BytesIO:
-    """Genera un archivo ZIP con todas las facturas para el período dado."""
+def _max_workers_facturas() -> int:
+    """
+    Número de procesos para renderizar facturas en paralelo.
+    Con SQLite en memoria (p. ej. durante los tests) los procesos hijos no ven
+    los datos, así que se renderiza en el proceso actual.
+    """
+    max_workers = getattr(settings, 'FACTURAS_MAX_WORKERS', 1) or 1
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        return 1
+    return max(1, int(max_workers))
+
+def _inicializar_worker_facturas():
+    """Prepara cada proceso del pool: Django listo, sin conexiones heredadas y WeasyPrint precargado."""
+    import django
+    django.setup()
+    # Tras un fork los sockets de las conexiones del padre son compartidos: cerrarlos aquí
+    # terminaría la sesión del padre en un motor en red. Solo se sueltan; si el worker
+    # necesitara la base de datos abriría una conexión propia.
+    for conexion in connections.all(initialized_only=True):
+        conexion.connection = None
+    utils.precalentar_weasyprint()
+
+# Un solo pool por proceso web, creado con la primera descarga y reutilizado por las
+# siguientes: arrancar max_workers procesos (y precargar WeasyPrint) en cada petición
+# costaba más que renderizar un ZIP pequeño
+_pool_facturas = None # (max_workers, executor)
+_pool_facturas_lock = threading.Lock()
+
+def _obtener_pool_facturas(max_workers: int) -> ProcessPoolExecutor:
+    global _pool_facturas
+    with _pool_facturas_lock:
+        if _pool_facturas is not None and _pool_facturas[0] != max_workers:
+            _pool_facturas[1].shutdown(wait=False, cancel_futures=True)
+            _pool_facturas = None
+        if _pool_facturas is None:
+            _pool_facturas = (max_workers, ProcessPoolExecutor(max_workers=max_workers, initializer=_inicializar_worker_facturas))
+        return _pool_facturas[1]
+
+def cerrar_pool_facturas(executor: ProcessPoolExecutor | None = None):
+    """
+    Detiene el pool de facturas (al salir del proceso, o si un worker murió y el pool quedó roto).
+    Con `executor` solo lo detiene si sigue siendo el pool en uso: otra petición puede haberlo
+    reemplazado ya.
+    """
+    global _pool_facturas
+    with _pool_facturas_lock:
+        if _pool_facturas is not None and executor in (None, _pool_facturas[1]):
+            _pool_facturas[1].shutdown(wait=False, cancel_futures=True)
+            _pool_facturas = None
+
+atexit.register(cerrar_pool_facturas)
+
+def _resultado_factura(executor: ProcessPoolExecutor, future) -> bytes:
+    """PDF de un future del pool; si un worker murió, la próxima descarga crea un pool nuevo."""
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        cerrar_pool_facturas(executor)
+        raise
+
+def _renderizar_factura_worker(usuario, historico_lecturas, fecha_emision, periodo_facturacion, base_url, consumos_mensuales=None) -> bytes:
+    """Punto de entrada en los procesos del pool: recibe el usuario, sus lecturas y sus consumos ya cargados."""
+    return utils.generar_pdf_factura(
+        usuario=usuario,
+        fecha_emision=fecha_emision,
+        periodo_facturacion=periodo_facturacion,
+        base_url=base_url,
+        historico_lecturas=historico_lecturas,
+        consumos_mensuales=consumos_mensuales
+    )
+
+def cargar_datos_facturacion(usuarios=None, chunk_size: int = 500):
+    """
+    Recorre los usuarios en orden de contrato con sus últimas seis lecturas ya cargadas
+    en `usuario.ultimas_lecturas` y sus últimos seis meses de consumo (ConsumoMensual) en
+    `usuario.ultimos_consumos`. Los Prefetch con slice se resuelven con ROW_NUMBER() por
+    usuario, así que son tres consultas por bloque de `chunk_size` usuarios sin importar
+    cuántas lecturas tenga cada uno.
+    """
+    if usuarios is None:
+        usuarios = UserAcueducto.objects.all()
+    ultimas_lecturas = Prefetch(
+        'lecturas',
+        queryset=HistoricoLectura.objects.order_by('-fecha_lectura')[:6],
+        to_attr='ultimas_lecturas'
+    )
+    ultimos_consumos = Prefetch(
+        'consumos_mensuales',
+        queryset=ConsumoMensual.objects.order_by('-periodo')[:6],
+        to_attr='ultimos_consumos'
+    )
+    return usuarios.order_by('contrato').prefetch_related(ultimas_lecturas, ultimos_consumos).iterator(chunk_size=chunk_size)
+
+# Margen que se carga antes de `desde` para tener la lectura anterior del primer mes del reporte
+MARGEN_LECTURA_ANTERIOR = timedelta(days=62)
+
+def consumo_por_periodo_service(desde=None, zona: str = '', categoria: str = '') -> list[dict]:
+    """
+    Consumo por mes y categoría para los reportes, calculado por el motor de facturación
+    (facturacion.consumo_por_periodo) con las lecturas desde la fecha `desde`.
+    Devuelve [{'anio', 'mes', 'categoria', 'consumo'}] ordenado por mes y categoría.
+    """
+    usuarios = UserAcueducto.objects.all()
+    if zona:
+        usuarios = usuarios.filter(zona=zona)
+    if categoria:
+        usuarios = usuarios.filter(categoria=categoria)
+    categorias = dict(usuarios.values_list('id', 'categoria'))
+    columnas = facturacion.cargar_columnas(
+        usuarios if zona or categoria else None,
+        desde - MARGEN_LECTURA_ANTERIOR if desde else None
+    )
+    primer_periodo = facturacion.periodo(desde) if desde else None
+    totales = facturacion.consumo_por_periodo(columnas, categorias)
+    return [
+        {'anio': anio, 'mes': mes, 'categoria': categoria_usuario, 'consumo': round(consumo, 3)}
+        for (categoria_usuario, numero), consumo in sorted(totales.items(), key=lambda item: (item[0][1], item[0][0]))
+        if primer_periodo is None or numero >= primer_periodo
+        for anio, mes in [facturacion.fecha_periodo(numero)]
+    ]
+
+def _periodo_facturacion(periodo_inicio_str: str, periodo_fin_str: str) -> str:
+    """Valida las fechas del período y devuelve el texto que se imprime en la factura."""
     if not periodo_inicio_str or not periodo_fin_str:
         raise ValueError('Por favor, especifique el período de facturación')
 
     periodo_inicio_fecha = datetime.strptime(periodo_inicio_str, '%Y-%m-%d')
     periodo_fin_fecha = datetime.strptime(periodo_fin_str, '%Y-%m-%d')
-    periodo_facturacion = f"Del {utils.formatear_fecha_espanol(periodo_inicio_fecha)} al {utils.formatear_fecha_espanol(periodo_fin_fecha)}"
+    return f"Del {utils.formatear_fecha_espanol(periodo_inicio_fecha)} al {utils.formatear_fecha_espanol(periodo_fin_fecha)}"
 
-    zip_buffer = BytesIO()
+def _iterar_facturas(periodo_facturacion: str, max_workers: int | None = None, usuarios=None):
+    """
+    Recorre los usuarios (todos, o el queryset `usuarios`) en orden de contrato y produce tuplas (usuario, obtener_pdf),
+    donde obtener_pdf() devuelve los bytes del PDF de ese usuario.
+    Con más de un worker las facturas se renderizan en el ProcessPoolExecutor del proceso
+    (compartido entre peticiones), que va como máximo 2 * max_workers facturas por delante del consumidor, para que la
+    memoria no crezca con el número de usuarios.
+    """
     # Ensure settings.BASE_DIR is Path object or string for correct path joining
     base_url = os.path.join(str(settings.BASE_DIR), 'acueducto', 'static') # Use os.path.join for robustness
+    fecha_emision = datetime.now() # Consider making this configurable or using timezone.now()
+    usuarios = cargar_datos_facturacion(usuarios)
+    if max_workers is None:
+        max_workers = _max_workers_facturas()
 
-    with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-        for usuario in UserAcueducto.objects.all():
-            try:
-                # Assuming utils.generar_pdf_factura returns a temporary file object (like NamedTemporaryFile)
-                pdf_file_obj = utils.generar_pdf_factura(
-                    usuario=usuario,
-                    fecha_emision=datetime.now(), # Consider making this configurable or using timezone.now()
-                    periodo_facturacion=periodo_facturacion,
-                    base_url=base_url
-                )
+    if max_workers <= 1:
+        for usuario in usuarios:
+            yield usuario, partial(
+                utils.generar_pdf_factura,
+                usuario=usuario,
+                fecha_emision=fecha_emision,
+                periodo_facturacion=periodo_facturacion,
+                base_url=base_url,
+                historico_lecturas=usuario.ultimas_lecturas,
+                consumos_mensuales=usuario.ultimos_consumos
+            )
+        return
 
-                with open(pdf_file_obj.name, 'rb') as pdf_content_file:
-                    zip_file.writestr(f'factura_{usuario.contrato}.pdf', pdf_content_file.read())
+    pendientes = deque()
+    executor = _obtener_pool_facturas(max_workers)
+    try:
+        for usuario in usuarios:
+            future = executor.submit(
+                _renderizar_factura_worker, usuario, usuario.ultimas_lecturas,
+                fecha_emision, periodo_facturacion, base_url, usuario.ultimos_consumos
+            )
+            pendientes.append((usuario, future))
+            if len(pendientes) >= 2 * max_workers:
+                usuario_listo, future_listo = pendientes.popleft()
+                yield usuario_listo, partial(_resultado_factura, executor, future_listo)
+        while pendientes:
+            usuario_listo, future_listo = pendientes.popleft()
+            yield usuario_listo, partial(_resultado_factura, executor, future_listo)
+    except BrokenProcessPool:
+        # submit() sobre un pool que ya se rompió
+        cerrar_pool_facturas(executor)
+        raise
+    finally:
+        # Si hubo un error o el cliente cortó la descarga, no se renderiza lo que falta
+        for _, future in pendientes:
+            future.cancel()
 
-                os.unlink(pdf_file_obj.name) # Clean up the temporary PDF file
-            except Exception as e:
-                # Consider logging the error or handling it more gracefully
-                raise Exception(f'Error al generar factura para {usuario.contrato}: {str(e)}')
+def _obtener_pdf_factura(usuario, obtener_pdf) -> bytes:
+    try:
+        return obtener_pdf()
+    except Exception as e:
+        # Consider logging the error or handling it more gracefully
+        raise Exception(f'Error al generar factura para {usuario.contrato}: {str(e)}')
+
+def generar_zip_todas_facturas_service(periodo_inicio_str: str, periodo_fin_str: str, max_workers: int | None = None) -> BytesIO:
+    """
+    Genera un archivo ZIP con todas las facturas para el período dado.
+    Las facturas se renderizan en un ProcessPoolExecutor de `max_workers` procesos
+    (por defecto settings.FACTURAS_MAX_WORKERS) y se agregan al ZIP en orden de contrato.
+    """
+    periodo_facturacion = _periodo_facturacion(periodo_inicio_str, periodo_fin_str)
+
+    zip_buffer = BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
+        for usuario, obtener_pdf in _iterar_facturas(periodo_facturacion, max_workers):
+            zip_file.writestr(f'factura_{usuario.contrato}.pdf', _obtener_pdf_factura(usuario, obtener_pdf))
 
     zip_buffer.seek(0) # Reset buffer position to the beginning before reading
     return zip_buffer
 
-def crear_nueva_ruta_service(nombre_ruta: str, usuarios_orden_data: list) -> Ruta:
+def generar_zip_todas_facturas_stream_service(periodo_inicio_str: str, periodo_fin_str: str, max_workers: int | None = None):
     """
-    Crea una nueva ruta de lectura.
-    Elimina todas las rutas existentes antes de crear una nueva.
+    Igual que generar_zip_todas_facturas_service pero devuelve un generador de bytes
+    para un StreamingHttpResponse. Cada factura_<contrato>.pdf se envía en cuanto está
+    renderizada, así que la memoria usada no depende del número de usuarios.
+    Una factura que no se puede generar no corta la descarga (ya se respondió 200): se
+    omite y el error queda en errores.txt al final del ZIP, como en _ejecutar_zip_facturas.
+    Las fechas se validan antes de devolver el generador para poder informar el error.
+    """
+    periodo_facturacion = _periodo_facturacion(periodo_inicio_str, periodo_fin_str)
+
+    def _stream():
+        buffer = utils.ZipStreamBuffer()
+        errores = []
+        # Sin seek() ZipFile escribe data descriptors tras cada entrada
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+            for usuario, obtener_pdf in _iterar_facturas(periodo_facturacion, max_workers):
+                # El PDF se genera antes de abrir la entrada para no dejarla a medias
+                try:
+                    pdf_bytes = _obtener_pdf_factura(usuario, obtener_pdf)
+                except Exception as e:
+                    errores.append(str(e))
+                    continue
+                zip_file.writestr(f'factura_{usuario.contrato}.pdf', pdf_bytes)
+                yield buffer.pop()
+            if errores:
+                zip_file.writestr('errores.txt', '\n'.join(errores) + '\n')
+        yield buffer.pop() # Directorio central
+
+    return _stream()
+
+def pagina_usuarios_service(busqueda: str = '', despues_de: str = '', limite: int | None = None) -> tuple[list, str | None]:
+    """
+    Página de usuarios ordenada por contrato con paginación por cursor (keyset): en lugar de
+    OFFSET se filtra contrato > último contrato de la página anterior, así cualquier página
+    cuesta lo mismo. Devuelve (usuarios, siguiente), donde siguiente es el contrato desde el
+    que pedir la próxima página o None si no hay más.
+    """
+    limite = limite or settings.LISTA_USUARIOS_TAMANO_PAGINA
+    usuarios = busqueda_usuarios.filtrar_usuarios(UserAcueducto.objects.order_by('contrato'), busqueda)
+    if despues_de:
+        usuarios = usuarios.filter(contrato__gt=despues_de)
+
+    # Se pide una fila de más solo para saber si hay otra página
+    pagina = list(usuarios[:limite + 1])
+    siguiente = pagina[limite - 1].contrato if len(pagina) > limite else None
+    return pagina[:limite], siguiente
+
+def pagina_ordenes_ruta_service(ruta_id: int, despues_de: int | None = None, limite: int | None = None) -> tuple[list, int | None]:
+    """
+    Paradas de una ruta en orden de visita, con el usuario, por cursor sobre `orden` (único
+    dentro de la ruta), como pagina_usuarios_service. Devuelve (órdenes, siguiente).
+    """
+    limite = limite or settings.LISTA_USUARIOS_TAMANO_PAGINA
+    ordenes = OrdenRuta.objects.filter(ruta_id=ruta_id).select_related('usuario').order_by('orden')
+    if despues_de is not None:
+        ordenes = ordenes.filter(orden__gt=despues_de)
+    pagina = list(ordenes[:limite + 1])
+    siguiente = pagina[limite - 1].orden if len(pagina) > limite else None
+    return pagina[:limite], siguiente
+
+# Órdenes por INSERT al crear una ruta (Django lo reduce si el motor admite menos parámetros)
+TAMANO_LOTE_ORDENES = 1000
+
+def proponer_orden_ruta_service(usuario_ids) -> list[int]:
+    """Ids de los usuarios en el orden de visita que propone rutas.ordenar_usuarios"""
+    usuarios = UserAcueducto.objects.filter(id__in=list(usuario_ids)).only(
+        'id', 'contrato', 'zona', 'address', 'latitud', 'longitud'
+    )
+    return [usuario.id for usuario in planificacion_rutas.ordenar_usuarios(usuarios)]
+
+def rutas_activas_lector(lector):
+    """
+    Rutas activas que trabaja `lector` (un User o None): primero las asignadas a él y luego
+    las que no tienen lector. Un lector anónimo solo ve las rutas sin lector.
+    """
+    rutas = Ruta.objects.filter(activa=True)
+    if lector is not None and lector.is_authenticated:
+        return rutas.filter(Q(lector=lector) | Q(lector__isnull=True)).order_by(
+            F('lector').asc(nulls_last=True), 'fecha_creacion'
+        )
+    return rutas.filter(lector__isnull=True).order_by('fecha_creacion')
+
+def ruta_lector_para_usuario(lector, usuario_id: int) -> int | None:
+    """
+    Id de la ruta de `lector` donde está la orden de `usuario_id`: entre sus rutas activas,
+    primero una con la orden pendiente y luego en el orden de rutas_activas_lector. None si
+    el usuario no está en ninguna. Una sola consulta por el índice de OrdenRuta.usuario.
+    """
+    return (
+        OrdenRuta.objects.filter(usuario_id=usuario_id, ruta__in=rutas_activas_lector(lector))
+        .order_by('lectura_tomada', F('ruta__lector').asc(nulls_last=True), 'ruta__fecha_creacion')
+        .values_list('ruta_id', flat=True).first()
+    )
+
+def _archivar_rutas_activas(lector_ids):
+    """Archiva las rutas activas de los lectores indicados (None: las rutas sin lector)"""
+    condicion = Q(lector_id__in=[lector_id for lector_id in lector_ids if lector_id is not None])
+    if None in lector_ids:
+        condicion |= Q(lector__isnull=True)
+    Ruta.objects.filter(condicion, activa=True).update(activa=False, fecha_finalizacion=timezone.now())
+
+def crear_nueva_ruta_service(nombre_ruta: str, usuarios_orden_data: list, optimizar: bool = False,
+                             lector_id: int | None = None) -> Ruta:
+    """
+    Crea una nueva ruta de lectura en una transacción, asignada a `lector_id` si se indica.
+    La ruta activa anterior del mismo lector (o las rutas sin lector) se archiva (activa=False)
+    en lugar de eliminarse, así se conserva su historial; las órdenes se insertan con
+    bulk_create por lotes. Con `optimizar` se ignora el orden recibido y se usa el que
+    propone proponer_orden_ruta_service.
     """
     if not nombre_ruta or not usuarios_orden_data:
         raise ValueError("Nombre de ruta y usuarios son requeridos para crear la ruta.") # Or handle as a more specific exception
 
-    # Eliminar todas las rutas existentes antes de crear una nueva
-    Ruta.objects.all().delete() # Consider if this is truly desired, or if routes should be deactivated/archived.
-                                # For now, matching existing logic.
+    try:
+        ordenes = [(int(usuario_data['id']), int(usuario_data['orden'])) for usuario_data in usuarios_orden_data]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Cada usuario de la ruta debe tener 'id' y 'orden' numéricos.")
+    if len({orden for _, orden in ordenes}) != len(ordenes):
+        raise ValueError("Hay posiciones repetidas en el orden de la ruta.")
+    usuario_ids = {usuario_id for usuario_id, _ in ordenes}
+    if optimizar:
+        propuesto = proponer_orden_ruta_service(usuario_ids)
+        existentes = len(propuesto)
+        ordenes = [(usuario_id, orden) for orden, usuario_id in enumerate(propuesto, 1)]
+    else:
+        existentes = UserAcueducto.objects.filter(id__in=usuario_ids).count()
+    if existentes != len(usuario_ids):
+        raise ValueError("La ruta incluye usuarios que no existen.")
+    if lector_id is not None and not User.objects.filter(id=lector_id).exists():
+        raise ValueError("El lector no existe.")
 
-    # Crear la nueva ruta
-    nueva_ruta = Ruta.objects.create(nombre=nombre_ruta)
-
-    for usuario_data in usuarios_orden_data:
-        OrdenRuta.objects.create(
-            ruta=nueva_ruta,
-            usuario_id=usuario_data['id'], # Assuming 'id' is passed in usuario_data
-            orden=usuario_data['orden']    # Assuming 'orden' is passed
+    with transaction.atomic():
+        _archivar_rutas_activas([lector_id])
+        # bulk_create no dispara las señales de OrdenRuta: el contador se fija al crear la ruta
+        nueva_ruta = Ruta.objects.create(nombre=nombre_ruta, lector_id=lector_id, total_ordenes=len(ordenes))
+        OrdenRuta.objects.bulk_create(
+            [OrdenRuta(ruta=nueva_ruta, usuario_id=usuario_id, orden=orden) for usuario_id, orden in ordenes],
+            batch_size=TAMANO_LOTE_ORDENES
         )
 
     return nueva_ruta
 
+def repartir_rutas_service(nombre_base: str, lector_ids: list, zona: str = '') -> list[Ruta]:
+    """
+    Reparte los usuarios (todos o los de `zona`) en una ruta activa por lector. Se ordenan
+    todos con rutas.ordenar_usuarios y el recorrido se corta en tramos consecutivos de igual
+    tamaño (difieren en a lo sumo un usuario): cada lector recibe la misma carga en una zona
+    compacta. Las rutas activas anteriores de esos lectores se archivan.
+    """
+    lector_ids = list(dict.fromkeys(int(lector_id) for lector_id in lector_ids))
+    if not nombre_base or not lector_ids:
+        raise ValueError("Nombre de ruta y lectores son requeridos para repartir las rutas.")
+    if User.objects.filter(id__in=lector_ids).count() != len(lector_ids):
+        raise ValueError("Hay lectores que no existen.")
+
+    usuarios = UserAcueducto.objects.only('id', 'contrato', 'zona', 'address', 'latitud', 'longitud')
+    if zona:
+        usuarios = usuarios.filter(zona=zona)
+    recorrido = [usuario.id for usuario in planificacion_rutas.ordenar_usuarios(usuarios)]
+    if not recorrido:
+        raise ValueError("No hay usuarios para repartir.")
+
+    tramos = []
+    cantidad, sobrantes = divmod(len(recorrido), len(lector_ids))
+    inicio = 0
+    for indice in range(len(lector_ids)):
+        fin = inicio + cantidad + (1 if indice < sobrantes else 0)
+        tramos.append(recorrido[inicio:fin])
+        inicio = fin
+
+    with transaction.atomic():
+        _archivar_rutas_activas(lector_ids)
+        rutas = [
+            Ruta.objects.create(
+                nombre=f'{nombre_base} {indice}/{len(lector_ids)}', lector_id=lector_id, total_ordenes=len(tramo)
+            )
+            for indice, (lector_id, tramo) in enumerate(zip(lector_ids, tramos), 1)
+            if tramo
+        ]
+        OrdenRuta.objects.bulk_create(
+            [
+                OrdenRuta(ruta=ruta, usuario_id=usuario_id, orden=orden)
+                for ruta, tramo in zip(rutas, tramos)
+                for orden, usuario_id in enumerate(tramo, 1)
+            ],
+            batch_size=TAMANO_LOTE_ORDENES
+        )
+    return rutas
+
 def finalizar_ruta_service(ruta_id: int) -> tuple[bool, str, Ruta | None]:
     """
     Finaliza una ruta de lectura.
@@ -88,6 +442,609 @@ def finalizar_ruta_service(ruta_id: int) -> tuple[bool, str, Ruta | None]:
     # Marcar la ruta como finalizada
     ruta.activa = False
     ruta.fecha_finalizacion = timezone.now()
-    ruta.save()
+    ruta.save(update_fields=['activa', 'fecha_finalizacion'])
 
     return True, 'Ruta finalizada exitosamente', ruta
+
+def marcar_lecturas_tomadas(usuario_ids, ruta_ids=None) -> int:
+    """
+    Marca como tomadas las órdenes pendientes de los usuarios en las rutas indicadas (por
+    defecto, las activas) y suma las marcadas al contador de cada ruta con F(). El UPDATE
+    filtra lectura_tomada=False, así dos peticiones concurrentes no cuentan dos veces la
+    misma orden. Devuelve cuántas órdenes se marcaron.
+    """
+    if not usuario_ids:
+        return 0
+    if ruta_ids is None:
+        ruta_ids = list(Ruta.objects.filter(activa=True).values_list('id', flat=True))
+    marcadas_total = 0
+    with transaction.atomic():
+        for ruta_id in ruta_ids:
+            marcadas = OrdenRuta.objects.filter(
+                ruta_id=ruta_id, usuario_id__in=usuario_ids, lectura_tomada=False
+            ).update(lectura_tomada=True)
+            if marcadas:
+                Ruta.objects.filter(pk=ruta_id).update(lecturas_completadas=F('lecturas_completadas') + marcadas)
+            marcadas_total += marcadas
+    return marcadas_total
+
+def registrar_lectura_service(usuario_id: int, lectura, ruta_id: int | None = None) -> tuple[HistoricoLectura, int]:
+    """
+    Registra la lectura de hoy de un usuario en una transacción: el histórico, su mes en
+    ConsumoMensual (un upsert), solo las columnas lectura y fecha_ultima_lectura del
+    usuario y, si se indica la ruta, su orden
+    marcada como tomada con un único UPDATE (más el contador de la ruta si la orden cambió).
+    Devuelve (histórico creado, órdenes marcadas). Lanza UserAcueducto.DoesNotExist si el
+    usuario no existe y ValueError si la lectura no es un número.
+    """
+    lectura = float(lectura)
+    fecha_actual = timezone.now().date()
+    with transaction.atomic():
+        # El UPDATE también comprueba que el usuario existe, sin un SELECT previo
+        if not UserAcueducto.objects.filter(pk=usuario_id).update(lectura=lectura, fecha_ultima_lectura=fecha_actual):
+            raise UserAcueducto.DoesNotExist('Usuario no encontrado')
+        historico = HistoricoLectura(usuario_id=usuario_id, lectura=lectura, fecha_lectura=fecha_actual)
+        historico._consumo_pendiente = True
+        historico.save(force_insert=True)
+        consumos_mensuales.registrar_lectura_actual(historico)
+        marcadas = 0
+        if ruta_id is not None:
+            marcadas = OrdenRuta.objects.filter(
+                ruta_id=ruta_id, usuario_id=usuario_id, lectura_tomada=False
+            ).update(lectura_tomada=True)
+            if marcadas:
+                Ruta.objects.filter(pk=ruta_id).update(lecturas_completadas=F('lecturas_completadas') + marcadas)
+    return historico, marcadas
+
+def _conteo_ordenes(**filtros):
+    ordenes = (
+        OrdenRuta.objects.filter(ruta=OuterRef('pk'), **filtros)
+        .order_by().values('ruta').annotate(total=Count('pk')).values('total')
+    )
+    return Coalesce(Subquery(ordenes, output_field=IntegerField()), Value(0))
+
+def reconciliar_contadores_rutas(solo_activas: bool = False) -> int:
+    """
+    Recalcula total_ordenes y lecturas_completadas desde OrdenRuta, para corregir los cambios
+    hechos con update() u otras vías que no pasan por las señales. Devuelve cuántas rutas
+    tenían contadores desactualizados.
+    """
+    rutas = Ruta.objects.all()
+    if solo_activas:
+        rutas = rutas.filter(activa=True)
+    rutas = rutas.annotate(
+        total_real=_conteo_ordenes(), completadas_real=_conteo_ordenes(lectura_tomada=True)
+    )
+    with transaction.atomic():
+        desactualizadas = rutas.exclude(
+            total_ordenes=F('total_real'), lecturas_completadas=F('completadas_real')
+        ).values_list('id', flat=True)
+        return Ruta.objects.filter(id__in=list(desactualizadas)).update(
+            total_ordenes=_conteo_ordenes(), lecturas_completadas=_conteo_ordenes(lectura_tomada=True)
+        )
+
+def ruta_activa_vista_service(lector=None):
+    """
+    Ruta activa del lector (rutas_activas_lector) con solo las columnas que muestra la toma
+    de lectura: id, nombre y los contadores de avance. None si no tiene una ruta activa.
+    """
+    return rutas_activas_lector(lector).only(
+        'id', 'nombre', 'activa', 'total_ordenes', 'lecturas_completadas'
+    ).first()
+
+def ordenes_ruta_vista_service(ruta):
+    """
+    Órdenes de la ruta como diccionarios con los datos de la lista de toma de lectura. La
+    última lectura sale de UserAcueducto.lectura/fecha_ultima_lectura en vez del histórico;
+    el histórico de cada usuario se pide aparte (historial_lecturas_service) al abrirlo.
+    El queryset es perezoso: se evalúa al renderizar, después de registrar una lectura.
+    """
+    return ruta.ordenruta_set.values(
+        'orden', 'lectura_tomada', 'usuario_id',
+        contrato=F('usuario__contrato'),
+        address=F('usuario__address'),
+        ultima_lectura=F('usuario__lectura'),
+        fecha_ultima_lectura=F('usuario__fecha_ultima_lectura'),
+    )
+
+# Lecturas del historial de un usuario que se entregan por defecto
+LECTURAS_HISTORIAL = 6
+
+def historial_lecturas_service(usuario_id: int, limite: int = LECTURAS_HISTORIAL) -> list[dict]:
+    """Últimas `limite` lecturas del usuario (fecha y valor), la más reciente primero"""
+    return list(
+        HistoricoLectura.objects.filter(usuario_id=usuario_id)
+        .order_by('-fecha_lectura').values('fecha_lectura', 'lectura')[:limite]
+    )
+
+# Lecturas anteriores de cada usuario que viajan en el paquete de la ruta (las del histórico)
+LECTURAS_PAQUETE_RUTA = 6
+
+def paquete_ruta_service(ruta_id=None, lector=None) -> dict | None:
+    """
+    Paquete para trabajar la ruta activa del lector sin conexión: la ruta y sus órdenes con los
+    datos del usuario y sus últimas lecturas. `version` es un hash del contenido, así el
+    dispositivo solo lo vuelve a descargar cuando algo cambió.
+    """
+    rutas = rutas_activas_lector(lector)
+    if ruta_id:
+        rutas = rutas.filter(id=ruta_id)
+    ruta = rutas.first()
+    if ruta is None:
+        return None
+
+    ordenes = ruta.ordenruta_set.select_related('usuario').prefetch_related(Prefetch(
+        'usuario__lecturas',
+        queryset=HistoricoLectura.objects.order_by('-fecha_lectura')[:LECTURAS_PAQUETE_RUTA],
+        to_attr='ultimas_lecturas'
+    ))
+    contenido = {
+        'ruta': {
+            'id': ruta.id,
+            'nombre': ruta.nombre,
+            'fecha_creacion': ruta.fecha_creacion.isoformat(),
+        },
+        'ordenes': [
+            {
+                'orden': orden.orden,
+                'lectura_tomada': orden.lectura_tomada,
+                'usuario': {
+                    'id': orden.usuario.id,
+                    'contrato': orden.usuario.contrato,
+                    'nombre': f"{orden.usuario.name} {orden.usuario.lastname}",
+                    'address': orden.usuario.address,
+                    'numero_de_medidor': orden.usuario.numero_de_medidor,
+                    'lectura': orden.usuario.lectura,
+                    'fecha_ultima_lectura': orden.usuario.fecha_ultima_lectura.isoformat() if orden.usuario.fecha_ultima_lectura else None,
+                    'lecturas': [
+                        {'fecha_lectura': lectura.fecha_lectura.isoformat(), 'lectura': lectura.lectura}
+                        for lectura in orden.usuario.ultimas_lecturas
+                    ],
+                },
+            }
+            for orden in ordenes
+        ],
+    }
+    version = hashlib.sha256(json.dumps(contenido, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return {'version': version, **contenido}
+
+def _validar_lectura_lote(item) -> tuple[dict | None, str]:
+    """Normaliza una lectura del lote; devuelve (datos, '') o (None, error)"""
+    if not isinstance(item, dict):
+        return None, 'Formato inválido'
+    id_cliente = str(item.get('id_cliente') or '').strip()
+    if not id_cliente or len(id_cliente) > 64:
+        return None, 'id_cliente es obligatorio (máximo 64 caracteres)'
+    if not item.get('contrato') and not item.get('usuario_id'):
+        return None, 'Debe indicar contrato o usuario_id'
+    try:
+        lectura = float(item.get('lectura'))
+    except (TypeError, ValueError):
+        return None, 'Lectura inválida'
+    if lectura < 0:
+        return None, 'Lectura inválida'
+    fecha_lectura = timezone.localdate()
+    if item.get('fecha_lectura'):
+        try:
+            fecha_lectura = datetime.strptime(item['fecha_lectura'], '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return None, 'fecha_lectura inválida (formato AAAA-MM-DD)'
+        if fecha_lectura > timezone.localdate():
+            return None, 'fecha_lectura no puede ser futura'
+    return {
+        'id_cliente': id_cliente,
+        'contrato': str(item['contrato']) if item.get('contrato') else None,
+        'usuario_id': item.get('usuario_id'),
+        'lectura': lectura,
+        'fecha_lectura': fecha_lectura,
+    }, ''
+
+def _aplicar_lote_lecturas(items: list, ruta_ids=None) -> list[dict]:
+    resultados = []
+    validas = []
+    for indice, item in enumerate(items):
+        datos, error = _validar_lectura_lote(item)
+        resultado = {'indice': indice, 'id_cliente': item.get('id_cliente') if isinstance(item, dict) else None}
+        if datos is None:
+            resultado.update(estado='error', error=error)
+        else:
+            validas.append((resultado, datos))
+        resultados.append(resultado)
+
+    # Una consulta para las lecturas ya recibidas en un envío anterior y dos para los usuarios
+    ya_recibidas = set(HistoricoLectura.objects.filter(
+        id_cliente__in=[datos['id_cliente'] for _, datos in validas]
+    ).values_list('id_cliente', flat=True))
+    por_contrato = UserAcueducto.objects.in_bulk(
+        [datos['contrato'] for _, datos in validas if datos['contrato']], field_name='contrato'
+    )
+    por_id = UserAcueducto.objects.in_bulk(
+        [datos['usuario_id'] for _, datos in validas if not datos['contrato'] and str(datos['usuario_id']).isdigit()]
+    )
+
+    nuevas = []
+    usuarios_actualizados = {}
+    for resultado, datos in validas:
+        if datos['id_cliente'] in ya_recibidas:
+            resultado['estado'] = 'duplicada'
+            continue
+        if datos['contrato']:
+            usuario = por_contrato.get(datos['contrato'])
+        else:
+            usuario = por_id.get(int(datos['usuario_id'])) if str(datos['usuario_id']).isdigit() else None
+        if usuario is None:
+            resultado.update(estado='error', error='Usuario no encontrado')
+            continue
+
+        ya_recibidas.add(datos['id_cliente'])
+        nuevas.append(HistoricoLectura(
+            usuario=usuario,
+            lectura=datos['lectura'],
+            fecha_lectura=datos['fecha_lectura'],
+            id_cliente=datos['id_cliente'],
+        ))
+        # Una lectura tomada sin conexión días atrás no reemplaza una más reciente del usuario
+        if usuario.fecha_ultima_lectura is None or datos['fecha_lectura'] >= usuario.fecha_ultima_lectura:
+            usuario.lectura = datos['lectura']
+            usuario.fecha_ultima_lectura = datos['fecha_lectura']
+            usuarios_actualizados[usuario.pk] = usuario
+        resultado['estado'] = 'creada'
+        resultado['contrato'] = usuario.contrato
+
+    HistoricoLectura.objects.bulk_create(nuevas)
+    UserAcueducto.objects.bulk_update(usuarios_actualizados.values(), ['lectura', 'fecha_ultima_lectura'])
+    # bulk_create no dispara las señales de HistoricoLectura: el consumo mensual se recalcula
+    # desde el mes de la lectura más antigua del lote
+    if nuevas:
+        consumos_mensuales.recalcular_consumos(
+            {lectura.usuario_id for lectura in nuevas}, min(lectura.fecha_lectura for lectura in nuevas)
+        )
+    marcar_lecturas_tomadas({lectura.usuario_id for lectura in nuevas}, ruta_ids)
+    return resultados
+
+def registrar_lecturas_lote_service(items: list, ruta_ids=None) -> list[dict]:
+    """
+    Registra en una sola transacción las lecturas que un lector tomó sin conexión. Cada
+    lectura trae un id_cliente generado por el dispositivo: si ya se recibió (un reenvío del
+    mismo lote) se informa como 'duplicada' y no se vuelve a guardar. Las órdenes se marcan
+    solo en `ruta_ids` (las rutas del lector; por defecto, todas las activas).
+    Devuelve un resultado por lectura, en el mismo orden: estado 'creada', 'duplicada' o 'error'.
+    """
+    try:
+        with transaction.atomic():
+            return _aplicar_lote_lecturas(items, ruta_ids)
+    except IntegrityError:
+        # Otro envío del mismo lote guardó alguna lectura entre la consulta y el insert:
+        # al repetir, esas lecturas aparecen como duplicadas
+        with transaction.atomic():
+            return _aplicar_lote_lecturas(items, ruta_ids)
+
+def _factura_individual(contrato: str, fecha_emision_str: str | None, periodo_inicio_str: str, periodo_fin_str: str):
+    """Renderiza la factura de un contrato y devuelve (usuario, pdf_bytes)."""
+    periodo_facturacion = _periodo_facturacion(periodo_inicio_str, periodo_fin_str)
+    fecha_emision = datetime.strptime(fecha_emision_str, '%Y-%m-%d') if fecha_emision_str else datetime.now()
+    usuario = UserAcueducto.objects.get(contrato=contrato)
+    pdf_bytes = utils.generar_pdf_factura(
+        usuario=usuario,
+        fecha_emision=fecha_emision,
+        periodo_facturacion=periodo_facturacion,
+        base_url=os.path.join(str(settings.BASE_DIR), 'acueducto', 'static')
+    )
+    return usuario, pdf_bytes
+
+def encolar_zip_facturas_service(periodo_inicio_str: str, periodo_fin_str: str) -> TrabajoFacturacion:
+    """Valida el período y deja en cola la generación del ZIP con todas las facturas."""
+    _periodo_facturacion(periodo_inicio_str, periodo_fin_str)
+    return TrabajoFacturacion.objects.create(
+        tipo='zip_facturas',
+        parametros={'periodo_inicio': periodo_inicio_str, 'periodo_fin': periodo_fin_str}
+    )
+
+def encolar_email_factura_service(contrato: str, fecha_emision_str: str | None, periodo_inicio_str: str, periodo_fin_str: str) -> TrabajoFacturacion:
+    """Valida los datos y deja en cola el envío por email de la factura de un contrato."""
+    _periodo_facturacion(periodo_inicio_str, periodo_fin_str)
+    if fecha_emision_str:
+        datetime.strptime(fecha_emision_str, '%Y-%m-%d')
+    get_object_or_404(UserAcueducto, contrato=contrato)
+    return TrabajoFacturacion.objects.create(
+        tipo='email_factura',
+        total=1,
+        parametros={
+            'contrato': contrato,
+            'fecha_emision': fecha_emision_str,
+            'periodo_inicio': periodo_inicio_str,
+            'periodo_fin': periodo_fin_str,
+        }
+    )
+
+def tomar_siguiente_trabajo() -> TrabajoFacturacion | None:
+    """
+    Reserva el trabajo pendiente más antiguo. El UPDATE condicionado al estado hace que
+    dos workers no puedan tomar el mismo trabajo, también en SQLite.
+    """
+    while True:
+        trabajo = TrabajoFacturacion.objects.filter(estado='pendiente').order_by('fecha_creacion', 'id').first()
+        if trabajo is None:
+            return None
+        tomado = TrabajoFacturacion.objects.filter(id=trabajo.id, estado='pendiente').update(
+            estado='en_proceso', fecha_inicio=timezone.now()
+        )
+        if tomado:
+            trabajo.refresh_from_db()
+            return trabajo
+
+def _registrar_progreso(trabajo: TrabajoFacturacion, **campos):
+    TrabajoFacturacion.objects.filter(id=trabajo.id).update(**campos)
+    for campo, valor in campos.items():
+        setattr(trabajo, campo, valor)
+
+def _ejecutar_zip_facturas(trabajo: TrabajoFacturacion):
+    periodo_facturacion = _periodo_facturacion(trabajo.parametros.get('periodo_inicio'), trabajo.parametros.get('periodo_fin'))
+    _registrar_progreso(trabajo, total=UserAcueducto.objects.count())
+
+    nombre_archivo = f'trabajos/facturas_{trabajo.id}.zip'
+    ruta_archivo = os.path.join(str(settings.MEDIA_ROOT), nombre_archivo)
+    os.makedirs(os.path.dirname(ruta_archivo), exist_ok=True)
+
+    procesadas = fallidas = 0
+    errores = []
+    with zipfile.ZipFile(ruta_archivo, 'w') as zip_file:
+        for usuario, obtener_pdf in _iterar_facturas(periodo_facturacion):
+            try:
+                zip_file.writestr(f'factura_{usuario.contrato}.pdf', obtener_pdf())
+                procesadas += 1
+            except Exception as e:
+                # Una factura fallida no detiene el lote: queda registrada en el trabajo
+                fallidas += 1
+                errores.append({'contrato': usuario.contrato, 'error': str(e)})
+                _registrar_progreso(trabajo, errores=errores)
+            _registrar_progreso(trabajo, procesadas=procesadas, fallidas=fallidas)
+
+    trabajo.archivo.name = nombre_archivo
+    trabajo.save(update_fields=['archivo'])
+
+def _ejecutar_email_factura(trabajo: TrabajoFacturacion):
+    parametros = trabajo.parametros
+    usuario, pdf_bytes = _factura_individual(
+        parametros.get('contrato'),
+        parametros.get('fecha_emision'),
+        parametros.get('periodo_inicio'),
+        parametros.get('periodo_fin')
+    )
+    utils.enviar_factura_email(usuario, pdf_bytes)
+    _registrar_progreso(trabajo, procesadas=1)
+
+def _filtrar_usuarios(zona: str = '', categoria: str = ''):
+    usuarios = UserAcueducto.objects.exclude(email='')
+    if zona:
+        usuarios = usuarios.filter(zona=zona)
+    if categoria:
+        usuarios = usuarios.filter(categoria=categoria)
+    return usuarios
+
+class _LimiteEnvios:
+    """Espacia los lotes para no superar `max_por_minuto` mensajes por minuto."""
+
+    def __init__(self, max_por_minuto: int):
+        self.intervalo = 60 / max_por_minuto if max_por_minuto else 0
+        self._ultimo = None
+        self._cantidad = 0
+
+    def esperar(self, cantidad: int = 1):
+        """Espera lo que corresponde a los mensajes del lote anterior antes de enviar `cantidad`"""
+        if self.intervalo and self._ultimo is not None:
+            restante = self.intervalo * self._cantidad - (time.monotonic() - self._ultimo)
+            if restante > 0:
+                time.sleep(restante)
+        self._ultimo = time.monotonic()
+        self._cantidad = cantidad
+
+def _enviar_lote(conexion_email, mensajes: list, reintentos: int, limite: _LimiteEnvios) -> list[tuple[bool, int, str]]:
+    """
+    Envía `mensajes` por la conexión compartida con un send_messages por intento y devuelve
+    (enviado, intentos, error) de cada uno. Los backends de Django los envían en orden y se
+    detienen en el primero que falla, así que se recorre el lote con un generador para saber
+    hasta dónde llegó: los anteriores ya salieron y solo se reintenta desde el que falló, con
+    la conexión reabierta y espera creciente. Un mensaje que agota sus reintentos queda como
+    fallido y el lote sigue con el siguiente.
+    """
+    resultados = [None] * len(mensajes)
+    intentos = [0] * len(mensajes)
+    primero = 0 # Primer mensaje aún sin enviar
+    reabrir = False
+    while primero < len(mensajes):
+        alcanzado = [primero - 1] # Último mensaje que el backend tomó del lote
+
+        def _recorrer(desde):
+            for indice in range(desde, len(mensajes)):
+                alcanzado[0] = indice
+                yield mensajes[indice]
+
+        limite.esperar(len(mensajes) - primero)
+        try:
+            if reabrir:
+                # La conexión pudo quedar rota (timeout, desconexión del servidor); si no se
+                # puede reabrir cuenta como un intento fallido del mensaje pendiente
+                conexion_email.close()
+                conexion_email.open()
+                reabrir = False
+            conexion_email.send_messages(_recorrer(primero))
+            if alcanzado[0] < len(mensajes) - 1:
+                # Con fail_silently el backend devuelve 0 sin recorrer el lote si no pudo conectar
+                raise ConnectionError('No se pudo abrir la conexión de correo')
+        except Exception as e:
+            fallo = max(alcanzado[0], primero)
+            for indice in range(primero, fallo):
+                intentos[indice] += 1
+                resultados[indice] = (True, intentos[indice], '')
+            intentos[fallo] += 1
+            if intentos[fallo] > reintentos:
+                resultados[fallo] = (False, intentos[fallo], str(e))
+                primero = fallo + 1
+            else:
+                time.sleep(2 ** (intentos[fallo] - 1))
+                primero = fallo
+            reabrir = True
+        else:
+            for indice in range(primero, len(mensajes)):
+                intentos[indice] += 1
+                resultados[indice] = (True, intentos[indice], '')
+            primero = len(mensajes)
+    return resultados
+
+def enviar_facturas_masivo_service(periodo_inicio_str: str, periodo_fin_str: str, usuarios=None,
+                                   trabajo: TrabajoFacturacion | None = None, tamano_lote: int | None = None,
+                                   max_por_minuto: int | None = None, reintentos: int | None = None) -> dict:
+    """
+    Renderiza y envía por email las facturas de todos los usuarios (o del queryset `usuarios`)
+    sobre una sola conexión SMTP. Los mensajes se juntan en lotes de `tamano_lote` que salen
+    con un solo send_messages (ver _enviar_lote); tras cada lote se guarda el resultado de cada
+    destinatario en EnvioFactura y el avance del trabajo.
+    Devuelve {'total', 'enviados', 'fallidos'}.
+    """
+    periodo_facturacion = _periodo_facturacion(periodo_inicio_str, periodo_fin_str)
+    tamano_lote = tamano_lote or settings.EMAIL_MASIVO_TAMANO_LOTE
+    if max_por_minuto is None:
+        max_por_minuto = settings.EMAIL_MASIVO_MAX_POR_MINUTO
+    if reintentos is None:
+        reintentos = settings.EMAIL_MASIVO_REINTENTOS
+    if usuarios is None:
+        usuarios = _filtrar_usuarios()
+    if trabajo is not None:
+        _registrar_progreso(trabajo, total=usuarios.count())
+
+    limite = _LimiteEnvios(max_por_minuto)
+    resumen = {'total': 0, 'enviados': 0, 'fallidos': 0}
+    registros = []
+    lote = [] # (usuario, mensaje) listos para enviar
+
+    def _registrar(usuario, enviado, intentos, error):
+        resumen['enviados' if enviado else 'fallidos'] += 1
+        registros.append(EnvioFactura(
+            trabajo=trabajo, usuario=usuario, email=usuario.email,
+            enviado=enviado, intentos=intentos, error=error
+        ))
+
+    def _cerrar_lote():
+        if lote:
+            resultados = _enviar_lote(conexion_email, [mensaje for _, mensaje in lote], reintentos, limite)
+            for (usuario, _), resultado in zip(lote, resultados):
+                _registrar(usuario, *resultado)
+            lote.clear()
+        EnvioFactura.objects.bulk_create(registros)
+        if trabajo is not None:
+            _registrar_progreso(trabajo, procesadas=resumen['enviados'], fallidas=resumen['fallidos'])
+        registros.clear()
+
+    conexion_email = get_connection()
+    conexion_email.open()
+    try:
+        for usuario, obtener_pdf in _iterar_facturas(periodo_facturacion, usuarios=usuarios):
+            resumen['total'] += 1
+            try:
+                mensaje = utils.construir_email_factura(usuario, obtener_pdf(), connection=conexion_email)
+            except Exception as e:
+                _registrar(usuario, False, 0, f'Error al generar la factura: {str(e)}')
+            else:
+                lote.append((usuario, mensaje))
+                if len(lote) >= tamano_lote:
+                    _cerrar_lote()
+        _cerrar_lote()
+    finally:
+        conexion_email.close()
+    return resumen
+
+def encolar_email_masivo_service(periodo_inicio_str: str, periodo_fin_str: str, zona: str = '', categoria: str = '') -> TrabajoFacturacion:
+    """Valida el período y deja en cola el envío de facturas por email a todos los usuarios (o a una zona/categoría)."""
+    _periodo_facturacion(periodo_inicio_str, periodo_fin_str)
+    return TrabajoFacturacion.objects.create(
+        tipo='email_masivo',
+        parametros={
+            'periodo_inicio': periodo_inicio_str,
+            'periodo_fin': periodo_fin_str,
+            'zona': zona,
+            'categoria': categoria,
+        }
+    )
+
+def _ejecutar_email_masivo(trabajo: TrabajoFacturacion):
+    parametros = trabajo.parametros
+    enviar_facturas_masivo_service(
+        parametros.get('periodo_inicio'),
+        parametros.get('periodo_fin'),
+        usuarios=_filtrar_usuarios(parametros.get('zona', ''), parametros.get('categoria', '')),
+        trabajo=trabajo
+    )
+
+TIPOS_IMPORTACION = {'importar_usuarios': 'usuarios', 'importar_lecturas': 'lecturas'}
+
+def encolar_importacion_service(tipo: str, archivo, actualizar: bool = False) -> TrabajoFacturacion:
+    """
+    Guarda el CSV subido en MEDIA_ROOT/importaciones y deja en cola su importación
+    (`tipo`: 'usuarios' o 'lecturas'); `actualizar` permite modificar contratos existentes.
+    """
+    tipo_trabajo = next((clave for clave, valor in TIPOS_IMPORTACION.items() if valor == tipo), None)
+    if tipo_trabajo is None:
+        raise ValueError(f'Importación desconocida: {tipo}')
+    nombre_archivo = f'importaciones/{tipo}_{uuid.uuid4().hex}.csv'
+    ruta_archivo = os.path.join(str(settings.MEDIA_ROOT), nombre_archivo)
+    os.makedirs(os.path.dirname(ruta_archivo), exist_ok=True)
+    with open(ruta_archivo, 'wb') as destino:
+        for trozo in archivo.chunks():
+            destino.write(trozo)
+    return TrabajoFacturacion.objects.create(
+        tipo=tipo_trabajo,
+        parametros={'archivo': nombre_archivo, 'actualizar': bool(actualizar)}
+    )
+
+def _ejecutar_importacion(trabajo: TrabajoFacturacion):
+    ruta_archivo = os.path.join(str(settings.MEDIA_ROOT), trabajo.parametros['archivo'])
+    try:
+        with open(ruta_archivo, encoding='utf-8-sig', newline='') as archivo:
+            # Contar las filas es una lectura rápida del archivo y da el porcentaje de avance
+            _registrar_progreso(trabajo, total=max(sum(1 for _ in archivo) - 1, 0))
+            archivo.seek(0)
+
+            def progreso(resumen):
+                _registrar_progreso(
+                    trabajo, procesadas=resumen['filas'] - resumen['con_error'],
+                    fallidas=resumen['con_error'], errores=resumen['errores'],
+                )
+
+            if TIPOS_IMPORTACION[trabajo.tipo] == 'usuarios':
+                resumen = importacion.importar_usuarios(
+                    archivo, actualizar=trabajo.parametros.get('actualizar', False), progreso=progreso
+                )
+                detalle = f"{resumen['creados']} usuarios creados, {resumen['actualizados']} actualizados"
+            else:
+                resumen = importacion.importar_lecturas(archivo, progreso=progreso)
+                detalle = f"{resumen['creados']} lecturas importadas, {resumen['duplicados']} ya registradas"
+    finally:
+        if os.path.exists(ruta_archivo):
+            os.remove(ruta_archivo)
+    # El total final es el de filas con datos (sin las vacías)
+    _registrar_progreso(trabajo, total=resumen['filas'])
+    trabajo.mensaje = f"{detalle}, {resumen['con_error']} filas con error"
+
+EJECUTORES_TRABAJO = {
+    'zip_facturas': _ejecutar_zip_facturas,
+    'email_factura': _ejecutar_email_factura,
+    'email_masivo': _ejecutar_email_masivo,
+    'importar_usuarios': _ejecutar_importacion,
+    'importar_lecturas': _ejecutar_importacion,
+}
+
+def ejecutar_trabajo(trabajo: TrabajoFacturacion) -> TrabajoFacturacion:
+    """Ejecuta un trabajo ya reservado y deja registrado el resultado."""
+    try:
+        EJECUTORES_TRABAJO[trabajo.tipo](trabajo)
+    except Exception as e:
+        trabajo.estado = 'fallido'
+        trabajo.mensaje = str(e)
+    else:
+        trabajo.estado = 'completado'
+        if trabajo.fallidas and not trabajo.mensaje:
+            trabajo.mensaje = f'{trabajo.fallidas} de {trabajo.total} facturas no se pudieron procesar'
+    trabajo.fecha_finalizacion = timezone.now()
+    trabajo.save(update_fields=['estado', 'mensaje', 'fecha_finalizacion'])
+    return trabajo
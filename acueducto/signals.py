@@ -0,0 +1,74 @@
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import busqueda, cache_facturas, consumos
+from .models import HistoricoLectura, OrdenRuta, Ruta, UserAcueducto
+
+
+@receiver([post_save, post_delete], sender=UserAcueducto)
+def invalidar_cache_usuario(sender, instance, **kwargs):
+    cache_facturas.invalidar_usuario(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=HistoricoLectura)
+def invalidar_cache_lectura(sender, instance, **kwargs):
+    cache_facturas.invalidar_usuario(instance.usuario_id)
+
+
+@receiver(post_save, sender=HistoricoLectura)
+def actualizar_consumo_lectura_guardada(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        # registrar_lectura_service actualiza el mes por su cuenta, en una sola sentencia
+        if not getattr(instance, '_consumo_pendiente', False):
+            consumos.registrar_lectura(instance)
+    else:
+        # Una lectura editada puede cambiar su mes y los siguientes; si cambió de mes, desde el más antiguo
+        fechas = [instance.fecha_lectura, getattr(instance, '_fecha_lectura_guardada', None) or instance.fecha_lectura]
+        consumos.recalcular_consumos([instance.usuario_id], min(fechas))
+    instance._fecha_lectura_guardada = instance.fecha_lectura
+
+
+@receiver(post_delete, sender=HistoricoLectura)
+def actualizar_consumo_lectura_eliminada(sender, instance, **kwargs):
+    consumos.recalcular_consumos([instance.usuario_id], instance.fecha_lectura)
+
+
+@receiver(post_migrate)
+def instalar_indice_busqueda(sender, using, **kwargs):
+    if sender.label == 'acueducto':
+        busqueda.instalar_indice(using)
+
+
+def _ajustar_contadores_ruta(ruta_id, ordenes, completadas):
+    # Greatest evita que un contador desactualizado quede negativo (y viole el CHECK de
+    # PositiveIntegerField) al descontar; el comando reconciliar_rutas lo corrige después
+    cambios = {
+        campo: Greatest(F(campo) + delta, Value(0))
+        for campo, delta in (('total_ordenes', ordenes), ('lecturas_completadas', completadas))
+        if delta
+    }
+    if cambios:
+        Ruta.objects.filter(pk=ruta_id).update(**cambios)
+
+
+@receiver(post_save, sender=OrdenRuta)
+def contar_orden_guardada(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        _ajustar_contadores_ruta(instance.ruta_id, 1, int(instance.lectura_tomada))
+    else:
+        # Sin el valor anterior (instancia creada a mano o cargada con only()) no se ajusta
+        anterior = getattr(instance, '_lectura_tomada_guardada', None)
+        if anterior is not None:
+            _ajustar_contadores_ruta(instance.ruta_id, 0, int(instance.lectura_tomada) - int(anterior))
+    instance._lectura_tomada_guardada = instance.lectura_tomada
+
+
+@receiver(post_delete, sender=OrdenRuta)
+def descontar_orden_eliminada(sender, instance, **kwargs):
+    _ajustar_contadores_ruta(instance.ruta_id, -1, -int(instance.lectura_tomada))
@@ -0,0 +1,414 @@
+// Toma de lectura sin conexión: el paquete de la ruta activa y la cola de lecturas viven en
+// IndexedDB; las lecturas se envían por lotes a /lecturas/lote/ cuando hay conexión.
+const OfflineRuta = (() => {
+    const DB_NOMBRE = 'acueducto-toma-lectura';
+    const DB_VERSION = 1;
+    const CLAVE_PAQUETE = 'ruta_activa';
+    const TAMANO_LOTE = 200;
+    // Lecturas en cola a partir de las cuales se sincroniza sin esperar al final de la ruta
+    const SINCRONIZAR_CADA = 20;
+    const INTERVALO_SINCRONIZACION = 5 * 60 * 1000;
+
+    let config = {};
+    let db = null;
+    let paquete = null;
+    let sincronizando = false;
+    let ultimoError = '';
+
+    // --- IndexedDB ---
+
+    function abrirDB() {
+        return new Promise((resolve, reject) => {
+            const solicitud = indexedDB.open(DB_NOMBRE, DB_VERSION);
+            solicitud.onupgradeneeded = () => {
+                solicitud.result.createObjectStore('paquetes');
+                solicitud.result.createObjectStore('pendientes', { keyPath: 'id_cliente' });
+            };
+            solicitud.onsuccess = () => resolve(solicitud.result);
+            solicitud.onerror = () => reject(solicitud.error);
+        });
+    }
+
+    function operacion(store, modo, accion) {
+        return new Promise((resolve, reject) => {
+            const tx = db.transaction(store, modo);
+            const solicitud = accion(tx.objectStore(store));
+            tx.oncomplete = () => resolve(solicitud ? solicitud.result : undefined);
+            tx.onerror = () => reject(tx.error);
+        });
+    }
+
+    const leerPaquete = () => operacion('paquetes', 'readonly', store => store.get(CLAVE_PAQUETE));
+    const guardarPaquete = nuevo => operacion('paquetes', 'readwrite', store => store.put(nuevo, CLAVE_PAQUETE));
+    const borrarPaquete = () => operacion('paquetes', 'readwrite', store => store.delete(CLAVE_PAQUETE));
+    const leerPendientes = () => operacion('pendientes', 'readonly', store => store.getAll());
+    const agregarPendiente = lectura => operacion('pendientes', 'readwrite', store => store.put(lectura));
+    const quitarPendientes = ids => operacion('pendientes', 'readwrite', store => {
+        ids.forEach(id => store.delete(id));
+    });
+
+    // --- Paquete de la ruta ---
+
+    async function actualizarPaquete() {
+        const guardado = await leerPaquete();
+        if (!navigator.onLine) return guardado || null;
+        try {
+            const headers = guardado ? { 'If-None-Match': `"${guardado.version}"` } : {};
+            const response = await fetch(config.paqueteUrl, { headers, credentials: 'same-origin' });
+            if (response.status === 304) return guardado;
+            if (response.status === 404) {
+                // La ruta se finalizó; las lecturas en cola se siguen sincronizando
+                await borrarPaquete();
+                return null;
+            }
+            if (!response.ok) return guardado || null;
+            const nuevo = await response.json();
+            await guardarPaquete(nuevo);
+            return nuevo;
+        } catch (error) {
+            return guardado || null;
+        }
+    }
+
+    function buscarOrden(campo, valor) {
+        if (!paquete) return null;
+        return paquete.ordenes.find(orden => String(orden.usuario[campo]) === String(valor)) || null;
+    }
+
+    // --- Interfaz ---
+
+    function fechaHoy() {
+        // AAAA-MM-DD en la zona horaria del dispositivo
+        return new Date().toLocaleDateString('en-CA');
+    }
+
+    function formatearFecha(iso) {
+        if (!iso) return '';
+        const [anio, mes, dia] = iso.split('-');
+        return `${dia}/${mes}/${anio}`;
+    }
+
+    function nuevoIdCliente() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return `${Date.now()}-${Math.random().toString(36).slice(2)}-${Math.random().toString(36).slice(2)}`;
+    }
+
+    function elemento(tag, clase, texto) {
+        const el = document.createElement(tag);
+        if (clase) el.className = clase;
+        if (texto !== undefined) el.textContent = texto;
+        return el;
+    }
+
+    function formularioLectura(usuarioId) {
+        const form = elemento('form', 'lectura-form');
+        const input = elemento('input', 'lectura-input');
+        Object.assign(input, { type: 'number', step: '0.01', name: 'lectura', required: true, placeholder: 'Nueva lectura' });
+        const boton = elemento('button', 'guardar-btn', 'Guardar');
+        boton.type = 'submit';
+        form.append(input, boton);
+        form.addEventListener('submit', event => guardarLectura(event, usuarioId));
+        return form;
+    }
+
+    function itemOrden(orden, pendiente) {
+        const usuario = orden.usuario;
+        const completado = orden.lectura_tomada || pendiente;
+        const item = elemento('li', `usuario-ruta-item${completado ? ' completado' : ''}`);
+        item.id = `usuario-${usuario.id}`;
+
+        const info = elemento('div', 'direccion-info');
+        const ultima = usuario.lecturas[0];
+        [
+            ['Dirección:', usuario.address],
+            ['Contrato:', usuario.contrato],
+            ['Última lectura:', ultima ? `${ultima.lectura} m³ (${formatearFecha(ultima.fecha_lectura)})` : 'Sin lecturas previas'],
+        ].forEach(([etiqueta, valor], indice) => {
+            if (indice) info.appendChild(document.createElement('br'));
+            info.append(elemento('strong', null, etiqueta), ` ${valor}`);
+        });
+        const historial = elemento('button', 'historial-btn', 'Ver historial');
+        historial.type = 'button';
+        historial.addEventListener('click', () => verHistorial(historial, usuario.id));
+        info.append(document.createElement('br'), historial, elemento('div', 'historial-usuario'));
+        item.appendChild(info);
+
+        if (completado) {
+            item.appendChild(elemento('span', 'lectura-completada',
+                pendiente ? 'Lectura guardada en el dispositivo' : 'Lectura registrada'));
+        } else {
+            item.appendChild(formularioLectura(usuario.id));
+        }
+        return item;
+    }
+
+    function actualizarProgreso() {
+        const total = document.querySelectorAll('.usuario-ruta-item').length;
+        const completadas = document.querySelectorAll('.usuario-ruta-item.completado').length;
+        const barra = document.querySelector('.ruta-activa .progreso-barra');
+        const texto = document.querySelector('.ruta-activa .progreso-texto');
+        if (barra) barra.style.width = (total ? (completadas / total) * 100 : 0) + '%';
+        if (texto) texto.textContent = `Progreso: ${completadas} de ${total} lecturas`;
+        if (total && completadas === total) mostrarFinalizar();
+    }
+
+    function mostrarFinalizar() {
+        const rutaActiva = document.querySelector('.ruta-activa');
+        if (!rutaActiva || rutaActiva.querySelector('.finalizar-ruta')) return;
+        const div = elemento('div', 'finalizar-ruta');
+        const boton = elemento('button', 'btn-finalizar', 'Finalizar Ruta');
+        boton.addEventListener('click', () => finalizarRuta(Number(rutaActiva.dataset.rutaId)));
+        div.appendChild(boton);
+        rutaActiva.appendChild(div);
+    }
+
+    async function renderizarRuta() {
+        const rutaActiva = document.querySelector('.ruta-activa');
+        if (!paquete || !rutaActiva) return;
+        const pendientes = new Set((await leerPendientes()).map(lectura => String(lectura.usuario_id)));
+
+        rutaActiva.dataset.rutaId = paquete.ruta.id;
+        rutaActiva.querySelector('.ruta-titulo').textContent = paquete.ruta.nombre;
+        const lista = rutaActiva.querySelector('.usuarios-ruta');
+        lista.replaceChildren(...paquete.ordenes.map(orden =>
+            itemOrden(orden, pendientes.has(String(orden.usuario.id)))
+        ));
+        actualizarProgreso();
+    }
+
+    async function actualizarEstado() {
+        const estado = document.getElementById('estadoSincronizacion');
+        if (!estado) return;
+        const pendientes = (await leerPendientes()).length;
+        let texto;
+        if (!navigator.onLine) {
+            texto = `Sin conexión. ${pendientes} lecturas guardadas en el dispositivo`;
+        } else if (sincronizando) {
+            texto = 'Sincronizando lecturas...';
+        } else if (pendientes) {
+            texto = `${pendientes} lecturas pendientes de sincronizar`;
+        } else {
+            texto = 'Todas las lecturas están sincronizadas';
+        }
+        if (ultimoError) texto += ` (${ultimoError})`;
+        estado.querySelector('.estado-texto').textContent = texto;
+        estado.classList.toggle('sin-conexion', !navigator.onLine);
+        estado.querySelector('button').disabled = !navigator.onLine || sincronizando || !pendientes;
+    }
+
+    function mostrarUsuario(orden) {
+        const panel = document.getElementById('usuarioOffline');
+        const usuario = orden.usuario;
+        panel.replaceChildren();
+
+        const info = elemento('div', 'info-usuario');
+        info.appendChild(elemento('h3', null, 'Información del Usuario'));
+        [
+            ['Contrato:', usuario.contrato],
+            ['Nombre:', usuario.nombre],
+            ['Dirección:', usuario.address],
+            ['Última lectura:', usuario.lectura ?? 'Sin lectura'],
+        ].forEach(([etiqueta, valor]) => {
+            const p = document.createElement('p');
+            p.append(elemento('strong', null, etiqueta), ` ${valor}`);
+            info.appendChild(p);
+        });
+        panel.appendChild(info);
+
+        const item = document.getElementById(`usuario-${usuario.id}`);
+        if (item && !item.classList.contains('completado')) {
+            panel.appendChild(formularioLectura(usuario.id));
+        }
+
+        if (usuario.lecturas.length) {
+            const historico = elemento('div', 'historico');
+            historico.appendChild(elemento('h3', null, 'Histórico de Lecturas'));
+            const tabla = document.createElement('table');
+            const encabezado = document.createElement('tr');
+            encabezado.append(elemento('th', null, 'Fecha'), elemento('th', null, 'Lectura'));
+            tabla.appendChild(encabezado);
+            usuario.lecturas.forEach(lectura => {
+                const fila = document.createElement('tr');
+                fila.append(elemento('td', null, formatearFecha(lectura.fecha_lectura)), elemento('td', null, lectura.lectura));
+                tabla.appendChild(fila);
+            });
+            historico.appendChild(tabla);
+            panel.appendChild(historico);
+        }
+        panel.style.display = 'block';
+    }
+
+    function mostrarMensaje(texto, tipo) {
+        const panel = document.getElementById('usuarioOffline');
+        panel.replaceChildren(elemento('div', `mensaje ${tipo}`, texto));
+        panel.style.display = 'block';
+    }
+
+    // --- Lecturas y sincronización ---
+
+    async function guardarLectura(event, usuarioId) {
+        event.preventDefault();
+        const form = event.target;
+        const lectura = form.querySelector('input[name="lectura"]').value;
+        if (lectura === '' || Number(lectura) < 0) {
+            alert('Ingrese una lectura válida');
+            return;
+        }
+
+        await agregarPendiente({
+            id_cliente: nuevoIdCliente(),
+            usuario_id: usuarioId,
+            lectura: Number(lectura),
+            fecha_lectura: fechaHoy(),
+        });
+
+        const item = document.getElementById(`usuario-${usuarioId}`);
+        if (item) {
+            item.classList.add('completado');
+            item.querySelector('.lectura-form')?.replaceWith(
+                elemento('span', 'lectura-completada', 'Lectura guardada en el dispositivo')
+            );
+        }
+        if (form.closest('#usuarioOffline')) {
+            form.replaceWith(elemento('div', 'mensaje exito', 'Lectura guardada en el dispositivo'));
+        }
+        actualizarProgreso();
+
+        const pendientes = (await leerPendientes()).length;
+        await actualizarEstado();
+        if (pendientes >= SINCRONIZAR_CADA) {
+            sincronizar();
+        }
+    }
+
+    async function marcarSincronizadas(lecturas) {
+        // El paquete local refleja lo ya enviado sin volver a descargarlo
+        if (!paquete) return;
+        lecturas.forEach(lectura => {
+            const orden = buscarOrden('id', lectura.usuario_id);
+            if (orden) {
+                orden.lectura_tomada = true;
+                orden.usuario.lectura = lectura.lectura;
+                orden.usuario.lecturas.unshift({ fecha_lectura: lectura.fecha_lectura, lectura: lectura.lectura });
+            }
+        });
+        await guardarPaquete(paquete);
+    }
+
+    async function sincronizar() {
+        if (sincronizando || !navigator.onLine) return false;
+        sincronizando = true;
+        ultimoError = '';
+        await actualizarEstado();
+        let completa = true;
+        try {
+            const pendientes = await leerPendientes();
+            for (let i = 0; i < pendientes.length; i += TAMANO_LOTE) {
+                const lote = pendientes.slice(i, i + TAMANO_LOTE);
+                const response = await fetch(config.loteUrl, {
+                    method: 'POST',
+                    credentials: 'same-origin',
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'X-CSRFToken': getCookie('csrftoken')
+                    },
+                    body: JSON.stringify({ lecturas: lote })
+                });
+                if (response.status === 401 || response.status === 403) {
+                    throw new Error('Inicie sesión para sincronizar');
+                }
+                if (!response.ok) {
+                    throw new Error('Error del servidor al sincronizar');
+                }
+                const data = await response.json();
+                // Creadas y duplicadas ya están en el servidor; los errores de validación no se
+                // corregirán reenviando, así que también salen de la cola y se informan
+                const errores = data.resultados.filter(resultado => resultado.estado === 'error');
+                errores.forEach(resultado => {
+                    console.error('Lectura rechazada:', lote[resultado.indice], resultado.error);
+                });
+                if (errores.length) {
+                    ultimoError = `${errores.length} lecturas rechazadas`;
+                    completa = false;
+                }
+                await quitarPendientes(data.resultados.map(resultado => lote[resultado.indice].id_cliente));
+                await marcarSincronizadas(data.resultados
+                    .filter(resultado => resultado.estado !== 'error')
+                    .map(resultado => lote[resultado.indice]));
+            }
+        } catch (error) {
+            console.error('Error:', error);
+            ultimoError = error.message;
+            completa = false;
+        } finally {
+            sincronizando = false;
+            await actualizarEstado();
+        }
+        return completa;
+    }
+
+    function configurarBusqueda() {
+        const form = document.getElementById('buscarContratoForm');
+        if (!form) return;
+        form.addEventListener('submit', event => {
+            const contrato = form.querySelector('input[name="contrato"]').value.trim();
+            const orden = buscarOrden('contrato', contrato);
+            // Los contratos de la ruta se resuelven con el paquete, sin ir al servidor
+            if (orden) {
+                event.preventDefault();
+                mostrarUsuario(orden);
+            } else if (!navigator.onLine) {
+                event.preventDefault();
+                mostrarMensaje('Sin conexión: el contrato no está en la ruta descargada', 'error');
+            }
+        });
+    }
+
+    function registrarServiceWorker() {
+        if (!('serviceWorker' in navigator) || !config.swUrl) return;
+        navigator.serviceWorker.register(config.swUrl, { scope: '/' })
+            .then(() => navigator.serviceWorker.ready)
+            .then(registro => {
+                const recursos = [
+                    location.pathname,
+                    ...Array.from(document.querySelectorAll('link[rel="stylesheet"][href], script[src]'),
+                                  el => el.href || el.src)
+                ];
+                registro.active.postMessage({ tipo: 'precargar', recursos });
+            })
+            .catch(error => console.error('Error al registrar el service worker:', error));
+    }
+
+    async function iniciar() {
+        config = document.getElementById('tomaLecturaConfig')?.dataset || {};
+        if (!config.paqueteUrl || !('indexedDB' in window)) return;
+        db = await abrirDB();
+
+        paquete = await actualizarPaquete();
+        await renderizarRuta();
+        configurarBusqueda();
+        await actualizarEstado();
+        registrarServiceWorker();
+
+        document.querySelector('#estadoSincronizacion button')?.addEventListener('click', sincronizar);
+        window.addEventListener('online', async () => {
+            await sincronizar();
+            paquete = await actualizarPaquete();
+            await renderizarRuta();
+        });
+        window.addEventListener('offline', actualizarEstado);
+        setInterval(() => { if (navigator.onLine) sincronizar(); }, INTERVALO_SINCRONIZACION);
+        if (navigator.onLine) sincronizar();
+    }
+
+    document.addEventListener('DOMContentLoaded', () => {
+        iniciar().catch(error => console.error('Error al iniciar la toma de lectura sin conexión:', error));
+    });
+
+    function lecturasUsuario(usuarioId) {
+        const orden = buscarOrden('id', usuarioId);
+        return orden ? orden.usuario.lecturas : null;
+    }
+
+    return { guardarLectura, sincronizar, lecturasUsuario, activo: () => db !== null };
+})();
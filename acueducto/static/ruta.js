@@ -3,6 +3,18 @@ async function finalizarRuta(rutaId) {
         return;
     }
 
+    // Las lecturas guardadas en el dispositivo deben llegar al servidor antes de cerrar la ruta
+    if (typeof OfflineRuta !== 'undefined' && OfflineRuta.activo()) {
+        if (!navigator.onLine) {
+            alert('Sin conexión: la ruta se puede finalizar cuando se sincronicen las lecturas');
+            return;
+        }
+        if (!await OfflineRuta.sincronizar()) {
+            alert('No se pudieron sincronizar todas las lecturas; la ruta no se finalizó');
+            return;
+        }
+    }
+
     try {
         const response = await fetch('/finalizar-ruta/', {
             method: 'POST',
@@ -47,6 +59,10 @@ function getCookie(name) {
 }
 
 async function guardarLectura(event, usuarioId) {
+    if (typeof OfflineRuta !== 'undefined' && OfflineRuta.activo()) {
+        // Con el modo sin conexión disponible la lectura se encola y se sincroniza por lotes
+        return OfflineRuta.guardarLectura(event, usuarioId);
+    }
     event.preventDefault();
     const form = event.target;
     const lecturaInput = form.querySelector('input[name="lectura"]');
@@ -75,6 +91,10 @@ async function guardarLectura(event, usuarioId) {
             // Reemplazar el formulario con un mensaje de éxito
             const formContainer = form.parentElement;
             formContainer.innerHTML = '<span class="lectura-completada">Lectura registrada</span>';
+            if (data.advertencias && data.advertencias.length) {
+                // Consumo negativo o pico: la lectura quedó guardada, pero conviene verificarla
+                alert('Verifique la lectura:\n' + data.advertencias.join('\n'));
+            }
             
             // Actualizar el contador de lecturas completadas
             const lecturasTotales = document.querySelectorAll('.usuario-ruta-item').length;
@@ -114,3 +134,50 @@ async function guardarLectura(event, usuarioId) {
         alert('Error al guardar la lectura');
     }
 }
+
+function mostrarHistorial(contenedor, lecturas) {
+    if (!lecturas.length) {
+        contenedor.textContent = 'Sin lecturas previas';
+        return;
+    }
+    const tabla = document.createElement('table');
+    tabla.innerHTML = '<tr><th>Fecha</th><th>Lectura</th></tr>';
+    lecturas.forEach(lectura => {
+        const fila = tabla.insertRow();
+        const [anio, mes, dia] = lectura.fecha_lectura.split('-');
+        fila.insertCell().textContent = `${dia}/${mes}/${anio}`;
+        fila.insertCell().textContent = lectura.lectura;
+    });
+    contenedor.replaceChildren(tabla);
+}
+
+async function verHistorial(boton, usuarioId) {
+    // El historial no viene con la página: se pide solo para el usuario que se abre
+    const contenedor = boton.nextElementSibling;
+    if (contenedor.childElementCount || contenedor.textContent) {
+        contenedor.replaceChildren();
+        boton.textContent = 'Ver historial';
+        return;
+    }
+    boton.textContent = 'Ocultar historial';
+
+    // Con el paquete de la ruta descargado el historial ya está en el dispositivo
+    const enPaquete = typeof OfflineRuta !== 'undefined' ? OfflineRuta.lecturasUsuario(usuarioId) : null;
+    if (enPaquete) {
+        mostrarHistorial(contenedor, enPaquete);
+        return;
+    }
+
+    try {
+        const plantilla = document.getElementById('tomaLecturaConfig').dataset.historialUrl;
+        const response = await fetch(plantilla.replace('/0/', `/${usuarioId}/`));
+        if (!response.ok) {
+            throw new Error('Error al cargar el historial');
+        }
+        const data = await response.json();
+        mostrarHistorial(contenedor, data.lecturas);
+    } catch (error) {
+        console.error('Error:', error);
+        contenedor.textContent = 'No se pudo cargar el historial';
+    }
+}
@@ -0,0 +1,34 @@
+// Sugerencias de usuarios (typeahead) para los inputs con data-sugerencias-url y un <datalist>
+function configurarSugerencias(input) {
+    const datalist = document.getElementById(input.getAttribute('list'));
+    const url = input.dataset.sugerenciasUrl;
+    let temporizador = null;
+    let ultimaConsulta = '';
+
+    input.addEventListener('input', function() {
+        clearTimeout(temporizador);
+        const texto = this.value.trim();
+        if (texto.length < 2 || texto === ultimaConsulta) return;
+
+        temporizador = setTimeout(async () => {
+            ultimaConsulta = texto;
+            try {
+                const response = await fetch(`${url}?q=${encodeURIComponent(texto)}`);
+                if (!response.ok) throw new Error('Error en la respuesta del servidor');
+                const data = await response.json();
+                datalist.replaceChildren(...data.resultados.map(usuario => {
+                    const opcion = document.createElement('option');
+                    opcion.value = usuario.contrato;
+                    opcion.label = `${usuario.nombre} - ${usuario.address}`;
+                    return opcion;
+                }));
+            } catch (error) {
+                console.error('Error:', error);
+            }
+        }, 200);
+    });
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('input[data-sugerencias-url]').forEach(configurarSugerencias);
+});
@@ -0,0 +1,76 @@
+// Service worker de la toma de lectura. Solo administra lo que la página le pide precargar
+// (la propia página y sus estáticos): así se puede abrir la ruta sin conexión.
+const CACHE = 'acueducto-toma-lectura-v1';
+
+self.addEventListener('install', () => self.skipWaiting());
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(claves => Promise.all(
+                claves.filter(clave => clave.startsWith('acueducto-') && clave !== CACHE)
+                      .map(clave => caches.delete(clave))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+async function guardarEnCache(cache, url, response) {
+    // Una redirección (p. ej. al login por sesión vencida) no debe reemplazar la página guardada
+    if (response.ok && !response.redirected) {
+        await cache.put(url, response);
+    }
+}
+
+self.addEventListener('message', event => {
+    if (!event.data || event.data.tipo !== 'precargar') return;
+    event.waitUntil(caches.open(CACHE).then(cache => Promise.all(
+        event.data.recursos.map(url =>
+            fetch(url, { credentials: 'same-origin' })
+                .then(response => guardarEnCache(cache, url, response))
+                .catch(() => {})
+        )
+    )));
+});
+
+async function paginaConRespaldo(request, url) {
+    const cache = await caches.open(CACHE);
+    const clave = url.origin + url.pathname;
+    try {
+        const response = await fetch(request);
+        await guardarEnCache(cache, clave, response.clone());
+        return response;
+    } catch (error) {
+        // Sin conexión: la última copia de la página (sin ?contrato=, que se resuelve con el paquete)
+        const guardada = await cache.match(clave);
+        if (guardada) return guardada;
+        throw error;
+    }
+}
+
+async function estaticoDesdeCache(request, guardado) {
+    // Se responde con la copia guardada y se actualiza en segundo plano
+    const cache = await caches.open(CACHE);
+    fetch(request)
+        .then(response => guardarEnCache(cache, request, response))
+        .catch(() => {});
+    return guardado;
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
+
+    event.respondWith((async () => {
+        if (request.mode === 'navigate') {
+            if (await caches.match(url.origin + url.pathname)) {
+                return paginaConRespaldo(request, url);
+            }
+            return fetch(request);
+        }
+        const guardado = await caches.match(request);
+        return guardado ? estaticoDesdeCache(request, guardado) : fetch(request);
+    })());
+});
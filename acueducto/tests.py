@@ -308,7 +308,7 @@ from django.http import Http404 # For testing Http404 expectation
 
 class RouteServiceTests(BaseAcueductoTestCase):
     def test_crear_nueva_ruta_service_success(self):
-        # Setup: Create an old route to ensure it's deleted
+        # Setup: Create an old route to ensure it's archived
         old_ruta_nombre = "Ruta Vieja"
         old_ruta = Ruta.objects.create(nombre=old_ruta_nombre)
         OrdenRuta.objects.create(ruta=old_ruta, usuario=self.user_ac1, orden=1)
@@ -329,10 +329,13 @@ class RouteServiceTests(BaseAcueductoTestCase):
         self.assertIsInstance(ruta_creada, Ruta)
         self.assertEqual(ruta_creada.nombre, nombre_ruta_nueva)
 
-        # Assert that the old Ruta object no longer exists
-        self.assertFalse(Ruta.objects.filter(nombre=old_ruta_nombre).exists())
-        # Assert that only one Ruta object exists (the newly created one)
-        self.assertEqual(Ruta.objects.count(), 1) # This assumes no other routes are active from base setup
+        # Assert that the old Ruta is archived, not deleted, and keeps its orders
+        old_ruta.refresh_from_db()
+        self.assertFalse(old_ruta.activa)
+        self.assertIsNotNone(old_ruta.fecha_finalizacion)
+        self.assertEqual(old_ruta.ordenruta_set.count(), 1)
+        # Assert that only one Ruta is active (the newly created one)
+        self.assertEqual(list(Ruta.objects.filter(activa=True)), [ruta_creada])
 
         # Assert new OrdenRuta objects
         self.assertEqual(ruta_creada.ordenruta_set.count(), len(usuarios_orden_data))
@@ -428,7 +431,14 @@ from unittest import mock # Already at top level, but good to note it's used her
 from io import BytesIO # Already at top level
 import zipfile # Already at top level
 from datetime import datetime # Already at top level (date also present)
+from django.test import override_settings
 
+def _terminar_worker(*args):
+    """Reemplaza el render en un proceso del pool: el worker muere sin devolver nada"""
+    os._exit(1)
+
+# La caché de PDFs queda desactivada: estos tests cuentan los renders con WeasyPrint mockeado
+@override_settings(FACTURAS_CACHE_MAX_BYTES=0)
 class InvoiceServiceTests(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -445,17 +455,19 @@ class InvoiceServiceTests(TestCase):
             fecha_ultima_lectura=date(2023,1,16), lectura=200.0
         )
 
-    @mock.patch('acueducto.services.os.unlink') # Path to os.unlink used within services.py
+    def setUp(self):
+        # El pool de facturas es del proceso: cada test parte sin pool (los mocks lo reemplazan por hilos)
+        from . import services
+        services.cerrar_pool_facturas()
+        self.addCleanup(services.cerrar_pool_facturas)
+
     @mock.patch('acueducto.services.utils.generar_pdf_factura') # Path to utils.generar_pdf_factura used by the service
-    def test_generar_zip_todas_facturas_service_success(self, mock_generar_pdf, mock_os_unlink):
+    def test_generar_zip_todas_facturas_service_success(self, mock_generar_pdf):
         periodo_inicio_str = "2023-01-01"
         periodo_fin_str = "2023-01-31"
 
-        # Configure the mock for generar_pdf_factura
-        # It needs to return an object that has a 'name' attribute (like a file object)
-        mock_pdf_file_object = mock.MagicMock()
-        mock_pdf_file_object.name = "dummy_temp_factura.pdf" # Simulate temp file name
-        mock_generar_pdf.return_value = mock_pdf_file_object
+        # generar_pdf_factura returns the PDF content as bytes
+        mock_generar_pdf.return_value = b'%PDF-dummy'
 
         zip_buffer = generar_zip_todas_facturas_service(periodo_inicio_str, periodo_fin_str)
 
@@ -476,8 +488,6 @@ class InvoiceServiceTests(TestCase):
         self.assertTrue(call_for_user1[1]['base_url'].endswith('acueducto/static'))
 
 
-        self.assertEqual(mock_os_unlink.call_count, 2) # Called twice to delete temp PDFs
-        mock_os_unlink.assert_any_call("dummy_temp_factura.pdf") # Check it was called with the dummy name
 
         self.assertIsNotNone(zip_buffer)
         self.assertIsInstance(zip_buffer, BytesIO)
@@ -486,10 +496,10 @@ class InvoiceServiceTests(TestCase):
             self.assertEqual(len(zf.namelist()), 2)
             self.assertIn(f'factura_{self.user1.contrato}.pdf', zf.namelist())
             self.assertIn(f'factura_{self.user2.contrato}.pdf', zf.namelist())
+            self.assertEqual(zf.read(f'factura_{self.user1.contrato}.pdf'), b'%PDF-dummy')
 
-    @mock.patch('acueducto.services.os.unlink')
     @mock.patch('acueducto.services.utils.generar_pdf_factura')
-    def test_generar_zip_todas_facturas_service_no_users(self, mock_generar_pdf, mock_os_unlink):
+    def test_generar_zip_todas_facturas_service_no_users(self, mock_generar_pdf):
         # Ensure users are deleted for this specific test case
         UserAcueducto.objects.all().delete()
 
@@ -499,7 +509,6 @@ class InvoiceServiceTests(TestCase):
         zip_buffer = generar_zip_todas_facturas_service(periodo_inicio_str, periodo_fin_str)
 
         mock_generar_pdf.assert_not_called()
-        mock_os_unlink.assert_not_called()
         self.assertIsNotNone(zip_buffer)
         zip_buffer.seek(0)
         with zipfile.ZipFile(zip_buffer, 'r') as zf:
@@ -519,11 +528,176 @@ class InvoiceServiceTests(TestCase):
         with self.assertRaises(ValueError):
             generar_zip_todas_facturas_service("2023-01-01", "31/01/2023-invalid")
 
+    @mock.patch('acueducto.services.utils.generar_pdf_factura')
+    def test_generar_zip_todas_facturas_service_orden_contrato(self, mock_generar_pdf):
+        mock_generar_pdf.side_effect = lambda usuario, **kwargs: usuario.contrato.encode()
+
+        zip_buffer = generar_zip_todas_facturas_service("2023-01-01", "2023-01-31", max_workers=1)
+
+        with zipfile.ZipFile(zip_buffer, 'r') as zf:
+            self.assertEqual(zf.namelist(), ['factura_C001.pdf', 'factura_C002.pdf'])
+            self.assertEqual(zf.read('factura_C002.pdf'), b'C002')
+
+    @mock.patch('acueducto.services._inicializar_worker_facturas')
+    @mock.patch('acueducto.services._renderizar_factura_worker')
+    def test_generar_zip_todas_facturas_service_pool(self, mock_worker, mock_init):
+        # Un ThreadPoolExecutor reemplaza al pool de procesos: los mocks no cruzan procesos
+        from concurrent.futures import ThreadPoolExecutor
+        mock_worker.side_effect = lambda usuario, historico_lecturas, *args: usuario.contrato.encode()
+
+        with mock.patch('acueducto.services.ProcessPoolExecutor', ThreadPoolExecutor):
+            zip_buffer = generar_zip_todas_facturas_service("2023-01-01", "2023-01-31", max_workers=2)
+
+        self.assertEqual(mock_worker.call_count, 2)
+        with zipfile.ZipFile(zip_buffer, 'r') as zf:
+            self.assertEqual(zf.namelist(), ['factura_C001.pdf', 'factura_C002.pdf'])
+            self.assertEqual(zf.read('factura_C001.pdf'), b'C001')
+
+    @mock.patch('acueducto.services._inicializar_worker_facturas')
+    @mock.patch('acueducto.services._renderizar_factura_worker')
+    def test_pool_se_reutiliza_entre_peticiones(self, mock_worker, mock_init):
+        from concurrent.futures import ThreadPoolExecutor
+        mock_worker.side_effect = lambda usuario, historico_lecturas, *args: usuario.contrato.encode()
+        with mock.patch('acueducto.services.ProcessPoolExecutor', wraps=ThreadPoolExecutor) as pool:
+            generar_zip_todas_facturas_service("2023-01-01", "2023-01-31", max_workers=2)
+            generar_zip_todas_facturas_service("2023-01-01", "2023-01-31", max_workers=2)
+            self.assertEqual(pool.call_count, 1)
+            # Otro número de workers reemplaza el pool
+            generar_zip_todas_facturas_service("2023-01-01", "2023-01-31", max_workers=3)
+            self.assertEqual(pool.call_count, 2)
+
+    @mock.patch('acueducto.services._inicializar_worker_facturas')
+    @mock.patch('acueducto.services._renderizar_factura_worker', _terminar_worker)
+    def test_pool_roto_se_reemplaza(self, mock_init):
+        from . import services
+        # Procesos reales: el worker termina sin responder y el pool queda roto
+        with self.assertRaisesRegex(Exception, 'Error al generar factura para C001'):
+            generar_zip_todas_facturas_service("2023-01-01", "2023-01-31", max_workers=2)
+        self.assertIsNone(services._pool_facturas)
+
+        with mock.patch('acueducto.services.ProcessPoolExecutor') as pool:
+            services._obtener_pool_facturas(2)
+        pool.assert_called_once()
+
+    def test_worker_suelta_las_conexiones_sin_cerrarlas(self):
+        from . import services
+        conexion = mock.MagicMock()
+        with mock.patch.object(services.connections, 'all', return_value=[conexion]), \
+             mock.patch('django.setup'), mock.patch.object(services.utils, 'precalentar_weasyprint'):
+            services._inicializar_worker_facturas()
+        self.assertIsNone(conexion.connection)
+        conexion.close.assert_not_called()
+
+    @mock.patch('acueducto.services._inicializar_worker_facturas')
+    @mock.patch('acueducto.services._renderizar_factura_worker')
+    def test_generar_zip_todas_facturas_service_pool_error(self, mock_worker, mock_init):
+        from concurrent.futures import ThreadPoolExecutor
+        mock_worker.side_effect = RuntimeError('fallo de render')
+
+        with mock.patch('acueducto.services.ProcessPoolExecutor', ThreadPoolExecutor):
+            with self.assertRaisesRegex(Exception, 'Error al generar factura para C001: fallo de render'):
+                generar_zip_todas_facturas_service("2023-01-01", "2023-01-31", max_workers=2)
+
+    @mock.patch('acueducto.services.utils.generar_pdf_factura')
+    def test_generar_zip_todas_facturas_stream_service(self, mock_generar_pdf):
+        from .services import generar_zip_todas_facturas_stream_service
+        mock_generar_pdf.side_effect = lambda usuario, **kwargs: usuario.contrato.encode() * 100
+
+        stream = generar_zip_todas_facturas_stream_service("2023-01-01", "2023-01-31", max_workers=1)
+        # La primera entrada sale en cuanto se renderiza su factura, sin esperar a las demás
+        primer_chunk = next(stream)
+        self.assertTrue(primer_chunk.startswith(b'PK\x03\x04'))
+        self.assertEqual(mock_generar_pdf.call_count, 1)
 
-from .utils import generar_pdf_factura, formatear_fecha_espanol
-import tempfile # For the return value of generar_pdf_factura
-import os # For cleaning up temp file
+        contenido = primer_chunk + b''.join(stream)
+        with zipfile.ZipFile(BytesIO(contenido), 'r') as zf:
+            self.assertEqual(zf.namelist(), ['factura_C001.pdf', 'factura_C002.pdf'])
+            self.assertEqual(zf.read('factura_C001.pdf'), b'C001' * 100)
+
+    @mock.patch('acueducto.services.utils.generar_pdf_factura')
+    def test_stream_con_factura_fallida_cierra_el_zip(self, mock_generar_pdf):
+        from .services import generar_zip_todas_facturas_stream_service
+        def _generar(usuario, **kwargs):
+            if usuario.contrato == 'C001':
+                raise RuntimeError('fallo de render')
+            return b'%PDF'
+        mock_generar_pdf.side_effect = _generar
+
+        contenido = b''.join(generar_zip_todas_facturas_stream_service("2023-01-01", "2023-01-31", max_workers=1))
+        with zipfile.ZipFile(BytesIO(contenido), 'r') as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), ['factura_C002.pdf', 'errores.txt'])
+            self.assertIn('Error al generar factura para C001: fallo de render', zf.read('errores.txt').decode())
+
+    def test_generar_zip_todas_facturas_stream_service_valida_antes_de_streaming(self):
+        from .services import generar_zip_todas_facturas_stream_service
+        with self.assertRaisesRegex(ValueError, 'Por favor, especifique el período de facturación'):
+            generar_zip_todas_facturas_stream_service("", "2023-01-31")
+
+    @mock.patch('acueducto.services.utils.generar_pdf_factura')
+    def test_generar_factura_view_todas_streaming(self, mock_generar_pdf):
+        mock_generar_pdf.return_value = b'%PDF'
+        response = self.client.post(reverse('generar_factura'), {
+            'generar_todas_directo': '',
+            'periodo_inicio_todas': '2023-01-01',
+            'periodo_fin_todas': '2023-01-31',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)), 'r') as zf:
+            self.assertEqual(len(zf.namelist()), 2)
 
+    def _crear_usuarios_con_lecturas(self, cantidad, inicio):
+        for i in range(inicio, inicio + cantidad):
+            usuario = UserAcueducto.objects.create(
+                contrato=f"Q{i:03d}", name="Query", lastname=f"User{i}",
+                email=f"query{i}@example.com", categoria="residencial", lectura=float(i)
+            )
+            for mes in range(1, 9): # 8 lecturas, solo las 6 más recientes van a la factura
+                HistoricoLectura.objects.create(usuario=usuario, fecha_lectura=date(2023, mes, 1), lectura=mes * 10)
+
+    def test_cargar_datos_facturacion_ultimas_seis_lecturas(self):
+        from .services import cargar_datos_facturacion
+        self._crear_usuarios_con_lecturas(2, 0)
+
+        # Usuarios, últimas lecturas y últimos meses de consumo
+        with self.assertNumQueries(3):
+            usuarios = list(cargar_datos_facturacion())
+
+        self.assertEqual([u.contrato for u in usuarios], ['C001', 'C002', 'Q000', 'Q001'])
+        lecturas = usuarios[2].ultimas_lecturas
+        self.assertEqual([l.fecha_lectura.month for l in lecturas], [8, 7, 6, 5, 4, 3])
+        self.assertEqual([c.periodo.month for c in usuarios[2].ultimos_consumos], [8, 7, 6, 5, 4, 3])
+        self.assertEqual(usuarios[0].ultimas_lecturas, [])
+
+    @mock.patch('acueducto.utils.HTML')
+    def test_generar_zip_todas_facturas_consultas_constantes(self, mock_weasy_html):
+        mock_weasy_html.return_value.write_pdf.return_value = b'%PDF'
+        self._crear_usuarios_con_lecturas(3, 0)
+        with self.assertNumQueries(3):
+            generar_zip_todas_facturas_service("2023-01-01", "2023-01-31", max_workers=1)
+
+        # Con el triple de usuarios el número de consultas no cambia
+        self._crear_usuarios_con_lecturas(10, 3)
+        with self.assertNumQueries(3):
+            zip_buffer = generar_zip_todas_facturas_service("2023-01-01", "2023-01-31", max_workers=1)
+        with zipfile.ZipFile(zip_buffer, 'r') as zf:
+            self.assertEqual(len(zf.namelist()), 15)
+
+    def test_max_workers_facturas_sqlite_en_memoria(self):
+        from .services import _max_workers_facturas
+        # La base de datos de tests es SQLite en memoria: los procesos hijos no la verían
+        with self.settings(FACTURAS_MAX_WORKERS=8):
+            self.assertEqual(_max_workers_facturas(), 1)
+
+
+from .utils import generar_pdf_factura, formatear_fecha_espanol, obtener_contexto_render
+from . import services
+from io import StringIO
+import tempfile
+
+@override_settings(FACTURAS_CACHE_MAX_BYTES=0)
 class UtilsTests(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -552,53 +726,56 @@ class UtilsTests(TestCase):
         periodo_facturacion_str = "Del 1 de febrero de 2023 al 28 de febrero de 2023"
         base_url_dummy = "/dummy/static/path/"
 
-        pdf_file_obj = None # Initialize to ensure it's available in finally block
-        try:
-            pdf_file_obj = generar_pdf_factura(
-                usuario=self.user,
-                fecha_emision=fecha_emision_dt,
-                periodo_facturacion=periodo_facturacion_str,
-                base_url=base_url_dummy
-            )
+        pdf_bytes = generar_pdf_factura(
+            usuario=self.user,
+            fecha_emision=fecha_emision_dt,
+            periodo_facturacion=periodo_facturacion_str,
+            base_url=base_url_dummy
+        )
 
-            # Assertions
-            mock_get_template.assert_called_once_with('factura_template.html')
-
-            mock_template_obj.render.assert_called_once()
-            render_context = mock_template_obj.render.call_args[0][0]
-            self.assertEqual(render_context['usuario'], self.user)
-            self.assertEqual(render_context['fecha_emision'], fecha_emision_dt)
-            self.assertEqual(render_context['periodo_facturacion'], periodo_facturacion_str)
-            self.assertIn('historico_lecturas', render_context)
-            # Based on setUpTestData, 3 lecturas exist. The function fetches up to 6.
-            self.assertEqual(len(render_context['historico_lecturas']), 3)
-            self.assertIn('lectura_anterior', render_context)
-            # Check if lectura_anterior is correctly identified
-            # Readings are: 150 (Feb 10), 120 (Jan 10), 100 (Dec 10)
-            # If current is Feb 10 (150), anterior should be Jan 10 (120)
-            # The logic in generar_pdf_factura gets all() and orders by -fecha_lectura
-            # historico_lecturas[0] is the latest, historico_lecturas[1] is the one before.
-            if len(self.user.lecturas.all().order_by('-fecha_lectura')) > 1:
-                self.assertEqual(render_context['lectura_anterior'].lectura, 120) # Second latest
-            else:
-                self.assertIsNone(render_context['lectura_anterior'])
-
-
-            mock_weasy_html.assert_called_once_with(string=mock_template_obj.render.return_value, base_url=base_url_dummy)
-            mock_html_instance.write_pdf.assert_called_once_with(pdf_file_obj.name)
-
-            self.assertIsNotNone(pdf_file_obj)
-            self.assertTrue(hasattr(pdf_file_obj, 'name'))
-            self.assertTrue(pdf_file_obj.name.endswith('.pdf'))
-
-        finally:
-            # Cleanup the temporary file
-            if pdf_file_obj and hasattr(pdf_file_obj, 'name') and os.path.exists(pdf_file_obj.name):
-                try:
-                    pdf_file_obj.close() # Close before unlinking if it's still open
-                except Exception:
-                    pass # Ignore errors on close if already closed or unlinked
-                os.unlink(pdf_file_obj.name)
+        # Assertions
+        mock_get_template.assert_called_once_with('factura_template.html')
+
+        mock_template_obj.render.assert_called_once()
+        render_context = mock_template_obj.render.call_args[0][0]
+        self.assertEqual(render_context['usuario'], self.user)
+        self.assertEqual(render_context['fecha_emision'], fecha_emision_dt)
+        self.assertEqual(render_context['periodo_facturacion'], periodo_facturacion_str)
+        self.assertIn('historico_lecturas', render_context)
+        # Based on setUpTestData, 3 lecturas exist. The function fetches up to 6.
+        self.assertEqual(len(render_context['historico_lecturas']), 3)
+        self.assertIn('lectura_anterior', render_context)
+        # Readings are: 150 (Feb 10), 120 (Jan 10), 100 (Dec 10)
+        # historico_lecturas[0] is the latest, historico_lecturas[1] is the one before.
+        self.assertEqual(render_context['lectura_anterior'].lectura, 120) # Second latest
+
+        mock_weasy_html.assert_called_once_with(string=mock_template_obj.render.return_value, base_url=base_url_dummy)
+        # No target: WeasyPrint renders to memory, reusing the process-wide stylesheet and fonts
+        contexto = obtener_contexto_render()
+        mock_html_instance.write_pdf.assert_called_once_with(
+            stylesheets=contexto.stylesheets, font_config=contexto.font_config, cache=contexto.cache
+        )
+        self.assertEqual(pdf_bytes, mock_html_instance.write_pdf.return_value)
+
+    def test_obtener_contexto_render_reutiliza_y_invalida(self):
+        contexto = obtener_contexto_render()
+        self.assertIs(obtener_contexto_render(), contexto)
+
+        # Si cambia la plantilla o un estático, el contexto se recompila
+        firma_nueva = tuple(None for _ in contexto.firma)
+        with mock.patch('acueducto.utils._firma_recursos_factura', return_value=firma_nueva):
+            contexto_nuevo = obtener_contexto_render()
+        self.assertIsNot(contexto_nuevo, contexto)
+        self.assertEqual(contexto_nuevo.firma, firma_nueva)
+
+    def test_enviar_factura_email_adjunta_bytes(self):
+        from django.core import mail
+        from .utils import enviar_factura_email
+        with self.settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            enviar_factura_email(self.user, b'%PDF-dummy')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+        self.assertEqual(mail.outbox[0].attachments, [('factura_U001.pdf', b'%PDF-dummy', 'application/pdf')])
 
     def test_formatear_fecha_espanol(self):
         fecha1 = date(2023, 1, 15) # January 15, 2023
@@ -609,3 +786,1670 @@ class UtilsTests(TestCase):
 
         fecha3 = date(2022, 12, 25) # December 25, 2022
         self.assertEqual(formatear_fecha_espanol(fecha3), "25 de diciembre de 2022")
+
+
+from django.core import mail
+from django.core.management import call_command
+from .models import TrabajoFacturacion
+import shutil
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class TrabajoFacturacionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = UserAcueducto.objects.create(
+            contrato="T001", name="Job", lastname="User1",
+            email="job1@example.com", categoria="residencial", lectura=10.0
+        )
+        cls.user2 = UserAcueducto.objects.create(
+            contrato="T002", name="Job", lastname="User2",
+            email="job2@example.com", categoria="comercial", lectura=20.0
+        )
+        cls.operador = User.objects.create_user(username='operador', password='password123')
+
+    def setUp(self):
+        self.client.force_login(self.operador)
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    @mock.patch('acueducto.services.utils.generar_pdf_factura')
+    def test_generar_todas_encola_sin_renderizar(self, mock_generar_pdf):
+        response = self.client.post(reverse('generar_factura'), {
+            'generar_todas': '',
+            'periodo_inicio_todas': '2023-01-01',
+            'periodo_fin_todas': '2023-01-31',
+        })
+        trabajo = TrabajoFacturacion.objects.get()
+        self.assertRedirects(response, f"{reverse('generar_factura')}?trabajo={trabajo.id}")
+        self.assertEqual(trabajo.tipo, 'zip_facturas')
+        self.assertEqual(trabajo.estado, 'pendiente')
+        mock_generar_pdf.assert_not_called()
+
+    @mock.patch('acueducto.services.utils.generar_pdf_factura')
+    def test_procesar_trabajo_zip(self, mock_generar_pdf):
+        mock_generar_pdf.return_value = b'%PDF'
+        trabajo = services.encolar_zip_facturas_service('2023-01-01', '2023-01-31')
+
+        call_command('procesar_trabajos', '--una-vez', stdout=StringIO())
+
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, 'completado')
+        self.assertEqual((trabajo.total, trabajo.procesadas, trabajo.fallidas), (2, 2, 0))
+
+        response = self.client.get(reverse('estado_trabajo', args=[trabajo.id]))
+        data = response.json()
+        self.assertEqual(data['estado'], 'completado')
+        self.assertEqual(data['porcentaje_completado'], 100)
+        self.assertEqual(data['descarga_url'], reverse('descargar_trabajo', args=[trabajo.id]))
+
+        response = self.client.get(data['descarga_url'])
+        contenido = b''.join(response.streaming_content)
+        with zipfile.ZipFile(BytesIO(contenido), 'r') as zf:
+            self.assertEqual(zf.namelist(), ['factura_T001.pdf', 'factura_T002.pdf'])
+
+    def test_estado_y_descarga_requieren_login(self):
+        trabajo = services.encolar_zip_facturas_service('2023-01-01', '2023-01-31')
+        self.client.logout()
+        for nombre in ('estado_trabajo', 'descargar_trabajo'):
+            response = self.client.get(reverse(nombre, args=[trabajo.id]))
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response.url.startswith(reverse('login')))
+
+    @mock.patch('acueducto.services.utils.generar_pdf_factura')
+    def test_procesar_trabajo_zip_con_fallas(self, mock_generar_pdf):
+        def _generar(usuario, **kwargs):
+            if usuario.contrato == 'T001':
+                raise RuntimeError('plantilla rota')
+            return b'%PDF'
+        mock_generar_pdf.side_effect = _generar
+        trabajo = services.encolar_zip_facturas_service('2023-01-01', '2023-01-31')
+
+        services.ejecutar_trabajo(services.tomar_siguiente_trabajo())
+
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, 'completado')
+        self.assertEqual((trabajo.procesadas, trabajo.fallidas), (1, 1))
+        self.assertEqual(trabajo.errores, [{'contrato': 'T001', 'error': 'plantilla rota'}])
+
+    @mock.patch('acueducto.services.utils.generar_pdf_factura')
+    def test_enviar_email_encola_y_procesa(self, mock_generar_pdf):
+        mock_generar_pdf.return_value = b'%PDF'
+        response = self.client.post(reverse('generar_factura'), {
+            'enviar_email': '',
+            'contrato': 'T002',
+            'fecha_emision': '2023-02-01',
+            'periodo_inicio': '2023-01-01',
+            'periodo_fin': '2023-01-31',
+        })
+        trabajo = TrabajoFacturacion.objects.get()
+        self.assertRedirects(response, f"{reverse('generar_factura')}?trabajo={trabajo.id}")
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command('procesar_trabajos', '--una-vez', stdout=StringIO())
+
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, 'completado')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['job2@example.com'])
+
+    def test_trabajo_fallido_registra_mensaje(self):
+        trabajo = TrabajoFacturacion.objects.create(tipo='email_factura', total=1, parametros={
+            'contrato': 'NOEXISTE', 'periodo_inicio': '2023-01-01', 'periodo_fin': '2023-01-31'
+        })
+        services.ejecutar_trabajo(services.tomar_siguiente_trabajo())
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, 'fallido')
+        self.assertTrue(trabajo.mensaje)
+
+    def test_tomar_siguiente_trabajo_no_repite(self):
+        services.encolar_zip_facturas_service('2023-01-01', '2023-01-31')
+        self.assertIsNotNone(services.tomar_siguiente_trabajo())
+        self.assertIsNone(services.tomar_siguiente_trabajo())
+
+
+from .models import EnvioFactura
+from django.core.mail import get_connection
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+@mock.patch('acueducto.services.utils.generar_pdf_factura', return_value=b'%PDF')
+@mock.patch('acueducto.services.time.sleep')
+class EnvioMasivoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = UserAcueducto.objects.create(
+            contrato="M001", name="Mail", lastname="User1",
+            email="mail1@example.com", categoria="residencial", zona="Norte"
+        )
+        cls.user2 = UserAcueducto.objects.create(
+            contrato="M002", name="Mail", lastname="User2",
+            email="mail2@example.com", categoria="comercial", zona="Sur"
+        )
+        cls.user3 = UserAcueducto.objects.create(
+            contrato="M003", name="Mail", lastname="User3",
+            email="mail3@example.com", categoria="residencial", zona="Norte"
+        )
+
+    def test_envio_masivo_una_conexion(self, mock_sleep, mock_generar_pdf):
+        with mock.patch('acueducto.services.get_connection', wraps=get_connection) as mock_conexion:
+            resumen = services.enviar_facturas_masivo_service('2023-01-01', '2023-01-31', tamano_lote=2, max_por_minuto=0)
+
+        mock_conexion.assert_called_once()
+        self.assertEqual(resumen, {'total': 3, 'enviados': 3, 'fallidos': 0})
+        self.assertEqual([m.to for m in mail.outbox], [['mail1@example.com'], ['mail2@example.com'], ['mail3@example.com']])
+        self.assertEqual(mail.outbox[0].attachments[0][0], 'factura_M001.pdf')
+        self.assertEqual(EnvioFactura.objects.filter(enviado=True, intentos=1).count(), 3)
+
+    def test_envio_masivo_en_lotes(self, mock_sleep, mock_generar_pdf):
+        conexion = get_connection()
+        lotes = []
+        enviar = conexion.send_messages
+        def _send_messages(mensajes):
+            mensajes = list(mensajes)
+            lotes.append([m.to[0] for m in mensajes])
+            return enviar(mensajes)
+
+        with mock.patch('acueducto.services.get_connection', return_value=conexion), \
+             mock.patch.object(conexion, 'send_messages', side_effect=_send_messages):
+            services.enviar_facturas_masivo_service('2023-01-01', '2023-01-31', tamano_lote=2, max_por_minuto=0)
+
+        # Un send_messages por lote de hasta dos mensajes
+        self.assertEqual(lotes, [['mail1@example.com', 'mail2@example.com'], ['mail3@example.com']])
+        self.assertEqual(len(mail.outbox), 3)
+
+    def _conexion_con_fallos(self, fallos):
+        """Conexión falsa que recorre el lote en orden y falla `fallos[email]` veces en ese destinatario"""
+        conexion = mock.MagicMock()
+        entregados = []
+        def _send_messages(mensajes):
+            for mensaje in mensajes:
+                if fallos.get(mensaje.to[0]):
+                    fallos[mensaje.to[0]] -= 1
+                    raise ConnectionError('SMTP desconectado')
+                entregados.append(mensaje.to[0])
+            return len(entregados)
+        conexion.send_messages.side_effect = _send_messages
+        return conexion, entregados
+
+    def test_envio_masivo_reintenta_y_registra_fallos(self, mock_sleep, mock_generar_pdf):
+        # mail1 falla una vez y luego sale; mail2 falla en los tres intentos; mail3 sale
+        conexion, entregados = self._conexion_con_fallos({'mail1@example.com': 1, 'mail2@example.com': 3})
+        with mock.patch('acueducto.services.get_connection', return_value=conexion):
+            resumen = services.enviar_facturas_masivo_service('2023-01-01', '2023-01-31', max_por_minuto=0, reintentos=2)
+
+        self.assertEqual(resumen, {'total': 3, 'enviados': 2, 'fallidos': 1})
+        # Solo se reintenta lo que no salió: nadie recibe la factura dos veces
+        self.assertEqual(entregados, ['mail1@example.com', 'mail3@example.com'])
+        envio1 = EnvioFactura.objects.get(usuario=self.user1)
+        self.assertTrue(envio1.enviado)
+        self.assertEqual(envio1.intentos, 2)
+        envio2 = EnvioFactura.objects.get(usuario=self.user2)
+        self.assertFalse(envio2.enviado)
+        self.assertEqual(envio2.intentos, 3)
+        self.assertEqual(envio2.error, 'SMTP desconectado')
+        self.assertEqual(EnvioFactura.objects.get(usuario=self.user3).intentos, 1)
+        conexion.open.assert_called()
+        conexion.close.assert_called()
+
+    def test_envio_masivo_reconexion_fallida_no_corta_el_trabajo(self, mock_sleep, mock_generar_pdf):
+        conexion, entregados = self._conexion_con_fallos({'mail1@example.com': 1})
+        # La primera apertura funciona; el servidor sigue caído en cada reconexión
+        conexion.open.side_effect = [True] + [ConnectionRefusedError('sin servidor')] * 10
+        with mock.patch('acueducto.services.get_connection', return_value=conexion):
+            resumen = services.enviar_facturas_masivo_service('2023-01-01', '2023-01-31', max_por_minuto=0, reintentos=1)
+
+        self.assertEqual(resumen, {'total': 3, 'enviados': 0, 'fallidos': 3})
+        self.assertEqual(entregados, [])
+        self.assertEqual(EnvioFactura.objects.get(usuario=self.user1).intentos, 2)
+        self.assertEqual(EnvioFactura.objects.get(usuario=self.user3).error, 'sin servidor')
+
+    def test_envio_masivo_limite_por_minuto(self, mock_sleep, mock_generar_pdf):
+        with mock.patch('acueducto.services.time.monotonic', return_value=100.0):
+            services.enviar_facturas_masivo_service('2023-01-01', '2023-01-31', tamano_lote=2, max_por_minuto=30)
+        # 30 por minuto: 2 segundos por mensaje, se espera los 4 del primer lote antes del segundo
+        self.assertEqual(mock_sleep.call_args_list, [mock.call(4.0)])
+
+    def test_envio_masivo_trabajo_filtrado_por_zona(self, mock_sleep, mock_generar_pdf):
+        trabajo = services.encolar_email_masivo_service('2023-01-01', '2023-01-31', zona='Norte')
+        services.ejecutar_trabajo(services.tomar_siguiente_trabajo())
+
+        trabajo.refresh_from_db()
+        self.assertEqual(trabajo.estado, 'completado')
+        self.assertEqual((trabajo.total, trabajo.procesadas, trabajo.fallidas), (2, 2, 0))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['mail1@example.com', 'mail3@example.com'])
+        self.assertEqual(trabajo.envios.count(), 2)
+
+
+from . import cache_facturas
+import os
+
+@mock.patch('acueducto.utils.obtener_contexto_render')
+@mock.patch('acueducto.utils.HTML')
+class CacheFacturasTests(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        override = override_settings(FACTURAS_CACHE_DIR=self.cache_dir, FACTURAS_CACHE_MAX_BYTES=10 * 1024)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(cache_facturas.limpiar)
+        cache_facturas.limpiar()
+
+        self.user = UserAcueducto.objects.create(
+            contrato="K001", name="Cache", lastname="User",
+            email="cache@example.com", categoria="residencial", lectura=30.0
+        )
+        HistoricoLectura.objects.create(usuario=self.user, fecha_lectura=date(2023, 1, 10), lectura=30)
+        self.kwargs = {
+            'fecha_emision': datetime(2023, 2, 1, 9, 0),
+            'periodo_facturacion': 'Enero 2023',
+            'base_url': '/static/',
+        }
+
+    def _generar(self, **kwargs):
+        return generar_pdf_factura(usuario=UserAcueducto.objects.get(pk=self.user.pk), **{**self.kwargs, **kwargs})
+
+    def test_segunda_descarga_sale_de_cache(self, mock_html, mock_contexto):
+        mock_contexto.return_value.write_pdf.return_value = b'%PDF-1'
+
+        self.assertEqual(self._generar(), b'%PDF-1')
+        # Misma factura emitida más tarde el mismo día: no se vuelve a renderizar
+        self.assertEqual(self._generar(fecha_emision=datetime(2023, 2, 1, 18, 30)), b'%PDF-1')
+        self.assertEqual(mock_contexto.return_value.write_pdf.call_count, 1)
+
+        # Otro período u otra fecha de emisión es otra factura
+        self._generar(periodo_facturacion='Febrero 2023')
+        self._generar(fecha_emision=datetime(2023, 2, 2))
+        self.assertEqual(mock_contexto.return_value.write_pdf.call_count, 3)
+
+    def test_cambios_en_usuario_o_lecturas_invalidan(self, mock_html, mock_contexto):
+        mock_contexto.return_value.write_pdf.side_effect = [b'%PDF-1', b'%PDF-2', b'%PDF-3', b'%PDF-4']
+
+        self.assertEqual(self._generar(), b'%PDF-1')
+        HistoricoLectura.objects.create(usuario=self.user, fecha_lectura=date(2023, 2, 10), lectura=45)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, str(self.user.pk))))
+        self.assertEqual(self._generar(), b'%PDF-2')
+
+        self.user.credito = 1500
+        self.user.save()
+        self.assertEqual(self._generar(), b'%PDF-3')
+
+        # Un update() no dispara señales, pero la clave cambia igual porque depende de los datos
+        UserAcueducto.objects.filter(pk=self.user.pk).update(zona='Sur')
+        self.assertEqual(self._generar(), b'%PDF-4')
+        self.assertEqual(self._generar(), b'%PDF-4')
+
+    def test_cambio_de_plantilla_invalida(self, mock_html, mock_contexto):
+        mock_contexto.return_value.write_pdf.side_effect = [b'%PDF-1', b'%PDF-2']
+        self._generar()
+        with mock.patch('acueducto.utils._firma_recursos_factura', return_value=('otra',)), \
+                mock.patch('acueducto.utils.RECURSOS_FACTURA', (os.path.join(os.path.dirname(__file__), 'models.py'),)):
+            self.assertEqual(self._generar(), b'%PDF-2')
+
+    def test_desalojo_lru_por_tamano(self, mock_html, mock_contexto):
+        mock_contexto.return_value.write_pdf.return_value = b'x' * 4096
+        periodos = ['P1', 'P2', 'P3']
+        for periodo in periodos:
+            self._generar(periodo_facturacion=periodo)
+        # Límite de 10 KB: la tercera factura desaloja a la usada hace más tiempo (P1)
+        self.assertEqual(mock_contexto.return_value.write_pdf.call_count, 3)
+        self._generar(periodo_facturacion='P3')
+        self._generar(periodo_facturacion='P2')
+        self.assertEqual(mock_contexto.return_value.write_pdf.call_count, 3)
+        self._generar(periodo_facturacion='P1')
+        self.assertEqual(mock_contexto.return_value.write_pdf.call_count, 4)
+        self.assertLessEqual(cache_facturas._tamano_total(), 10 * 1024)
+
+    def test_cache_desactivada(self, mock_html, mock_contexto):
+        mock_contexto.return_value.write_pdf.return_value = b'%PDF'
+        with self.settings(FACTURAS_CACHE_MAX_BYTES=0):
+            self._generar()
+            self._generar()
+        self.assertEqual(mock_contexto.return_value.write_pdf.call_count, 2)
+        self._generar(usar_cache=False)
+        self.assertEqual(mock_contexto.return_value.write_pdf.call_count, 3)
+
+
+class IndicesConsultasTests(TestCase):
+    """EXPLAIN de las consultas frecuentes de views.py: cada una debe resolverse con un índice."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = UserAcueducto.objects.create(
+            contrato="I001", name="Index", lastname="User",
+            email="index@example.com", categoria="residencial"
+        )
+        HistoricoLectura.objects.create(usuario=cls.usuario, fecha_lectura=date(2023, 1, 10), lectura=10)
+        cls.ruta = Ruta.objects.create(nombre="Ruta Indices", activa=True)
+        OrdenRuta.objects.create(ruta=cls.ruta, usuario=cls.usuario, orden=1)
+
+    def assertUsaIndice(self, queryset, indice):
+        plan = queryset.explain()
+        self.assertRegex(plan, rf'USING (COVERING )?INDEX {indice}\b', plan)
+
+    def test_historial_de_usuario(self):
+        self.assertUsaIndice(self.usuario.lecturas.all()[:6], 'historico_usuario_fecha_idx')
+        self.assertUsaIndice(self.usuario.lecturas.all().order_by('-fecha_lectura'), 'historico_usuario_fecha_idx')
+
+    def test_orden_de_usuario_en_ruta(self):
+        self.assertUsaIndice(self.ruta.ordenruta_set.filter(usuario=self.usuario), 'ordenruta_ruta_usuario_idx')
+
+    def test_lecturas_pendientes_de_ruta(self):
+        self.assertUsaIndice(self.ruta.ordenruta_set.filter(lectura_tomada=False), 'ordenruta_pendientes_idx')
+        # La consulta de exists() en finalizar_ruta_service no lleva ORDER BY
+        self.assertUsaIndice(self.ruta.ordenruta_set.filter(lectura_tomada=False).order_by(), 'ordenruta_pendientes_idx')
+
+    def test_prefetch_de_lecturas_de_la_ruta(self):
+        self.assertUsaIndice(HistoricoLectura.objects.filter(usuario__in=[self.usuario.pk]), 'historico_usuario_fecha_idx')
+
+    def test_ruta_activa(self):
+        self.assertUsaIndice(Ruta.objects.filter(activa=True), 'ruta_activa_idx')
+
+    def test_reconciliacion_de_contadores(self):
+        queryset = Ruta.objects.filter(activa=True).annotate(
+            total_real=services._conteo_ordenes(), completadas_real=services._conteo_ordenes(lectura_tomada=True)
+        )
+        self.assertUsaIndice(queryset, 'ruta_activa_idx')
+        self.assertUsaIndice(queryset, 'ordenruta_ruta_tomada_idx')
+
+    def test_usuario_por_contrato(self):
+        # contrato es unique: SQLite ya tiene su índice automático
+        self.assertUsaIndice(UserAcueducto.objects.filter(contrato='I001'), 'sqlite_autoindex_acueducto_useracueducto_\\d')
+
+
+from .services import pagina_usuarios_service
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+@override_settings(LISTA_USUARIOS_TAMANO_PAGINA=3)
+class ListaUsuariosPaginacionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(1, 8):
+            UserAcueducto.objects.create(
+                contrato=f"L{i:03d}", name="Lista", lastname=f"User{i}",
+                email=f"lista{i}@example.com", categoria="residencial",
+                address="Calle Norte" if i % 2 else "Calle Sur"
+            )
+
+    def test_paginas_por_cursor(self):
+        usuarios, siguiente = pagina_usuarios_service()
+        self.assertEqual([u.contrato for u in usuarios], ['L001', 'L002', 'L003'])
+        self.assertEqual(siguiente, 'L003')
+
+        usuarios, siguiente = pagina_usuarios_service(despues_de=siguiente)
+        self.assertEqual([u.contrato for u in usuarios], ['L004', 'L005', 'L006'])
+
+        usuarios, siguiente = pagina_usuarios_service(despues_de=siguiente)
+        self.assertEqual([u.contrato for u in usuarios], ['L007'])
+        self.assertIsNone(siguiente)
+
+    def test_paginas_con_busqueda(self):
+        usuarios, siguiente = pagina_usuarios_service(busqueda='norte')
+        self.assertEqual([u.contrato for u in usuarios], ['L001', 'L003', 'L005'])
+        usuarios, siguiente = pagina_usuarios_service(busqueda='norte', despues_de=siguiente)
+        self.assertEqual([u.contrato for u in usuarios], ['L007'])
+        self.assertIsNone(siguiente)
+
+    def test_pagina_no_usa_offset(self):
+        with CaptureQueriesContext(connection) as consultas:
+            pagina_usuarios_service(despues_de='L003')
+        sql = consultas.captured_queries[0]['sql']
+        self.assertNotIn('OFFSET', sql)
+        self.assertIn('LIMIT 4', sql)
+
+    def test_lista_renderiza_solo_la_primera_pagina(self):
+        response = self.client.get(reverse('lista_usuarios'))
+        self.assertEqual([u.contrato for u in response.context['usuarios']], ['L001', 'L002', 'L003'])
+        self.assertEqual(response.context['siguiente'], 'L003')
+        self.assertNotContains(response, 'L004')
+        # El selector de la ruta ya no trae usuarios renderizados
+        self.assertNotContains(response, 'name="usuarios_seleccionados"')
+
+        response = self.client.get(reverse('lista_usuarios'), {'despues': 'L006'})
+        self.assertEqual([u.contrato for u in response.context['usuarios']], ['L007'])
+        self.assertIsNone(response.context['siguiente'])
+
+    def test_lista_consultas_constantes(self):
+        # Mismas consultas con 7 usuarios que con 57: el costo no depende del total
+        with CaptureQueriesContext(connection) as antes:
+            self.client.get(reverse('lista_usuarios'))
+        for i in range(8, 58):
+            UserAcueducto.objects.create(
+                contrato=f"L{i:03d}", name="Lista", lastname=f"User{i}",
+                email=f"lista{i}@example.com", categoria="residencial"
+            )
+        with self.assertNumQueries(len(antes)):
+            self.client.get(reverse('lista_usuarios'))
+
+    def test_usuarios_json(self):
+        response = self.client.get(reverse('usuarios_json'), {'despues': 'L003', 'busqueda': 'sur'})
+        data = response.json()
+        self.assertEqual([u['contrato'] for u in data['usuarios']], ['L004', 'L006'])
+        self.assertIsNone(data['siguiente'])
+        self.assertEqual(data['usuarios'][0]['categoria'], 'Residencial')
+        self.assertEqual(data['usuarios'][0]['historico_url'], reverse('historico_lecturas', args=['L004']))
+
+        data = self.client.get(reverse('usuarios_json'), {'limite': '2'}).json()
+        self.assertEqual(len(data['usuarios']), 2)
+        self.assertEqual(data['siguiente'], 'L002')
+
+    def _ruta_con_todos(self):
+        ruta = Ruta.objects.create(nombre='Reparto', activa=True)
+        for orden, usuario in enumerate(UserAcueducto.objects.order_by('contrato'), start=1):
+            OrdenRuta.objects.create(ruta=ruta, usuario=usuario, orden=orden, lectura_tomada=orden == 1)
+        return ruta
+
+    def test_rutas_activas_sin_paradas(self):
+        ruta = self._ruta_con_todos()
+        with CaptureQueriesContext(connection) as antes:
+            response = self.client.get(reverse('lista_usuarios'))
+        # Solo los contadores; L007 no está en la primera página de usuarios ni se renderizan paradas
+        self.assertContains(response, 'Lecturas: 1 de 7')
+        self.assertContains(response, reverse('ordenes_ruta_json', args=[ruta.id]))
+        self.assertNotContains(response, 'L007')
+
+        for i in range(8, 40):
+            usuario = UserAcueducto.objects.create(contrato=f"L{i:03d}", name="Lista", lastname=f"User{i}",
+                                                   email=f"lista{i}@example.com", categoria="residencial")
+            OrdenRuta.objects.create(ruta=ruta, usuario=usuario, orden=i)
+        with self.assertNumQueries(len(antes)):
+            self.client.get(reverse('lista_usuarios'))
+
+    def test_ordenes_ruta_json(self):
+        ruta = self._ruta_con_todos()
+        url = reverse('ordenes_ruta_json', args=[ruta.id])
+        data = self.client.get(url).json()
+        self.assertEqual([o['contrato'] for o in data['ordenes']], ['L001', 'L002', 'L003'])
+        self.assertTrue(data['ordenes'][0]['lectura_tomada'])
+        self.assertEqual(data['siguiente'], 3)
+
+        data = self.client.get(url, {'despues': 6}).json()
+        self.assertEqual([o['contrato'] for o in data['ordenes']], ['L007'])
+        self.assertIsNone(data['siguiente'])
+        self.assertEqual(self.client.get(url, {'despues': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('ordenes_ruta_json', args=[ruta.id + 1])).status_code, 404)
+
+
+from . import busqueda
+
+class BusquedaUsuariosTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = UserAcueducto.objects.create(
+            contrato="12345", name="Maria", lastname="Gomez", email="b1@example.com",
+            address="Carrera 10 # 45-12", numero_de_medidor="MED-778"
+        )
+        cls.user2 = UserAcueducto.objects.create(
+            contrato="99123", name="Pedro", lastname="Ruiz", email="b2@example.com",
+            address="Calle 123 Sur"
+        )
+        cls.user3 = UserAcueducto.objects.create(
+            contrato="123", name="Ana", lastname="Lopez", email="b3@example.com",
+            address="Vereda El Alto"
+        )
+
+    def _contratos(self, texto, **kwargs):
+        return [usuario.contrato for usuario in busqueda.buscar_usuarios(texto, **kwargs)]
+
+    def test_indice_instalado_por_migrate(self):
+        self.assertTrue(busqueda.indice_disponible())
+        sql = str(busqueda.filtrar_usuarios(UserAcueducto.objects.all(), 'gomez').query)
+        self.assertIn('MATCH', sql)
+        self.assertNotIn('LIKE', sql)
+
+    def test_busqueda_por_subcadena_en_cada_campo(self):
+        self.assertEqual(self._contratos('carrera'), ['12345'])
+        self.assertEqual(self._contratos('GOMEZ'), ['12345'])
+        self.assertEqual(self._contratos('ia go'), ['12345'])  # nombre y apellido juntos
+        self.assertEqual(self._contratos('d-77'), ['12345'])
+        self.assertEqual(self._contratos('alto'), ['123'])
+        self.assertEqual(self._contratos('inexistente'), [])
+
+    def test_ranking(self):
+        # Contrato exacto, contrato que empieza por el texto, contrato que lo contiene y al final
+        # la coincidencia solo en la dirección (Calle 123 Sur es del contrato 99123)
+        UserAcueducto.objects.create(
+            contrato="777", name="Solo", lastname="Direccion", email="b5@example.com", address="Barrio 123"
+        )
+        self.assertEqual(self._contratos('123'), ['123', '12345', '99123', '777'])
+        self.assertEqual(self._contratos('123', limite=2), ['123', '12345'])
+        self.assertEqual(self._contratos('med-7'), ['12345'])
+
+    def test_texto_corto_sin_indice(self):
+        self.assertEqual(self._contratos('99'), ['99123'])
+        self.assertEqual(self._contratos('12'), ['123', '12345', '99123'])
+
+    def test_indice_sigue_cambios_sin_senales(self):
+        UserAcueducto.objects.filter(pk=self.user2.pk).update(address='Avenida Libertadores')
+        self.assertEqual(self._contratos('libertadores'), ['99123'])
+        self.assertEqual(self._contratos('123 sur'), [])
+
+        UserAcueducto.objects.bulk_create([
+            UserAcueducto(contrato="55501", name="Nuevo", lastname="Masivo", email="b4@example.com", address="Finca Libertad")
+        ])
+        self.assertEqual(self._contratos('finca'), ['55501'])
+
+        UserAcueducto.objects.filter(contrato="55501").delete()
+        self.assertEqual(self._contratos('finca'), [])
+
+    def test_filtrar_usuarios_en_lista(self):
+        response = self.client.get(reverse('lista_usuarios'), {'busqueda': 'lopez'})
+        self.assertEqual([u.contrato for u in response.context['usuarios']], ['123'])
+
+    def test_reinstala_triggers_perdidos(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TRIGGER {busqueda.TABLA_BUSQUEDA}_au")
+        # Sin trigger el índice queda desactualizado hasta que post_migrate lo reinstala
+        UserAcueducto.objects.filter(pk=self.user3.pk).update(address='Sector La Loma')
+        self.assertEqual(self._contratos('loma'), [])
+
+        self.assertTrue(busqueda.instalar_indice())
+        self.assertEqual(self._contratos('loma'), ['123'])
+        self.assertFalse(busqueda.instalar_indice())
+
+    def test_sin_indice_usa_icontains(self):
+        with mock.patch('acueducto.busqueda.indice_disponible', return_value=False):
+            self.assertEqual(self._contratos('gomez'), ['12345'])
+            sql = str(busqueda.filtrar_usuarios(UserAcueducto.objects.all(), 'gomez').query)
+        self.assertIn('LIKE', sql)
+
+    def test_sugerencias_json(self):
+        response = self.client.get(reverse('sugerencias_usuarios'), {'q': 'maria'})
+        self.assertEqual(response.json(), {'resultados': [{
+            'id': self.user1.id, 'contrato': '12345', 'nombre': 'Maria Gomez',
+            'address': 'Carrera 10 # 45-12', 'numero_de_medidor': 'MED-778',
+        }]})
+        self.assertEqual(self.client.get(reverse('sugerencias_usuarios')).json(), {'resultados': []})
+
+    def test_comando_reindexar(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {busqueda.TABLA_BUSQUEDA}")
+        self.assertEqual(self._contratos('gomez'), [])
+        out = StringIO()
+        call_command('reindexar_busqueda', stdout=out)
+        self.assertIn('3 usuarios indexados', out.getvalue())
+        self.assertEqual(self._contratos('gomez'), ['12345'])
+
+
+from django.db import IntegrityError
+import json
+
+class LoteLecturasTests(BaseAcueductoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.login(username='testuser', password='password123')
+        self.hoy = timezone.now().date()
+
+    def _enviar(self, lecturas, **kwargs):
+        return self.client.post(
+            reverse('registrar_lecturas_lote'), json.dumps({'lecturas': lecturas}),
+            content_type='application/json', **kwargs
+        )
+
+    def test_lote_registra_lecturas(self):
+        response = self._enviar([
+            {'id_cliente': 'disp1-1', 'contrato': '1001', 'lectura': 110.5},
+            {'id_cliente': 'disp1-2', 'usuario_id': self.user_ac3_no_orden.id, 'lectura': 210,
+             'fecha_lectura': str(self.hoy - timedelta(days=1))},
+        ])
+        data = response.json()
+        self.assertEqual((data['creadas'], data['duplicadas'], data['errores']), (2, 0, 0))
+        self.assertEqual([r['estado'] for r in data['resultados']], ['creada', 'creada'])
+
+        self.user_ac1.refresh_from_db()
+        self.assertEqual((self.user_ac1.lectura, self.user_ac1.fecha_ultima_lectura), (110.5, self.hoy))
+        self.assertEqual(self.user_ac1.lecturas.first().id_cliente, 'disp1-1')
+        self.user_ac3_no_orden.refresh_from_db()
+        self.assertEqual(self.user_ac3_no_orden.fecha_ultima_lectura, self.hoy - timedelta(days=1))
+        self.orden1.refresh_from_db()
+        self.assertTrue(self.orden1.lectura_tomada)
+
+    def test_reenvio_no_duplica(self):
+        lote = [
+            {'id_cliente': 'disp1-1', 'contrato': '1001', 'lectura': 110},
+            {'id_cliente': 'disp1-2', 'contrato': '1002', 'lectura': 160},
+        ]
+        self._enviar(lote)
+        total = HistoricoLectura.objects.count()
+
+        data = self._enviar(lote + [{'id_cliente': 'disp1-3', 'contrato': '1003', 'lectura': 220}]).json()
+        self.assertEqual([r['estado'] for r in data['resultados']], ['duplicada', 'duplicada', 'creada'])
+        self.assertEqual(HistoricoLectura.objects.count(), total + 1)
+
+    def test_errores_por_lectura_no_bloquean_el_lote(self):
+        data = self._enviar([
+            {'id_cliente': 'a', 'contrato': '9999', 'lectura': 10},
+            {'id_cliente': 'b', 'contrato': '1001', 'lectura': 'abc'},
+            {'contrato': '1001', 'lectura': 10},
+            {'id_cliente': 'c', 'contrato': '1001', 'lectura': 10, 'fecha_lectura': str(self.hoy + timedelta(days=1))},
+            {'id_cliente': 'd', 'contrato': '1002', 'lectura': 170},
+            {'id_cliente': 'd', 'contrato': '1002', 'lectura': 170},
+            'no es una lectura',
+        ]).json()
+        self.assertEqual([r['estado'] for r in data['resultados']],
+                         ['error', 'error', 'error', 'error', 'creada', 'duplicada', 'error'])
+        self.assertEqual(data['resultados'][0]['error'], 'Usuario no encontrado')
+        self.assertEqual(HistoricoLectura.objects.filter(id_cliente__isnull=False).count(), 1)
+
+    def test_lectura_atrasada_no_reemplaza_la_actual(self):
+        fecha_actual = self.user_ac1.fecha_ultima_lectura
+        self._enviar([{'id_cliente': 'vieja', 'contrato': '1001', 'lectura': 95,
+                       'fecha_lectura': str(fecha_actual - timedelta(days=3))}])
+        self.user_ac1.refresh_from_db()
+        self.assertEqual((self.user_ac1.lectura, self.user_ac1.fecha_ultima_lectura), (100, fecha_actual))
+        self.assertTrue(HistoricoLectura.objects.filter(id_cliente='vieja').exists())
+
+    def test_consultas_constantes(self):
+        def lote(prefijo, n):
+            return [{'id_cliente': f'{prefijo}-{i}', 'contrato': '1001' if i % 2 else '1002', 'lectura': 100 + i}
+                    for i in range(n)]
+        with CaptureQueriesContext(connection) as pocas:
+            self._enviar(lote('x', 2))
+        # Mismas órdenes por marcar en ambos envíos: solo debe variar el tamaño del lote
+        OrdenRuta.objects.update(lectura_tomada=False)
+        # 100 lecturas caben en un solo INSERT aun con el límite de 999 parámetros de SQLite
+        with CaptureQueriesContext(connection) as muchas:
+            self._enviar(lote('y', 100))
+        self.assertEqual(len(muchas), len(pocas))
+
+    def test_ndjson(self):
+        cuerpo = '\n'.join(json.dumps({'id_cliente': f'n{i}', 'contrato': '1003', 'lectura': 200 + i}) for i in range(3))
+        response = self.client.post(reverse('registrar_lecturas_lote'), cuerpo, content_type='application/x-ndjson')
+        self.assertEqual(response.json()['creadas'], 3)
+
+    def test_reintento_tras_conflicto_concurrente(self):
+        aplicar = services._aplicar_lote_lecturas
+        llamadas = []
+
+        def _aplicar(items, ruta_ids=None):
+            llamadas.append(items)
+            if len(llamadas) == 1:
+                # Otro envío del mismo lote insertó un id_cliente entre la consulta y el bulk_create
+                raise IntegrityError('UNIQUE constraint failed: acueducto_historicolectura.id_cliente')
+            return aplicar(items, ruta_ids)
+
+        with mock.patch('acueducto.services._aplicar_lote_lecturas', side_effect=_aplicar):
+            data = self._enviar([{'id_cliente': 'r1', 'contrato': '1001', 'lectura': 111}]).json()
+        self.assertEqual(len(llamadas), 2)
+        self.assertEqual(data['creadas'], 1)
+
+    def test_validaciones_del_envio(self):
+        self.assertEqual(self.client.post(reverse('registrar_lecturas_lote'), 'no json', content_type='application/json').status_code, 400)
+        self.assertEqual(self._enviar('x').status_code, 400)
+        with self.settings(LECTURAS_LOTE_MAX=2):
+            self.assertEqual(self._enviar([{}, {}, {}]).status_code, 413)
+        self.client.logout()
+        self.assertEqual(self._enviar([]).status_code, 401)
+
+
+class PaqueteRutaTests(BaseAcueductoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.login(username='testuser', password='password123')
+
+    def test_paquete_contiene_ordenes_y_lecturas(self):
+        response = self.client.get(reverse('paquete_ruta'))
+        self.assertEqual(response.status_code, 200)
+        paquete = response.json()
+        self.assertEqual(paquete['ruta']['id'], self.active_route.id)
+        self.assertEqual([o['usuario']['contrato'] for o in paquete['ordenes']], ['1001', '1002'])
+        self.assertEqual([o['lectura_tomada'] for o in paquete['ordenes']], [False, True])
+        lecturas = paquete['ordenes'][0]['usuario']['lecturas']
+        self.assertEqual(len(lecturas), services.LECTURAS_PAQUETE_RUTA)
+        self.assertEqual(lecturas[0]['lectura'], 100)
+        self.assertEqual(response['ETag'], f'"{paquete["version"]}"')
+
+    def test_304_si_el_paquete_no_cambio(self):
+        etag = self.client.get(reverse('paquete_ruta'))['ETag']
+        response = self.client.get(reverse('paquete_ruta'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        OrdenRuta.objects.filter(pk=self.orden1.pk).update(lectura_tomada=True)
+        response = self.client.get(reverse('paquete_ruta'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_consultas_constantes(self):
+        with CaptureQueriesContext(connection) as pocas:
+            self.client.get(reverse('paquete_ruta'))
+        for i in range(10):
+            usuario = UserAcueducto.objects.create(contrato=f'20{i:02d}', name='N', lastname='L', address='Calle',
+                                             email=f'p{i}@example.com', zona='A')
+            OrdenRuta.objects.create(ruta=self.active_route, usuario=usuario, orden=10 + i)
+            HistoricoLectura.objects.create(usuario=usuario, lectura=i, fecha_lectura=timezone.now().date())
+        with CaptureQueriesContext(connection) as muchas:
+            self.client.get(reverse('paquete_ruta'))
+        self.assertEqual(len(muchas), len(pocas))
+
+    def test_sin_ruta_activa_o_sin_sesion(self):
+        Ruta.objects.update(activa=False)
+        self.assertEqual(self.client.get(reverse('paquete_ruta')).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('paquete_ruta')).status_code, 401)
+
+    def test_service_worker_desde_la_raiz(self):
+        response = self.client.get(reverse('service_worker'))
+        self.assertEqual(reverse('service_worker'), '/sw.js')
+        self.assertEqual(response['Content-Type'], 'application/javascript')
+        self.assertIn(b'precargar', response.content)
+
+
+class ContadoresRutaTests(BaseAcueductoTestCase):
+    def _contadores(self, ruta):
+        ruta.refresh_from_db()
+        return ruta.total_ordenes, ruta.lecturas_completadas
+
+    def test_senales_de_orden(self):
+        self.assertEqual(self._contadores(self.active_route), (2, 1))
+        orden = OrdenRuta.objects.create(ruta=self.active_route, usuario=self.user_ac3_no_orden, orden=3)
+        self.assertEqual(self._contadores(self.active_route), (3, 1))
+
+        orden = OrdenRuta.objects.get(pk=orden.pk)
+        orden.lectura_tomada = True
+        orden.save()
+        orden.save() # Sin cambios no vuelve a sumar
+        self.assertEqual(self._contadores(self.active_route), (3, 2))
+
+        orden.delete()
+        self.assertEqual(self._contadores(self.active_route), (2, 1))
+
+    def test_guardar_instancia_vieja_no_pisa_contadores(self):
+        ruta = Ruta.objects.get(pk=self.active_route.pk)
+        services.marcar_lecturas_tomadas([self.user_ac1.pk])
+        ruta.nombre = 'Renombrada'
+        ruta.save()
+        self.assertEqual(self._contadores(self.active_route), (2, 2))
+
+    def test_save_con_contadores_cambiados(self):
+        ruta = Ruta.objects.get(pk=self.active_route.pk)
+        ruta.lecturas_completadas = 0
+        # Un save() completo no descarta el cambio en silencio
+        with self.assertRaises(ValueError):
+            ruta.save()
+        self.assertEqual(self._contadores(self.active_route), (2, 1))
+        # Pedido con update_fields se guarda tal cual (p. ej. una corrección manual)
+        ruta.save(update_fields=['lecturas_completadas'])
+        self.assertEqual(self._contadores(self.active_route), (2, 0))
+        ruta.refresh_from_db()
+        ruta.nombre = 'Renombrada'
+        ruta.save()
+
+    def test_marcar_lecturas_tomadas_no_cuenta_dos_veces(self):
+        self.assertEqual(services.marcar_lecturas_tomadas([self.user_ac1.pk, self.user_ac2.pk]), 1)
+        self.assertEqual(services.marcar_lecturas_tomadas([self.user_ac1.pk]), 0)
+        self.assertEqual(self._contadores(self.active_route), (2, 2))
+        self.assertEqual(self.active_route.porcentaje_completado(), 100)
+
+    def test_guardar_lectura_actualiza_contador(self):
+        self.client.login(username='testuser', password='password123')
+        self.client.post(reverse('guardar_lectura'), json.dumps({'usuario_id': self.user_ac1.id, 'lectura': 120}),
+                         content_type='application/json')
+        self.assertEqual(self._contadores(self.active_route), (2, 2))
+
+    def test_reconciliar_rutas(self):
+        # update() no pasa por las señales: los contadores quedan desactualizados
+        OrdenRuta.objects.filter(ruta=self.active_route).update(lectura_tomada=True)
+        Ruta.objects.filter(pk=self.empty_active_route.pk).update(total_ordenes=5)
+        salida = StringIO()
+        call_command('reconciliar_rutas', stdout=salida)
+        self.assertIn('2 rutas', salida.getvalue())
+        self.assertEqual(self._contadores(self.active_route), (2, 2))
+        self.assertEqual(self._contadores(self.empty_active_route), (0, 0))
+        self.assertEqual(services.reconciliar_contadores_rutas(), 0)
+
+    def test_toma_lectura_sin_agregaciones(self):
+        self.client.login(username='testuser', password='password123')
+        Ruta.objects.exclude(pk=self.active_route.pk).update(activa=False)
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('toma_lectura'))
+        self.assertEqual((response.context['total_lecturas'], response.context['lecturas_completadas']), (2, 1))
+        self.assertFalse([q['sql'] for q in consultas.captured_queries if 'COUNT(' in q['sql'].upper()])
+
+
+class TomaLecturaVistaTests(BaseAcueductoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.login(username='testuser', password='password123')
+        Ruta.objects.exclude(pk=self.active_route.pk).update(activa=False)
+
+    def test_lista_de_la_ruta_sin_historicos(self):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('toma_lectura'))
+        self.assertFalse([q['sql'] for q in consultas.captured_queries if 'acueducto_historicolectura' in q['sql']])
+        ordenes = list(response.context['ordenes_ruta'])
+        self.assertEqual([o['contrato'] for o in ordenes], ['1001', '1002'])
+        self.assertEqual(ordenes[0]['ultima_lectura'], self.user_ac1.lectura)
+        self.assertContains(response, f'id="usuario-{self.user_ac1.id}"')
+        self.assertContains(response, 'Ver historial', count=2)
+
+    def test_consultas_constantes(self):
+        with CaptureQueriesContext(connection) as pocas:
+            self.client.get(reverse('toma_lectura'))
+        for i in range(10):
+            usuario = UserAcueducto.objects.create(contrato=f'30{i:02d}', name='N', lastname='L', address='Calle',
+                                                   email=f'v{i}@example.com', zona='A')
+            OrdenRuta.objects.create(ruta=self.active_route, usuario=usuario, orden=10 + i)
+            HistoricoLectura.objects.create(usuario=usuario, lectura=i, fecha_lectura=timezone.now().date())
+        with CaptureQueriesContext(connection) as muchas:
+            self.client.get(reverse('toma_lectura'))
+        self.assertEqual(len(muchas), len(pocas))
+
+    def test_lectura_registrada_se_ve_en_la_lista(self):
+        response = self.client.post(reverse('toma_lectura'), {'contrato': '1001', 'lectura': '135'})
+        ordenes = list(response.context['ordenes_ruta'])
+        self.assertTrue(ordenes[0]['lectura_tomada'])
+        self.assertEqual(ordenes[0]['ultima_lectura'], 135)
+
+    def test_historial_bajo_demanda(self):
+        url = reverse('historial_lecturas_json', args=[self.user_ac1.id])
+        data = self.client.get(url).json()
+        self.assertEqual(len(data['lecturas']), services.LECTURAS_HISTORIAL)
+        self.assertEqual(data['lecturas'][0], {'fecha_lectura': self.user_ac1.fecha_ultima_lectura.isoformat(), 'lectura': 100})
+        self.assertEqual(len(self.client.get(url, {'limite': 2}).json()['lecturas']), 2)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+
+class RegistrarLecturaServiceTests(BaseAcueductoTestCase):
+    def _escrituras(self, consultas):
+        # Dentro del TestCase transaction.atomic() abre un SAVEPOINT; no es una consulta del servicio
+        return [q['sql'] for q in consultas.captured_queries if 'SAVEPOINT' not in q['sql']]
+
+    def test_registra_en_cuatro_consultas(self):
+        with CaptureQueriesContext(connection) as consultas:
+            historico, marcadas = services.registrar_lectura_service(self.user_ac3_no_orden.pk, '215.5', self.active_route.pk)
+        # Usuario, histórico, el mes en ConsumoMensual (un upsert) y la orden
+        self.assertLessEqual(len(self._escrituras(consultas)), 4)
+        self.assertEqual(marcadas, 0)
+        self.user_ac3_no_orden.refresh_from_db()
+        self.assertEqual((self.user_ac3_no_orden.lectura, self.user_ac3_no_orden.fecha_ultima_lectura),
+                         (215.5, timezone.now().date()))
+        self.assertEqual(historico.lectura, 215.5)
+
+    def test_solo_actualiza_columnas_de_lectura(self):
+        with CaptureQueriesContext(connection) as consultas:
+            services.registrar_lectura_service(self.user_ac1.pk, 120, self.active_route.pk)
+        (update_usuario,) = [sql for sql in self._escrituras(consultas) if sql.startswith('UPDATE "acueducto_useracueducto"')]
+        self.assertIn('"lectura"', update_usuario)
+        self.assertNotIn('"email"', update_usuario)
+        self.assertNotIn('"address"', update_usuario)
+
+    def test_marca_la_orden_y_el_contador(self):
+        with CaptureQueriesContext(connection) as consultas:
+            _, marcadas = services.registrar_lectura_service(self.user_ac1.pk, 120, self.active_route.pk)
+        # Las cuatro escrituras de la lectura más el contador de la ruta, que solo cambia si la orden se marcó
+        self.assertLessEqual(len(self._escrituras(consultas)), 5)
+        self.assertEqual(marcadas, 1)
+        self.orden1.refresh_from_db()
+        self.assertTrue(self.orden1.lectura_tomada)
+        self.active_route.refresh_from_db()
+        self.assertEqual(self.active_route.lecturas_completadas, 2)
+
+        _, marcadas = services.registrar_lectura_service(self.user_ac1.pk, 121, self.active_route.pk)
+        self.assertEqual(marcadas, 0)
+        self.active_route.refresh_from_db()
+        self.assertEqual(self.active_route.lecturas_completadas, 2)
+
+    def test_errores_no_dejan_escrituras(self):
+        total = HistoricoLectura.objects.count()
+        with self.assertRaises(UserAcueducto.DoesNotExist):
+            services.registrar_lectura_service(999999, 10)
+        with self.assertRaises(ValueError):
+            services.registrar_lectura_service(self.user_ac1.pk, 'abc')
+        self.assertEqual(HistoricoLectura.objects.count(), total)
+
+    def test_guardar_lectura_usuario_inexistente(self):
+        self.client.login(username='testuser', password='password123')
+        response = self.client.post(reverse('guardar_lectura'), json.dumps({'usuario_id': 999999, 'lectura': 10}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+
+class CrearRutaMasivaTests(BaseAcueductoTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        UserAcueducto.objects.bulk_create([
+            UserAcueducto(contrato=f'M{i:05d}', name='N', lastname='L', address=f'Calle {i}',
+                          email=f'm{i}@example.com', zona='A')
+            for i in range(600)
+        ])
+        cls.ids = list(UserAcueducto.objects.filter(contrato__startswith='M').order_by('contrato').values_list('id', flat=True))
+
+    def test_inserta_por_lotes(self):
+        with CaptureQueriesContext(connection) as consultas:
+            ruta = crear_nueva_ruta_service('Masiva', [{'id': id_usuario, 'orden': i} for i, id_usuario in enumerate(self.ids, 1)])
+        inserts = [q for q in consultas.captured_queries if q['sql'].startswith('INSERT INTO "acueducto_ordenruta"')]
+        # Un INSERT por lote, no uno por orden (SQLite admite 249 órdenes de 4 columnas por INSERT)
+        self.assertLessEqual(len(inserts), 3)
+        self.assertEqual(ruta.ordenruta_set.count(), 600)
+        ruta.refresh_from_db()
+        self.assertEqual((ruta.total_ordenes, ruta.lecturas_completadas), (600, 0))
+
+    def test_archiva_rutas_activas_sin_borrar_ordenes(self):
+        ordenes_antes = OrdenRuta.objects.count()
+        crear_nueva_ruta_service('Nueva', [{'id': self.ids[0], 'orden': 1}])
+        self.assertEqual(OrdenRuta.objects.count(), ordenes_antes + 1)
+        self.assertEqual(Ruta.objects.filter(activa=True).count(), 1)
+        self.assertTrue(Ruta.objects.filter(pk=self.active_route.pk, activa=False).exists())
+
+    def test_datos_invalidos_no_archivan(self):
+        for datos in ([{'id': self.ids[0], 'orden': 1}, {'id': self.ids[1], 'orden': 1}],
+                      [{'id': 999999, 'orden': 1}],
+                      [{'id': self.ids[0]}]):
+            with self.assertRaises(ValueError):
+                crear_nueva_ruta_service('Invalida', datos)
+        self.assertTrue(Ruta.objects.get(pk=self.active_route.pk).activa)
+
+
+from . import rutas
+import random
+
+class PlanificacionRutasTests(BaseAcueductoTestCase):
+    def _usuario(self, contrato, zona, address, latitud=None, longitud=None):
+        return UserAcueducto.objects.create(contrato=contrato, name='N', lastname='L', email=f'{contrato}@example.com',
+                                            zona=zona, address=address, latitud=latitud, longitud=longitud)
+
+    def test_posicion_direccion(self):
+        self.assertEqual(rutas.posicion_direccion('Calle 12 # 34-56'), (34.56, 12))
+        self.assertEqual(rutas.posicion_direccion('Cra 34B No. 12-5'), (34.2, 12.05))
+        self.assertEqual(rutas.posicion_direccion('KR 7 #45-10 apto 201'), (7, 45.1))
+        self.assertIsNone(rutas.posicion_direccion('Calle Falsa 123'))
+        self.assertIsNone(rutas.posicion_direccion(''))
+
+    def test_recorrido_sobre_una_linea(self):
+        puntos = [(x, 0) for x in range(50)]
+        random.Random(3).shuffle(puntos)
+        orden = rutas.ordenar_puntos(puntos)
+        self.assertEqual([puntos[indice][0] for indice in orden], list(range(50)))
+
+    def test_dos_opt_no_alarga_el_vecino_mas_cercano(self):
+        generador = random.Random(7)
+        puntos = [(generador.random() * 100, generador.random() * 100) for _ in range(2000)]
+        vecino = rutas._vecino_mas_cercano(puntos)
+        orden = rutas.ordenar_puntos(puntos)
+        self.assertEqual(sorted(orden), list(range(len(puntos))))
+        self.assertLess(rutas.longitud_recorrido(puntos, orden), rutas.longitud_recorrido(puntos, vecino))
+
+    def test_agrupa_por_zona_y_direccion(self):
+        b_lejos = self._usuario('P1', 'B', 'Calle 30 # 10-20')
+        a_sin = self._usuario('P2', 'A', 'Vereda El Alto')
+        a_calle5 = self._usuario('P3', 'A', 'Calle 5 # 10-20')
+        a_geo = self._usuario('P4', 'A', 'Finca', latitud=4.60, longitud=-74.08)
+        a_calle1 = self._usuario('P5', 'A', 'Calle 1 # 10-20')
+        b_cerca = self._usuario('P6', 'B', 'Calle 2 # 10-20')
+        a_calle3 = self._usuario('P7', 'A', 'Calle 3 # 10-20')
+        ordenados = rutas.ordenar_usuarios([b_lejos, a_sin, a_calle5, a_geo, a_calle1, b_cerca, a_calle3])
+        self.assertEqual(ordenados, [a_geo, a_calle1, a_calle3, a_calle5, a_sin, b_cerca, b_lejos])
+
+    def test_crear_ruta_optimizada(self):
+        lejos = self._usuario('Q1', 'A', 'Calle 9 # 1-10')
+        cerca = self._usuario('Q2', 'A', 'Calle 1 # 1-10')
+        medio = self._usuario('Q3', 'A', 'Calle 4 # 1-10')
+        datos = [{'id': usuario.id, 'orden': i} for i, usuario in enumerate([lejos, cerca, medio], 1)]
+        ruta = crear_nueva_ruta_service('Optimizada', datos, optimizar=True)
+        self.assertEqual([orden.usuario_id for orden in ruta.ordenruta_set.all()], [cerca.id, medio.id, lejos.id])
+
+    def test_endpoint_proponer_orden(self):
+        lejos = self._usuario('R1', 'A', 'Calle 9 # 1-10')
+        cerca = self._usuario('R2', 'A', 'Calle 1 # 1-10')
+        url = reverse('proponer_orden_ruta')
+        response = self.client.post(url, json.dumps({'usuario_ids': [lejos.id, cerca.id]}), content_type='application/json')
+        self.assertEqual(response.json()['usuario_ids'], [cerca.id, lejos.id])
+        self.assertEqual(self.client.post(url, 'x', content_type='application/json').status_code, 400)
+        with self.settings(RUTA_MAX_PARADAS=1):
+            response = self.client.post(url, json.dumps({'usuario_ids': [lejos.id, cerca.id]}), content_type='application/json')
+            self.assertEqual(response.status_code, 413)
+
+
+class RutasPorLectorTests(BaseAcueductoTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.lector1 = User.objects.create_user(username='lector1', password='password123')
+        cls.lector2 = User.objects.create_user(username='lector2', password='password123')
+        UserAcueducto.objects.bulk_create([
+            UserAcueducto(contrato=f'L{i:03d}', name='N', lastname='L', address=f'Calle {i} # 1-10',
+                          email=f'l{i}@example.com', zona='C')
+            for i in range(1, 12)
+        ])
+
+    def test_reparte_tramos_balanceados(self):
+        rutas_lector = services.repartir_rutas_service('Reparto', [self.lector1.id, self.lector2.id], zona='C')
+        self.assertEqual([ruta.lector_id for ruta in rutas_lector], [self.lector1.id, self.lector2.id])
+        self.assertEqual([ruta.total_ordenes for ruta in rutas_lector], [6, 5])
+        # Tramos consecutivos del recorrido: el primer lector recibe las calles 1 a 6
+        contratos = list(rutas_lector[0].ordenruta_set.values_list('usuario__contrato', flat=True))
+        self.assertEqual(contratos, [f'L{i:03d}' for i in range(1, 7)])
+        # La ruta sin lector sigue activa
+        self.assertTrue(Ruta.objects.get(pk=self.active_route.pk).activa)
+
+    def test_archiva_solo_las_rutas_del_lector(self):
+        anterior = crear_nueva_ruta_service('Anterior', [{'id': self.user_ac1.id, 'orden': 1}], lector_id=self.lector1.id)
+        otra = crear_nueva_ruta_service('Otra', [{'id': self.user_ac2.id, 'orden': 1}], lector_id=self.lector2.id)
+        services.repartir_rutas_service('Reparto', [self.lector1.id], zona='C')
+        self.assertFalse(Ruta.objects.get(pk=anterior.pk).activa)
+        self.assertTrue(Ruta.objects.get(pk=otra.pk).activa)
+        self.assertTrue(Ruta.objects.get(pk=self.active_route.pk).activa)
+
+    def test_datos_invalidos(self):
+        with self.assertRaises(ValueError):
+            services.repartir_rutas_service('Reparto', [999999])
+        with self.assertRaises(ValueError):
+            services.repartir_rutas_service('Reparto', [self.lector1.id], zona='Z')
+        with self.assertRaises(ValueError):
+            crear_nueva_ruta_service('X', [{'id': self.user_ac1.id, 'orden': 1}], lector_id=999999)
+
+    def test_cada_lector_ve_su_ruta(self):
+        Ruta.objects.exclude(pk=self.active_route.pk).update(activa=False)
+        propia = crear_nueva_ruta_service('Propia', [{'id': self.user_ac2.id, 'orden': 1}], lector_id=self.lector1.id)
+        self.client.login(username='lector1', password='password123')
+        self.assertEqual(self.client.get(reverse('toma_lectura')).context['ruta_activa'].pk, propia.pk)
+        # Un lector sin ruta asignada trabaja la ruta sin lector
+        self.client.login(username='lector2', password='password123')
+        self.assertEqual(self.client.get(reverse('toma_lectura')).context['ruta_activa'].pk, self.active_route.pk)
+
+    def test_guardar_lectura_marca_la_ruta_del_lector(self):
+        ruta1 = crear_nueva_ruta_service('R1', [{'id': self.user_ac1.id, 'orden': 1}], lector_id=self.lector1.id)
+        ruta2 = crear_nueva_ruta_service('R2', [{'id': self.user_ac1.id, 'orden': 1}], lector_id=self.lector2.id)
+        self.client.login(username='lector2', password='password123')
+        response = self.client.post(reverse('guardar_lectura'), json.dumps({'usuario_id': self.user_ac1.id, 'lectura': 130}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(OrdenRuta.objects.get(ruta=ruta1, usuario=self.user_ac1).lectura_tomada)
+        self.assertTrue(OrdenRuta.objects.get(ruta=ruta2, usuario=self.user_ac1).lectura_tomada)
+        self.assertFalse(OrdenRuta.objects.get(pk=self.orden1.pk).lectura_tomada)
+
+    def test_lectura_en_otra_ruta_del_lector(self):
+        # lector1 trabaja su ruta asignada y también la ruta sin lector, donde está user_ac1
+        crear_nueva_ruta_service('Propia', [{'id': self.user_ac2.id, 'orden': 1}], lector_id=self.lector1.id)
+        self.client.login(username='lector1', password='password123')
+        self.client.post(reverse('guardar_lectura'), json.dumps({'usuario_id': self.user_ac1.id, 'lectura': 130}),
+                         content_type='application/json')
+        self.assertTrue(OrdenRuta.objects.get(pk=self.orden1.pk).lectura_tomada)
+
+        OrdenRuta.objects.filter(pk=self.orden1.pk).update(lectura_tomada=False)
+        self.client.post(reverse('toma_lectura'), {'contrato': self.user_ac1.contrato, 'lectura': '140'})
+        self.assertTrue(OrdenRuta.objects.get(pk=self.orden1.pk).lectura_tomada)
+
+    def test_lote_marca_solo_las_rutas_del_lector(self):
+        ruta1 = crear_nueva_ruta_service('R1', [{'id': self.user_ac1.id, 'orden': 1}], lector_id=self.lector1.id)
+        ruta2 = crear_nueva_ruta_service('R2', [{'id': self.user_ac1.id, 'orden': 1}], lector_id=self.lector2.id)
+        self.client.login(username='lector2', password='password123')
+        response = self.client.post(
+            reverse('registrar_lecturas_lote'),
+            json.dumps({'lecturas': [{'id_cliente': 'l2-1', 'contrato': self.user_ac1.contrato, 'lectura': 130}]}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.json()['creadas'], 1)
+        self.assertFalse(OrdenRuta.objects.get(ruta=ruta1, usuario=self.user_ac1).lectura_tomada)
+        self.assertEqual(Ruta.objects.get(pk=ruta1.pk).lecturas_completadas, 0)
+        self.assertTrue(OrdenRuta.objects.get(ruta=ruta2, usuario=self.user_ac1).lectura_tomada)
+        self.assertEqual(Ruta.objects.get(pk=ruta2.pk).lecturas_completadas, 1)
+
+    def test_repartir_desde_lista_usuarios(self):
+        self.client.login(username='testuser', password='password123')
+        response = self.client.post(reverse('lista_usuarios'), {
+            'repartir_rutas': '1', 'nombre_reparto': 'Zona C',
+            'lectores': [self.lector1.id, self.lector2.id], 'zona_reparto': 'C',
+        })
+        self.assertRedirects(response, reverse('lista_usuarios'))
+        self.assertEqual(Ruta.objects.filter(activa=True, lector__isnull=False).count(), 2)
+
+
+from . import facturacion
+from . import utils
+from django.template.loader import get_template
+from decimal import Decimal
+import math
+
+TARIFAS_PRUEBA = {
+    'residencial': {'cargo_fijo': '5000', 'valor_m3': '1000'},
+    'comercial': {'cargo_fijo': '8000', 'valor_m3': '1500.50'},
+}
+
+@override_settings(FACTURACION_TARIFAS=TARIFAS_PRUEBA)
+class FacturacionTests(BaseAcueductoTestCase):
+    def test_consumos_por_columnas(self):
+        columnas = facturacion.Columnas()
+        columnas.extender([(1, 100, 10.0), (1, 101, 25.5), (1, 102, 30.0), (2, 101, 7.0), (2, 102, 5.0)])
+        columnas.indexar()
+        self.assertEqual((columnas.inicios, columnas.usuario_ids), ([0, 3], [1, 2]))
+        consumos = columnas.consumos()
+        self.assertTrue(math.isnan(consumos[0]) and math.isnan(consumos[3]))
+        self.assertEqual([consumos[1], consumos[2], consumos[4]], [15.5, 4.5, -2.0])
+        # Los consumos negativos no suman al período
+        self.assertEqual(facturacion.consumo_por_periodo(columnas), {101: 15.5, 102: 4.5})
+
+    def test_liquidar_todos(self):
+        UserAcueducto.objects.filter(pk=self.user_ac2.pk).update(categoria='comercial', credito=Decimal('1200.10'), otros_gastos_valor=300)
+        liquidaciones = facturacion.liquidar_todos()
+
+        juan = liquidaciones[self.user_ac1.pk]
+        self.assertEqual((juan.lectura_actual, juan.lectura_anterior, juan.consumo), (100, 98, 2))
+        self.assertEqual((juan.valor_consumo, juan.total), (Decimal('2000.00'), Decimal('7000.00')))
+
+        ana = liquidaciones[self.user_ac2.pk]
+        self.assertEqual(ana.valor_consumo, Decimal('3001.00'))
+        self.assertEqual(ana.total, Decimal('8000') + Decimal('3001.00') + Decimal('1200.10') + Decimal('300.00'))
+
+        # Sin histórico no hay consumo: solo el cargo fijo
+        luis = liquidaciones[self.user_ac3_no_orden.pk]
+        self.assertEqual((luis.lectura_actual, luis.consumo, luis.total), (200, None, Decimal('5000.00')))
+
+        # Una factura suelta, con las lecturas ya cargadas, da lo mismo que el cálculo de todos
+        self.assertEqual(facturacion.liquidar_usuario(self.user_ac1, self.user_ac1.lecturas.all()), juan)
+
+    def test_consumo_negativo_no_se_cobra(self):
+        HistoricoLectura.objects.create(usuario=self.user_ac1, lectura=3, fecha_lectura=timezone.now().date() + timedelta(days=1))
+        juan = facturacion.liquidar_todos()[self.user_ac1.pk]
+        self.assertEqual((juan.consumo, juan.valor_consumo, juan.total), (-97, Decimal('0.00'), Decimal('5000.00')))
+
+    def test_consultas_constantes(self):
+        with CaptureQueriesContext(connection) as pocas:
+            facturacion.liquidar_todos()
+        for i in range(20):
+            usuario = UserAcueducto.objects.create(contrato=f'F{i:03d}', name='N', lastname='L', email=f'f{i}@example.com')
+            HistoricoLectura.objects.bulk_create([
+                HistoricoLectura(usuario=usuario, lectura=10 * j, fecha_lectura=date(2024, j, 1)) for j in range(1, 13)
+            ])
+        with CaptureQueriesContext(connection) as muchas:
+            self.assertEqual(len(facturacion.liquidar_todos()), 23)
+        self.assertEqual(len(muchas), len(pocas))
+        self.assertEqual(len(muchas), 2)
+
+    def test_consumo_por_periodo_service(self):
+        usuario = UserAcueducto.objects.create(contrato='F900', name='N', lastname='L', email='f900@example.com', categoria='comercial')
+        for mes, lectura in ((1, 10), (2, 25), (3, 45)):
+            HistoricoLectura.objects.create(usuario=usuario, lectura=lectura, fecha_lectura=date(2023, mes, 5))
+        filas = services.consumo_por_periodo_service(desde=date(2023, 2, 1), categoria='comercial')
+        # La lectura de enero se carga para tener el consumo de febrero, pero enero no se reporta
+        self.assertEqual(filas, [
+            {'anio': 2023, 'mes': 2, 'categoria': 'comercial', 'consumo': 15},
+            {'anio': 2023, 'mes': 3, 'categoria': 'comercial', 'consumo': 20},
+        ])
+
+    def test_factura_usa_la_liquidacion(self):
+        contexto = utils.contexto_factura(self.user_ac1, datetime(2024, 1, 31), 'Enero')
+        self.assertEqual(contexto['liquidacion'].total, Decimal('7000.00'))
+        html = get_template('factura_template.html').render(contexto)
+        self.assertIn('Total a Pagar: $7.000,00', html)
+        self.assertIn('$1.000 por m³', html)
+
+    def test_clave_cache_depende_de_la_tarifa(self):
+        lecturas = list(self.user_ac1.lecturas.all())
+        claves = []
+        for tarifas in (TARIFAS_PRUEBA, {**TARIFAS_PRUEBA, 'residencial': {'cargo_fijo': '0', 'valor_m3': '900'}}):
+            with self.settings(FACTURACION_TARIFAS=tarifas):
+                liquidacion = facturacion.liquidar_usuario(self.user_ac1, lecturas)
+                claves.append(cache_facturas.clave_factura(self.user_ac1, lecturas, date(2024, 1, 31), 'Enero', 'v1', liquidacion=liquidacion))
+        self.assertNotEqual(claves[0], claves[1])
+
+
+
+from . import consumos
+from .models import ConsumoMensual
+
+class ConsumoMensualTests(BaseAcueductoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.usuario = UserAcueducto.objects.create(contrato='CM01', name='N', lastname='L', email='cm01@example.com')
+        for fecha, lectura in ((date(2024, 1, 10), 10), (date(2024, 2, 3), 20), (date(2024, 2, 20), 25), (date(2024, 3, 5), 45)):
+            HistoricoLectura.objects.create(usuario=self.usuario, fecha_lectura=fecha, lectura=lectura)
+
+    def _meses(self, usuario=None):
+        return list(ConsumoMensual.objects.filter(usuario=usuario or self.usuario).order_by('periodo').values_list(
+            'periodo__month', 'lectura', 'consumo'
+        ))
+
+    def test_se_mantiene_al_registrar_lecturas(self):
+        self.assertEqual(self._meses(), [(1, 10, None), (2, 25, 15), (3, 45, 20)])
+        # Reconstruir desde las lecturas da lo mismo que el mantenimiento incremental
+        incremental = list(ConsumoMensual.objects.order_by('usuario_id', 'periodo').values_list(
+            'usuario_id', 'periodo', 'lectura', 'fecha_lectura', 'consumo'
+        ))
+        consumos.recalcular_consumos()
+        self.assertEqual(list(ConsumoMensual.objects.order_by('usuario_id', 'periodo').values_list(
+            'usuario_id', 'periodo', 'lectura', 'fecha_lectura', 'consumo'
+        )), incremental)
+
+    def test_lectura_del_servicio_en_una_sentencia(self):
+        hoy = timezone.now().date()
+        for lectura in (50.2, 51.7):
+            with CaptureQueriesContext(connection) as consultas:
+                services.registrar_lectura_service(self.usuario.pk, lectura)
+            self.assertEqual(len([q for q in consultas.captured_queries if 'acueducto_consumomensual' in q['sql']]), 1)
+        # La segunda lectura del día reemplaza la primera en el mes; el consumo es contra marzo
+        self.assertEqual(self._meses()[-1], (hoy.month, 51.7, 6.7))
+        self.assertEqual(ConsumoMensual.objects.get(usuario=self.usuario, periodo=consumos.inicio_mes(hoy)).fecha_lectura, hoy)
+
+    def test_lectura_nueva_en_dos_consultas(self):
+        for fecha, lectura in ((date(2024, 4, 2), 60), (date(2024, 4, 28), 62), (date(2024, 4, 15), 61)):
+            with CaptureQueriesContext(connection) as consultas:
+                HistoricoLectura.objects.create(usuario=self.usuario, fecha_lectura=fecha, lectura=lectura)
+            consultas_consumo = [q['sql'] for q in consultas.captured_queries if 'acueducto_consumomensual' in q['sql']]
+            self.assertLessEqual(len(consultas_consumo), 2)
+        # La lectura del 15 no es la última de abril
+        self.assertEqual(self._meses()[-1], (4, 62, 17))
+
+    def test_lectura_atrasada_editada_y_eliminada(self):
+        atrasada = HistoricoLectura.objects.create(usuario=self.usuario, fecha_lectura=date(2024, 2, 25), lectura=30)
+        self.assertEqual(self._meses(), [(1, 10, None), (2, 30, 20), (3, 45, 15)])
+
+        atrasada = HistoricoLectura.objects.get(pk=atrasada.pk)
+        atrasada.fecha_lectura = date(2024, 3, 20)
+        atrasada.save()
+        self.assertEqual(self._meses(), [(1, 10, None), (2, 25, 15), (3, 30, 5)])
+
+        HistoricoLectura.objects.filter(usuario=self.usuario, fecha_lectura__month=3).delete()
+        self.assertEqual(self._meses(), [(1, 10, None), (2, 25, 15)])
+
+    def test_lote_de_lecturas(self):
+        items = [
+            {'id_cliente': 'cm-1', 'usuario_id': self.usuario.pk, 'lectura': 50, 'fecha_lectura': '2024-04-10'},
+            {'id_cliente': 'cm-2', 'contrato': self.user_ac3_no_orden.contrato, 'lectura': 210, 'fecha_lectura': '2024-04-10'},
+        ]
+        resultados = services.registrar_lecturas_lote_service(items)
+        self.assertEqual([r['estado'] for r in resultados], ['creada', 'creada'])
+        self.assertEqual(self._meses()[-1], (4, 50, 5))
+        self.assertEqual(self._meses(self.user_ac3_no_orden), [(4, 210, None)])
+
+    def test_comando_reconstruir(self):
+        ConsumoMensual.objects.all().delete()
+        salida = StringIO()
+        call_command('reconstruir_consumos', contrato=['CM01'], stdout=salida)
+        self.assertIn('3 meses de consumo', salida.getvalue())
+        self.assertEqual(self._meses(), [(1, 10, None), (2, 25, 15), (3, 45, 20)])
+        self.assertFalse(ConsumoMensual.objects.filter(usuario=self.user_ac1).exists())
+
+    def test_historico_lee_la_tabla_mensual(self):
+        self.client.login(username='testuser', password='password123')
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse('historico_lecturas', args=['CM01']))
+        self.assertFalse([q['sql'] for q in consultas.captured_queries if 'acueducto_historicolectura' in q['sql']])
+        self.assertEqual([(c.periodo.month, c.consumo) for c in response.context['historico']], [(3, 20), (2, 15), (1, None)])
+
+    def test_grafico_de_la_factura(self):
+        contexto = utils.contexto_factura(self.usuario, datetime(2024, 3, 31), 'Marzo')
+        self.assertEqual([c.periodo.month for c in contexto['consumos_mensuales']], [1, 2, 3])
+        html = get_template('factura_template.html').render(contexto)
+        self.assertIn("'01/2024',", html)
+        self.assertRegex(html, r"var consumos = \[\s*0,\s*15,\s*20,")
+
+
+from . import analitica
+from django.core.cache import cache
+from django.test import override_settings
+
+class AnaliticaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='analista', password='password123')
+        cls.norte_r = UserAcueducto.objects.create(contrato='AN1', name='A', lastname='1', email='an1@example.com', zona='Norte', credito=1000)
+        cls.norte_c = UserAcueducto.objects.create(contrato='AN2', name='A', lastname='2', email='an2@example.com', zona='Norte', categoria='comercial', otros_gastos_valor=500)
+        cls.sin_zona = UserAcueducto.objects.create(contrato='AN3', name='A', lastname='3', email='an3@example.com', credito='250.50')
+        # Hace dos meses, el mes pasado y este mes
+        cls.meses = [analitica.primer_mes(n) for n in (3, 2, 1)]
+        for usuario, lecturas in ((cls.norte_r, (10, 25, 30)), (cls.norte_c, (None, 5, 3))):
+            for mes, lectura in zip(cls.meses, lecturas):
+                if lectura is not None:
+                    HistoricoLectura.objects.create(usuario=usuario, fecha_lectura=mes, lectura=lectura)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_una_consulta_agrupada_por_panel(self):
+        with self.assertNumQueries(2):
+            tablero = analitica.calcular_tablero(2)
+        self.assertEqual(tablero['desde'], self.meses[1])
+        self.assertEqual(tablero['totales'], {'usuarios': 3, 'credito': Decimal('1250.50'), 'otros_gastos': Decimal('500')})
+        self.assertEqual([(z['zona'], z['usuarios'], z['credito']) for z in tablero['zonas']], [('', 1, Decimal('250.50')), ('Norte', 2, Decimal('1000'))])
+        self.assertEqual([(c['categoria'], c['usuarios']) for c in tablero['categorias']], [('comercial', 1), ('residencial', 2)])
+        # El consumo negativo del usuario comercial no suma; la cobertura es sobre los usuarios actuales
+        self.assertEqual(
+            [(m['periodo'], m['consumo'], m['lecturas'], m['cobertura']) for m in tablero['consumo_mensual']],
+            [(self.meses[1], 15, 2, 0.6667), (self.meses[2], 5, 2, 0.6667)]
+        )
+        self.assertEqual(
+            [(f['zona'], f['categoria'], f['consumo'], f['lecturas'], f['cobertura']) for f in tablero['consumo'] if f['periodo'] == self.meses[2]],
+            [('Norte', 'comercial', 0, 1, 1.0), ('Norte', 'residencial', 5, 1, 1.0)]
+        )
+
+    def test_cache_por_tiempo(self):
+        with self.assertNumQueries(2):
+            analitica.tablero(12)
+        HistoricoLectura.objects.create(usuario=self.sin_zona, fecha_lectura=self.meses[2], lectura=1)
+        with self.assertNumQueries(0):
+            tablero = analitica.tablero(12)
+        self.assertEqual(tablero['consumo_mensual'][-1]['lecturas'], 2)
+        with override_settings(ANALITICA_CACHE_SEGUNDOS=0), self.assertNumQueries(2):
+            self.assertEqual(analitica.tablero(12)['consumo_mensual'][-1]['lecturas'], 3)
+
+    def test_vistas(self):
+        self.assertEqual(self.client.get(reverse('tablero_analitica_json')).status_code, 401)
+        self.client.login(username='analista', password='password123')
+        datos = self.client.get(reverse('tablero_analitica_json'), {'meses': 'x'}).json()
+        self.assertEqual(datos['meses'], analitica.MESES_POR_DEFECTO)
+        self.assertEqual(datos['totales']['credito'], '1250.50')
+        response = self.client.get(reverse('tablero_analitica'), {'meses': 500})
+        self.assertEqual(response.context['tablero']['meses'], analitica.MESES_MAX)
+        self.assertContains(response, 'Sin zona')
+
+
+from . import anomalias
+from .models import AnomaliaLectura
+
+class AnomaliasLecturaTests(BaseAcueductoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hoy = timezone.now().date()
+        self.usuario = UserAcueducto.objects.create(contrato='AL01', name='N', lastname='L', email='al01@example.com')
+        # Consumos de 10 m³, un pico de 60 m³ y una lectura menor que la anterior
+        for meses_atras, lectura in zip(range(7, 0, -1), (0, 10, 20, 30, 40, 100, 95)):
+            HistoricoLectura.objects.create(
+                usuario=self.usuario, lectura=lectura, fecha_lectura=self.hoy - timedelta(days=30 * meses_atras)
+            )
+        UserAcueducto.objects.filter(pk=self.user_ac2.pk).update(fecha_ultima_lectura=self.hoy - timedelta(days=90))
+
+    def _anomalias(self):
+        return list(AnomaliaLectura.objects.order_by('usuario_id', 'fecha').values_list('usuario__contrato', 'tipo', 'consumo'))
+
+    def test_pasada_completa(self):
+        conteo = anomalias.detectar_anomalias()
+        self.assertEqual(dict(conteo), {'pico': 1, 'consumo_negativo': 1, 'medidor_sin_lectura': 1})
+        self.assertEqual(self._anomalias(), [
+            ('1002', 'medidor_sin_lectura', None), ('AL01', 'pico', 60), ('AL01', 'consumo_negativo', -5),
+        ])
+        pico = AnomaliaLectura.objects.get(tipo='pico')
+        self.assertEqual((pico.referencia, pico.lectura.lectura), (10, 100))
+        # Volver a pasar reemplaza las anomalías en lugar de duplicarlas
+        anomalias.detectar_anomalias()
+        self.assertEqual(AnomaliaLectura.objects.count(), 3)
+
+    def test_pasada_por_bloques(self):
+        with mock.patch.object(anomalias, 'TAMANO_LOTE', 1):
+            conteo = anomalias.detectar_anomalias(UserAcueducto.objects.filter(contrato='AL01'))
+        self.assertEqual(sum(conteo.values()), 2)
+        self.assertEqual([tipo for _, tipo, _ in self._anomalias()], ['pico', 'consumo_negativo'])
+
+    def test_revisar_lectura_nueva(self):
+        historico, _ = services.registrar_lectura_service(self.usuario.pk, 160)
+        with self.assertNumQueries(2):
+            encontradas = anomalias.revisar_lectura(historico)
+        # 65 m³ frente a una mediana de 10 m³ (el consumo negativo no cuenta)
+        self.assertEqual([(a.tipo, a.consumo, a.referencia) for a in encontradas], [('pico', 65, 10)])
+        self.assertEqual(AnomaliaLectura.objects.get().lectura, historico)
+        historico, _ = services.registrar_lectura_service(self.usuario.pk, 170)
+        with self.assertNumQueries(1):
+            self.assertEqual(anomalias.revisar_lectura(historico), [])
+
+    def test_advertencias_al_guardar(self):
+        self.client.login(username='testuser', password='password123')
+        data = self.client.post(reverse('guardar_lectura'), json.dumps({'usuario_id': self.usuario.id, 'lectura': 90}),
+                                content_type='application/json').json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['advertencias'], ['La lectura 90 es menor que la anterior (95)'])
+        response = self.client.post(reverse('toma_lectura'), {'contrato': 'AL01', 'lectura': '300'})
+        self.assertEqual(len(response.context['advertencias']), 1)
+        self.assertContains(response, 'Verifique la lectura: Consumo de 210 m³')
+        response = self.client.post(reverse('toma_lectura'), {'contrato': '1001', 'lectura': '102'})
+        self.assertEqual(response.context['advertencias'], [])
+
+    def test_comando(self):
+        salida = StringIO()
+        call_command('detectar_anomalias', contrato=['AL01'], stdout=salida)
+        self.assertIn('2 anomalías encontradas', salida.getvalue())
+
+
+from . import exportacion
+from django.http import StreamingHttpResponse
+import csv
+import io
+import xml.etree.ElementTree as ET
+
+@override_settings(FACTURACION_TARIFAS=TARIFAS_PRUEBA)
+class ExportacionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='exporta', password='password123')
+        cls.usuario = UserAcueducto.objects.create(contrato='EX01', name='José', lastname='Núñez', email='ex01@example.com',
+                                                   address='Calle "8", #3', credito='1500.00')
+        cls.comercial = UserAcueducto.objects.create(contrato='EX02', name='Tienda', lastname='\x07', email='ex02@example.com',
+                                                     categoria='comercial')
+        for usuario, lecturas in ((cls.usuario, (10, 25, 20)), (cls.comercial, (100, 110, 130))):
+            for mes, lectura in zip((1, 2, 3), lecturas):
+                HistoricoLectura.objects.create(usuario=usuario, fecha_lectura=date(2024, mes, 10), lectura=lectura)
+
+    def setUp(self):
+        self.client.login(username='exporta', password='password123')
+
+    def _csv(self, tipo, **parametros):
+        response = self.client.get(reverse('exportar', args=[tipo]), parametros)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        texto = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(texto.startswith('\ufeff'))
+        return list(csv.reader(io.StringIO(texto[1:])))
+
+    def test_usuarios_csv(self):
+        filas = self._csv('usuarios')
+        self.assertEqual(filas[0][:3], ['Contrato', 'Nombre', 'Apellido'])
+        self.assertEqual([fila[0] for fila in filas[1:]], ['EX01', 'EX02'])
+        self.assertEqual((filas[1][1], filas[1][5], filas[1][11]), ('José', 'Calle "8", #3', '1500.00'))
+
+    def test_lecturas_desde(self):
+        self.assertEqual(len(self._csv('lecturas')), 7)
+        filas = self._csv('lecturas', desde='2024-03-01')
+        self.assertEqual([fila[:3] for fila in filas[1:]], [['EX01', '2024-03-10', '20.0'], ['EX02', '2024-03-10', '130.0']])
+
+    def test_facturacion_por_mes(self):
+        filas = self._csv('facturacion', desde='2024-02-15')
+        self.assertEqual(filas[0][-1], 'Total')
+        # Febrero y marzo; el consumo negativo de marzo solo paga el cargo fijo
+        self.assertEqual([(f[0], f[2], f[4], f[-1]) for f in filas[1:]], [
+            ('EX01', '2024-02', '15.0', '20000.00'), ('EX01', '2024-03', '-5.0', '5000.00'),
+            ('EX02', '2024-02', '10.0', '23005.00'), ('EX02', '2024-03', '20.0', '38010.00'),
+        ])
+
+    def test_xlsx(self):
+        response = self.client.get(reverse('exportar', args=['usuarios']), {'formato': 'xlsx'})
+        self.assertEqual(response['Content-Type'], exportacion.FORMATOS['xlsx'])
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as libro:
+            self.assertIn('xl/workbook.xml', libro.namelist())
+            hoja = ET.fromstring(libro.read('xl/worksheets/sheet1.xml'))
+        ns = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+        filas = [
+            [celda.findtext(f'{ns}v') or celda.findtext(f'{ns}is/{ns}t') for celda in fila]
+            for fila in hoja.iter(f'{ns}row')
+        ]
+        self.assertEqual(len(filas), 3)
+        # Texto con comillas y un carácter de control que XML no admite; números como números
+        self.assertEqual((filas[1][0], filas[1][5], filas[2][2]), ('EX01', 'Calle "8", #3', ''))
+        self.assertEqual(filas[1][11], '1500.00')
+
+    def test_se_envia_por_trozos(self):
+        with mock.patch.object(exportacion, 'FILAS_POR_TROZO', 2), self.assertNumQueries(1):
+            trozos = list(exportacion.exportar('lecturas'))
+        self.assertEqual(len(trozos), 4)
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.client.get(reverse('exportar', args=['usuarios']), {'formato': 'pdf'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('exportar', args=['otro'])).status_code, 400)
+        self.assertEqual(self.client.get(reverse('exportar', args=['lecturas']), {'desde': 'ayer'}).status_code, 400)
+
+    def test_comando(self):
+        salida = StringIO()
+        call_command('exportar', 'lecturas', '--desde', '2024-03-01', stdout=salida)
+        self.assertEqual(len(salida.getvalue().splitlines()), 3)
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'facturacion.xlsx')
+            call_command('exportar', 'facturacion', '--formato', 'xlsx', '--salida', ruta, stderr=StringIO())
+            with zipfile.ZipFile(ruta) as libro:
+                self.assertIn('xl/worksheets/sheet1.xml', libro.namelist())
+
+
+from . import importacion
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import CommandError
+
+
+class ImportacionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_user = User.objects.create_user(username='importa', password='password123')
+        cls.existente = UserAcueducto.objects.create(contrato='IM01', name='Ana', lastname='Ríos', email='ana@example.com',
+                                                     numero_de_medidor='MED-1', lectura=50,
+                                                     fecha_ultima_lectura=date(2024, 2, 10))
+        HistoricoLectura.objects.create(usuario=cls.existente, fecha_lectura=date(2024, 2, 10), lectura=50)
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _errores(self, resumen):
+        return {error['fila']: error['error'] for error in resumen['errores']}
+
+    def test_crea_usuarios_y_valida_unicos(self):
+        resumen = importacion.importar_usuarios(StringIO(
+            'Contrato,Nombre,Apellido,Correo,Categoría,Medidor,Crédito\n'
+            'IM02,Luis,Gómez,luis@example.com,Comercial,MED-2,"1500,50"\n'
+            'IM03,Eva,Sosa,ana@example.com,residencial,,\n'       # email de IM01
+            'IM04,Rita,Paz,rita@example.com,residencial,MED-1,\n'  # medidor de IM01
+            'IM05,Leo,Mora,luis@example.com,residencial,,\n'       # email de IM02 en el archivo
+            'IM02,Luis,Gómez,otro@example.com,residencial,,\n'     # contrato repetido
+            'IM01,Ana,Ríos,ana@example.com,residencial,,\n'        # ya existe
+            'IM06,,Vega,correo-invalido,industrial,,\n'
+            '\n'
+            'IM07,Sol,Luna,sol@example.com,residencial,,\n'
+        ))
+        self.assertEqual((resumen['filas'], resumen['creados'], resumen['con_error']), (8, 2, 6))
+        errores = self._errores(resumen)
+        self.assertIn('ya pertenece al contrato IM01', errores[3])
+        self.assertIn('numero_de_medidor: MED-1', errores[4])
+        self.assertIn('ya pertenece al contrato IM02', errores[5])
+        self.assertEqual(errores[6], 'Contrato repetido en el archivo')
+        self.assertEqual(errores[7], 'El contrato ya existe')
+        self.assertTrue(errores[8].startswith('name:'))
+        self.assertIn('email:', errores[8])
+        self.assertIn('categoria:', errores[8])
+        luis = UserAcueducto.objects.get(contrato='IM02')
+        self.assertEqual((luis.categoria, luis.numero_de_medidor, str(luis.credito)), ('comercial', 'MED-2', '1500.50'))
+        self.assertTrue(UserAcueducto.objects.filter(contrato='IM07').exists())
+
+    def test_actualizar_por_contrato(self):
+        resumen = importacion.importar_usuarios(StringIO(
+            'contrato;nombre;apellido;email;categoria;zona\n'
+            'IM01;Ana María;Ríos;ana@example.com;comercial;Norte\n'
+            'IM08;Juan;Paz;juan.paz@example.com;residencial;Sur\n'
+        ), actualizar=True)
+        self.assertEqual((resumen['creados'], resumen['actualizados'], resumen['con_error']), (1, 1, 0))
+        self.existente.refresh_from_db()
+        # Solo cambian las columnas del archivo
+        self.assertEqual((self.existente.name, self.existente.zona, self.existente.numero_de_medidor), ('Ana María', 'Norte', 'MED-1'))
+
+    def test_columnas_obligatorias_y_filas_cortas(self):
+        with self.assertRaisesMessage(ValueError, 'Faltan columnas obligatorias: email'):
+            importacion.importar_usuarios(StringIO('contrato,nombre,apellido\nIM10,Eva,Sosa\n'))
+        self.assertFalse(UserAcueducto.objects.filter(contrato='IM10').exists())
+
+        resumen = importacion.importar_usuarios(StringIO(
+            'contrato,nombre,apellido,email,zona\n'
+            'IM01,Ana,Ríos,ana@example.com,Norte\n'
+            'IM11,Eva,Sosa,eva@example.com\n'   # sin zona
+            'IM12,Leo\n'                        # sin apellido ni email
+        ), actualizar=True)
+        self.assertEqual((resumen['creados'], resumen['actualizados']), (1, 1))
+        self.assertIn('email:', self._errores(resumen)[4])
+        self.assertEqual(UserAcueducto.objects.get(contrato='IM11').zona, '')
+
+    def test_error_de_integridad_se_informa_por_fila(self):
+        guardar = importacion._guardar_usuarios
+
+        def guardar_con_carrera(nuevos, cambios, campos):
+            # Otro proceso registra el email de IM14 entre las consultas del lote y el insert
+            if not UserAcueducto.objects.filter(contrato='OTRO').exists():
+                UserAcueducto.objects.create(contrato='OTRO', name='O', lastname='T', email='im14@example.com')
+            return guardar(nuevos, cambios, campos)
+
+        with mock.patch.object(importacion, '_guardar_usuarios', side_effect=guardar_con_carrera):
+            resumen = importacion.importar_usuarios(StringIO(
+                'contrato,nombre,apellido,email\n'
+                'IM13,Noa,Gil,im13@example.com\n'
+                'IM14,Ivo,Paz,im14@example.com\n'
+                'IM01,Ana,Ríos,ana@example.com\n'
+            ), actualizar=True)
+        self.assertEqual((resumen['creados'], resumen['actualizados'], resumen['con_error']), (1, 1, 1))
+        self.assertEqual(resumen['errores'][0]['contrato'], 'IM14')
+        self.assertIn('No se pudo guardar', resumen['errores'][0]['error'])
+        self.assertTrue(UserAcueducto.objects.filter(contrato='IM13').exists())
+
+    def test_consultas_por_lote(self):
+        def archivo(filas):
+            lineas = ['contrato,nombre,apellido,email,categoria,medidor']
+            lineas += [f'Q{i:05d},N,A,q{i}@example.com,residencial,M{i}' for i in range(filas)]
+            return StringIO('\n'.join(lineas))
+
+        with mock.patch.object(importacion, 'TAMANO_LOTE', 50):
+            with CaptureQueriesContext(connection) as un_lote:
+                importacion.importar_usuarios(archivo(50))
+            UserAcueducto.objects.filter(contrato__startswith='Q').delete()
+            with CaptureQueriesContext(connection) as cuatro_lotes:
+                resumen = importacion.importar_usuarios(archivo(200))
+        self.assertEqual(resumen['creados'], 200)
+        self.assertEqual(len(cuatro_lotes), 4 * len(un_lote))
+
+    def test_importar_lecturas(self):
+        resumen = importacion.importar_lecturas(StringIO(
+            'Contrato,Fecha lectura,Lectura\n'
+            'IM01,2024-01-10,40\n'
+            'IM01,10/03/2024,"62,5"\n'
+            'IM01,2024-02-10,50\n'   # ya registrada
+            'IM01,2024-03-10,63\n'   # repetida en el archivo
+            'NOEXISTE,2024-03-10,1\n'
+            'IM01,2099-01-01,70\n'
+            'IM01,2024-04-10,abc\n'
+        ))
+        self.assertEqual((resumen['creados'], resumen['duplicados'], resumen['con_error']), (2, 2, 3))
+        self.assertEqual(self._errores(resumen), {
+            6: 'Usuario no encontrado', 7: 'fecha_lectura no puede ser futura', 8: 'lectura debe ser un número',
+        })
+        self.existente.refresh_from_db()
+        self.assertEqual((self.existente.lectura, self.existente.fecha_ultima_lectura), (62.5, date(2024, 3, 10)))
+        self.assertEqual(
+            list(ConsumoMensual.objects.filter(usuario=self.existente).order_by('periodo').values_list('periodo', 'consumo')),
+            [(date(2024, 1, 1), None), (date(2024, 2, 1), 10.0), (date(2024, 3, 1), 12.5)],
+        )
+
+    def test_comando(self):
+        ruta = os.path.join(self.media_root, 'usuarios.csv')
+        with open(ruta, 'w', encoding='utf-8-sig') as archivo:
+            archivo.write('contrato,nombre,apellido,email,categoria\nIM09,Noa,Gil,noa@example.com,residencial\nIM01,A,B,ana@example.com,residencial\n')
+        out, err = StringIO(), StringIO()
+        call_command('importar', 'usuarios', ruta, stdout=out, stderr=err)
+        self.assertIn('1 creadas', out.getvalue())
+        self.assertIn('Fila 3 (IM01): El contrato ya existe', err.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('importar', 'lecturas', os.path.join(self.media_root, 'no_existe.csv'), stdout=out)
+
+    def test_vista_encola_importacion(self):
+        self.client.login(username='importa', password='password123')
+        archivo = SimpleUploadedFile('lecturas.csv', 'contrato,fecha,lectura\nIM01,2024-03-10,58\nXX,2024-03-10,1\n'.encode('utf-8'))
+        response = self.client.post(reverse('importar'), {'tipo': 'lecturas', 'archivo': archivo})
+        trabajo = TrabajoFacturacion.objects.get(tipo='importar_lecturas')
+        self.assertRedirects(response, f"{reverse('importar')}?trabajo={trabajo.id}", fetch_redirect_response=False)
+        self.assertEqual(HistoricoLectura.objects.filter(usuario=self.existente).count(), 1)
+
+        trabajo = services.ejecutar_trabajo(services.tomar_siguiente_trabajo())
+        self.assertEqual((trabajo.estado, trabajo.total, trabajo.procesadas, trabajo.fallidas), ('completado', 2, 1, 1))
+        self.assertEqual(trabajo.mensaje, '1 lecturas importadas, 0 ya registradas, 1 filas con error')
+        self.assertFalse(os.listdir(os.path.join(self.media_root, 'importaciones')))
+        self.existente.refresh_from_db()
+        self.assertEqual(self.existente.lectura, 58)
+
+        response = self.client.get(reverse('importar'), {'trabajo': trabajo.id})
+        self.assertContains(response, 'Usuario no encontrado')
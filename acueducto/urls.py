@@ -6,12 +6,26 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     path('', views.index, name='index'),
     path('lista/', views.lista_usuarios, name='lista_usuarios'),
+    path('usuarios/json/', views.usuarios_json, name='usuarios_json'),
     path('factura/', views.generar_factura, name='generar_factura'),
     path('toma-lectura/', views.toma_lectura, name='toma_lectura'),
     path('guardar-lectura/', views.guardar_lectura, name='guardar_lectura'),
+    path('usuarios/<int:usuario_id>/lecturas/', views.historial_lecturas_json, name='historial_lecturas_json'),
+    path('lecturas/lote/', views.registrar_lecturas_lote, name='registrar_lecturas_lote'),
+    path('rutas/activa/paquete/', views.paquete_ruta, name='paquete_ruta'),
+    path('sw.js', views.service_worker, name='service_worker'),
     path('historico-lecturas/<str:contrato>/', views.historico_lecturas, name='historico_lecturas'),
     path('buscar-usuario/', views.buscar_usuario_por_contrato, name='buscar_usuario'),
+    path('usuarios/sugerencias/', views.sugerencias_usuarios, name='sugerencias_usuarios'),
     path('modificar-usuario/', views.modificar_usuario, name='modificar_usuario'),
+    path('rutas/<int:ruta_id>/ordenes/', views.ordenes_ruta_json, name='ordenes_ruta_json'),
+    path('rutas/proponer-orden/', views.proponer_orden_ruta, name='proponer_orden_ruta'),
     path('finalizar-ruta/', views.finalizar_ruta, name='finalizar_ruta'),
+    path('analitica/', views.tablero_analitica, name='tablero_analitica'),
+    path('analitica/json/', views.tablero_analitica_json, name='tablero_analitica_json'),
+    path('exportar/<str:tipo>/', views.exportar, name='exportar'),
+    path('importar/', views.importar, name='importar'),
+    path('trabajos/<int:trabajo_id>/', views.estado_trabajo, name='estado_trabajo'),
+    path('trabajos/<int:trabajo_id>/descargar/', views.descargar_trabajo, name='descargar_trabajo'),
     
 ]
@@ -1,9 +1,12 @@
+import os
+import threading
 from django.conf import settings
 from django.template.loader import get_template
-from weasyprint import HTML # type: ignore
-import tempfile
-import os
+from weasyprint import CSS, HTML # type: ignore
+from weasyprint.text.fonts import FontConfiguration # type: ignore
 from django.core.mail import EmailMessage
+from . import cache_facturas
+from . import facturacion
 from .models import UserAcueducto # Assuming UserAcueducto might be needed for type hinting or direct use in future utils.
 
 def obtener_mes_espanol(numero_mes):
@@ -32,36 +35,149 @@ def formatear_fecha_espanol(fecha):
     mes = obtener_mes_espanol(fecha.month)
     return f"{fecha.day} de {mes} de {fecha.year}"
 
-def generar_pdf_factura(usuario: UserAcueducto, fecha_emision, periodo_facturacion, base_url):
-    """Genera el PDF de una factura individual"""
-    historico_lecturas = usuario.lecturas.all().order_by('-fecha_lectura')[:6]
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Archivos de los que depende el render de una factura; si cambia alguno se recompila el contexto
+RECURSOS_FACTURA = (
+    os.path.join(_APP_DIR, 'templates', 'factura_template.html'),
+    os.path.join(_APP_DIR, 'static', 'factura.css'),
+    os.path.join(_APP_DIR, 'static', 'images', 'logo1.webp'),
+)
+
+class ContextoRenderFactura:
+    """
+    Hoja de estilos, configuración de fuentes y caché de imágenes que comparten todas
+    las facturas renderizadas en el proceso, para no reconstruirlos en cada PDF.
+    """
+
+    def __init__(self, firma):
+        self.firma = firma
+        self.font_config = FontConfiguration()
+        self.stylesheets = [
+            CSS(filename=os.path.join(_APP_DIR, 'static', 'factura.css'), font_config=self.font_config)
+        ]
+        # WeasyPrint guarda aquí las imágenes ya cargadas (el logo), indexadas por URL
+        self.cache = {}
+
+    def write_pdf(self, html: HTML) -> bytes:
+        return html.write_pdf(stylesheets=self.stylesheets, font_config=self.font_config, cache=self.cache)
+
+_contexto_render = None
+_contexto_render_lock = threading.Lock()
+
+def _firma_recursos_factura():
+    return tuple(
+        os.stat(ruta).st_mtime_ns if os.path.exists(ruta) else None
+        for ruta in RECURSOS_FACTURA
+    )
+
+def obtener_contexto_render() -> ContextoRenderFactura:
+    """Devuelve el contexto de render del proceso, recompilándolo si la plantilla o los estáticos cambiaron."""
+    global _contexto_render
+    firma = _firma_recursos_factura()
+    contexto = _contexto_render
+    if contexto is None or contexto.firma != firma:
+        with _contexto_render_lock:
+            if _contexto_render is None or _contexto_render.firma != firma:
+                _contexto_render = ContextoRenderFactura(firma)
+            contexto = _contexto_render
+    return contexto
+
+def contexto_factura(usuario: UserAcueducto, fecha_emision, periodo_facturacion, historico_lecturas=None, consumos_mensuales=None) -> dict:
+    """
+    Arma el contexto de factura_template.html. Si historico_lecturas y consumos_mensuales no
+    vienen ya cargados (p. ej. desde services.cargar_datos_facturacion) se consultan las
+    últimas seis lecturas y los últimos seis meses de consumo (el gráfico de la factura).
+    Consumo, tarifa y total salen de facturacion.liquidar_usuario.
+    """
+    if historico_lecturas is None:
+        historico_lecturas = usuario.lecturas.all().order_by('-fecha_lectura')[:6]
+    historico_lecturas = list(historico_lecturas)
+    if consumos_mensuales is None:
+        consumos_mensuales = usuario.consumos_mensuales.all()[:6]
+    consumos_mensuales = list(consumos_mensuales)
     lectura_anterior = None
     if len(historico_lecturas) > 1:
         lectura_anterior = historico_lecturas[1]
 
-    template = get_template('factura_template.html')
-    context = {
+    return {
         'usuario': usuario,
         'historico_lecturas': historico_lecturas,
         'lectura_anterior': lectura_anterior,
+        # Del más antiguo al más reciente, como se dibujan en el gráfico
+        'consumos_mensuales': consumos_mensuales[::-1],
+        'liquidacion': facturacion.liquidar_usuario(usuario, historico_lecturas),
         'fecha_emision': fecha_emision,
         'periodo_facturacion': periodo_facturacion,
     }
+
+def generar_pdf_factura(usuario: UserAcueducto, fecha_emision, periodo_facturacion, base_url, historico_lecturas=None, usar_cache=True, consumos_mensuales=None) -> bytes:
+    """
+    Genera el PDF de una factura individual y devuelve su contenido en memoria. Si la misma
+    factura ya se generó (mismos datos, lecturas, período, fecha y plantilla) se sirve desde
+    la caché en disco sin pasar por WeasyPrint.
+    """
+    context = contexto_factura(usuario, fecha_emision, periodo_facturacion, historico_lecturas, consumos_mensuales)
+
+    clave = None
+    if usar_cache and cache_facturas.cache_habilitada():
+        version = cache_facturas.version_plantilla(RECURSOS_FACTURA, _firma_recursos_factura())
+        clave = cache_facturas.clave_factura(
+            usuario, context['historico_lecturas'], fecha_emision, periodo_facturacion, version,
+            liquidacion=context['liquidacion'], consumos_mensuales=context['consumos_mensuales']
+        )
+        pdf_bytes = cache_facturas.obtener(usuario.pk, clave)
+        if pdf_bytes is not None:
+            return pdf_bytes
+
+    template = get_template('factura_template.html')
     html = template.render(context)
 
     # Use settings.BASE_DIR directly if base_url is meant to be static path
     # For now, assuming base_url is passed correctly as Path object or string
-    pdf_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-    HTML(string=html, base_url=str(base_url)).write_pdf(pdf_file.name)
-    return pdf_file
+    # Sin target, write_pdf() devuelve los bytes: no hay archivo temporal que leer ni borrar
+    pdf_bytes = obtener_contexto_render().write_pdf(HTML(string=html, base_url=str(base_url)))
+    if clave is not None:
+        cache_facturas.guardar(usuario.pk, clave, pdf_bytes)
+    return pdf_bytes
 
-def enviar_factura_email(usuario: UserAcueducto, pdf_file_path: str):
-    """Envía la factura por email al usuario"""
+def precalentar_weasyprint():
+    """
+    Compila el contexto de render y renderiza un documento mínimo para que WeasyPrint
+    cargue Pango y las fuentes antes de la primera factura real (útil en los procesos
+    del pool de facturas).
+    """
+    obtener_contexto_render().write_pdf(HTML(string='<p>Acueducto</p>'))
+
+def construir_email_factura(usuario: UserAcueducto, pdf_bytes: bytes, connection=None) -> EmailMessage:
+    """Arma el email con la factura adjunta; `connection` permite reutilizar una conexión SMTP abierta"""
     email = EmailMessage(
         'Factura del Acueducto',
         'Adjunto encontrará su factura.',
         settings.DEFAULT_FROM_EMAIL,
-        [usuario.email]
+        [usuario.email],
+        connection=connection
     )
-    email.attach_file(pdf_file_path)
-    email.send()
+    email.attach(f'factura_{usuario.contrato}.pdf', pdf_bytes, 'application/pdf')
+    return email
+
+def enviar_factura_email(usuario: UserAcueducto, pdf_bytes: bytes):
+    """Envía la factura por email al usuario"""
+    construir_email_factura(usuario, pdf_bytes).send()
+
+class ZipStreamBuffer:
+    """Destino no seekable para ZipFile: acumula lo escrito hasta que el generador lo entrega."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
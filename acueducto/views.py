@@ -1,24 +1,29 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth.models import User
 from django.contrib import messages
 from django.views.decorators.http import require_POST
-from django.http import HttpResponse, JsonResponse
-from django.db.models import Q, Count, Case, When, FloatField, Value
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse, FileResponse, Http404
+from django.contrib.staticfiles import finders
+from django.db.models import Q, Case, When, FloatField, Value
 from django.template.loader import get_template
 from django.core.mail import EmailMessage
 from django.conf import settings
 from weasyprint import HTML
 from datetime import datetime, timedelta
-import tempfile
-import os
 from io import BytesIO
 # import zipfile # No longer used directly in views.py
 import json
-from .models import UserAcueducto, HistoricoLectura, Ruta, OrdenRuta
+from .models import UserAcueducto, HistoricoLectura, Ruta, OrdenRuta, TrabajoFacturacion
 from . import utils # Updated import
 from .forms import UserAcueductoForm # Import the form
 from . import services # Import services
+from . import busqueda as busqueda_usuarios
+from . import analitica
+from . import anomalias as anomalias_lecturas
+from . import exportacion
 
 # Create your views here.
 def index(request):
@@ -36,13 +41,10 @@ def index(request):
 
 def lista_usuarios(request):
     busqueda = request.GET.get('busqueda', '')
-    usuarios = UserAcueducto.objects.all()
     
     # Obtener solo las rutas activas
-    rutas_activas = Ruta.objects.filter(activa=True).annotate(
-        total_ordenes=Count('ordenruta'),
-        lecturas_completadas_count=Count('ordenruta', filter=Q(ordenruta__lectura_tomada=True))
-    ).prefetch_related('ordenruta_set__usuario')
+    # El avance sale de los contadores de Ruta; las paradas se piden por páginas a ordenes_ruta_json
+    rutas_activas = Ruta.objects.filter(activa=True).select_related('lector')
 
     if request.method == 'POST' and 'generar_ruta' in request.POST:
         try:
@@ -50,26 +52,107 @@ def lista_usuarios(request):
             usuarios_orden = json.loads(request.POST.get('usuarios_orden', '[]'))
             
             # Call the service to create the new route
-            services.crear_nueva_ruta_service(nombre_ruta, usuarios_orden)
+            services.crear_nueva_ruta_service(
+                nombre_ruta, usuarios_orden, optimizar=request.POST.get('optimizar_orden') == 'on',
+                lector_id=int(request.POST['lector']) if request.POST.get('lector') else None
+            )
             messages.success(request, 'Ruta creada exitosamente')
             return redirect('lista_usuarios')
         except ValueError as ve: # Catch specific error from service for better feedback
             messages.error(request, str(ve))
         except Exception as e: # Catch any other unexpected errors
             messages.error(request, f'Error al crear la ruta: {str(e)}')
+
+    if request.method == 'POST' and 'repartir_rutas' in request.POST:
+        try:
+            rutas = services.repartir_rutas_service(
+                request.POST.get('nombre_reparto'),
+                request.POST.getlist('lectores'),
+                request.POST.get('zona_reparto', '').strip()
+            )
+            messages.success(request, f'{len(rutas)} rutas creadas y asignadas')
+            return redirect('lista_usuarios')
+        except ValueError as ve:
+            messages.error(request, str(ve))
+        except Exception as e:
+            messages.error(request, f'Error al repartir las rutas: {str(e)}')
     
-    if busqueda:
-        usuarios = usuarios.filter(
-            Q(contrato__icontains=busqueda) |
-            Q(address__icontains=busqueda)
-        )
+    # Solo la primera página; el resto (y el selector de la ruta) se carga desde usuarios_json
+    usuarios, siguiente = services.pagina_usuarios_service(busqueda, request.GET.get('despues', ''))
     
     return render(request, 'lista_usuarios.html', {
         'usuarios': usuarios,
+        'siguiente': siguiente,
         'busqueda': busqueda,
-        'rutas_activas': rutas_activas
+        'rutas_activas': rutas_activas,
+        'lectores': User.objects.filter(is_active=True).order_by('username'),
+    })
+
+def _usuario_a_dict(usuario):
+    return {
+        'id': usuario.id,
+        'contrato': usuario.contrato,
+        'fecha_ultima_lectura': usuario.fecha_ultima_lectura.strftime('%d/%m/%Y') if usuario.fecha_ultima_lectura else '',
+        'name': usuario.name,
+        'lastname': usuario.lastname,
+        'email': usuario.email,
+        'phone': usuario.phone,
+        'address': usuario.address,
+        'categoria': usuario.get_categoria_display(),
+        'zona': usuario.zona,
+        'lectura': usuario.lectura,
+        'historico_url': reverse('historico_lecturas', args=[usuario.contrato]),
+    }
+
+def usuarios_json(request):
+    """Página de usuarios en JSON para la carga incremental de la lista y del selector de la ruta."""
+    try:
+        limite = min(int(request.GET.get('limite', settings.LISTA_USUARIOS_TAMANO_PAGINA)), 200)
+    except ValueError:
+        limite = settings.LISTA_USUARIOS_TAMANO_PAGINA
+    usuarios, siguiente = services.pagina_usuarios_service(
+        request.GET.get('busqueda', ''),
+        request.GET.get('despues', ''),
+        max(limite, 1)
+    )
+    return JsonResponse({
+        'usuarios': [_usuario_a_dict(usuario) for usuario in usuarios],
+        'siguiente': siguiente,
     })
 
+def ordenes_ruta_json(request, ruta_id):
+    """Página de paradas de una ruta en JSON, para desplegarlas en la lista de rutas activas."""
+    ruta = get_object_or_404(Ruta, pk=ruta_id)
+    try:
+        limite = min(int(request.GET.get('limite', settings.LISTA_USUARIOS_TAMANO_PAGINA)), 200)
+        despues = int(request.GET['despues']) if request.GET.get('despues') else None
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+    ordenes, siguiente = services.pagina_ordenes_ruta_service(ruta.pk, despues, max(limite, 1))
+    return JsonResponse({
+        'ordenes': [
+            {
+                'orden': orden.orden,
+                'contrato': orden.usuario.contrato,
+                'address': orden.usuario.address,
+                'lectura_tomada': orden.lectura_tomada,
+            }
+            for orden in ordenes
+        ],
+        'siguiente': siguiente,
+    })
+
+@require_POST
+def proponer_orden_ruta(request):
+    """Orden de visita propuesto para los usuarios seleccionados en el selector de la ruta."""
+    try:
+        usuario_ids = [int(usuario_id) for usuario_id in json.loads(request.body).get('usuario_ids', [])]
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'success': False, 'error': 'Se espera {"usuario_ids": [...]}'}, status=400)
+    if len(usuario_ids) > settings.RUTA_MAX_PARADAS:
+        return JsonResponse({'success': False, 'error': f'Máximo {settings.RUTA_MAX_PARADAS} usuarios por ruta'}, status=413)
+    return JsonResponse({'usuario_ids': services.proponer_orden_ruta_service(usuario_ids)})
+
 # generar_pdf_factura and enviar_factura_email moved to utils.py
 # generar_todas_facturas moved to services.py
 
@@ -94,43 +177,46 @@ def generar_factura_individual(contrato, fecha_emision, periodo_inicio, periodo_
 
 # Helper function to generate ZIP of all invoices
 def _generar_todas_facturas_zip(periodo_inicio, periodo_fin):
-    # Call the service function to get the zip_buffer
-    zip_buffer = services.generar_zip_todas_facturas_service(periodo_inicio, periodo_fin)
-    response = HttpResponse(zip_buffer.getvalue(), content_type='application/zip')
+    # The service validates the period up front and returns a generator, so each
+    # factura_<contrato>.pdf reaches the client as soon as it is rendered
+    zip_stream = services.generar_zip_todas_facturas_stream_service(periodo_inicio, periodo_fin)
+    response = StreamingHttpResponse(zip_stream, content_type='application/zip')
     response['Content-Disposition'] = 'attachment; filename="todas_las_facturas.zip"'
     return response
 
 # Helper function to generate PDF response for a single invoice
 def _generar_factura_pdf_response(request_post_data):
-    pdf_file = generar_factura_individual(
+    pdf_bytes = generar_factura_individual(
         contrato=request_post_data.get('contrato'),
         fecha_emision=datetime.strptime(request_post_data.get('fecha_emision'), '%Y-%m-%d') if request_post_data.get('fecha_emision') else None,
         periodo_inicio=request_post_data.get('periodo_inicio'),
         periodo_fin=request_post_data.get('periodo_fin')
     )
-    with open(pdf_file.name, 'rb') as pdf:
-        response = HttpResponse(pdf.read(), content_type='application/pdf')
-        response['Content-Disposition'] = f'inline; filename="factura_{request_post_data.get("contrato")}.pdf"'
-    os.unlink(pdf_file.name)
+    response = HttpResponse(pdf_bytes, content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename="factura_{request_post_data.get("contrato")}.pdf"'
     return response
 
-# Helper function to send a single invoice via email
+# Helper function to queue a single invoice for email delivery
 def _enviar_factura_email_view(request, request_post_data):
     try:
-        pdf_file = generar_factura_individual(
+        trabajo = services.encolar_email_factura_service(
             contrato=request_post_data.get('contrato'),
-            fecha_emision=datetime.strptime(request_post_data.get('fecha_emision'), '%Y-%m-%d') if request_post_data.get('fecha_emision') else None,
-            periodo_inicio=request_post_data.get('periodo_inicio'),
-            periodo_fin=request_post_data.get('periodo_fin')
+            fecha_emision_str=request_post_data.get('fecha_emision'),
+            periodo_inicio_str=request_post_data.get('periodo_inicio'),
+            periodo_fin_str=request_post_data.get('periodo_fin')
         )
-        usuario = UserAcueducto.objects.get(contrato=request_post_data.get('contrato'))
-        utils.enviar_factura_email(usuario, pdf_file.name) # Updated call
-        messages.success(request, 'Factura enviada por correo exitosamente')
-        os.unlink(pdf_file.name)
+        messages.success(request, 'La factura se enviará por correo en segundo plano')
+        return redirect(f"{reverse('generar_factura')}?trabajo={trabajo.id}")
     except Exception as e:
         messages.error(request, f'Error al enviar la factura por correo: {str(e)}')
     return redirect('generar_factura')
 
+# Helper function to queue the ZIP of all invoices as a background job
+def _encolar_todas_facturas_zip(request, periodo_inicio, periodo_fin):
+    trabajo = services.encolar_zip_facturas_service(periodo_inicio, periodo_fin)
+    messages.success(request, 'Las facturas se están generando en segundo plano')
+    return redirect(f"{reverse('generar_factura')}?trabajo={trabajo.id}")
+
 def generar_factura(request):
     """Vista principal para la generación de facturas"""
     contrato_preseleccionado = request.GET.get('contrato', '')
@@ -139,6 +225,19 @@ def generar_factura(request):
     if request.method == 'POST':
         try:
             if 'generar_todas' in request.POST:
+                return _encolar_todas_facturas_zip(
+                    request,
+                    request.POST.get('periodo_inicio_todas'),
+                    request.POST.get('periodo_fin_todas')
+                )
+            elif 'enviar_email_todas' in request.POST:
+                trabajo = services.encolar_email_masivo_service(
+                    request.POST.get('periodo_inicio_todas'),
+                    request.POST.get('periodo_fin_todas')
+                )
+                messages.success(request, 'Las facturas se enviarán por correo en segundo plano')
+                return redirect(f"{reverse('generar_factura')}?trabajo={trabajo.id}")
+            elif 'generar_todas_directo' in request.POST:
                 return _generar_todas_facturas_zip(
                     request.POST.get('periodo_inicio_todas'),
                     request.POST.get('periodo_fin_todas')
@@ -155,15 +254,44 @@ def generar_factura(request):
     busqueda_contrato = request.GET.get('busqueda_contrato', '')
     
     if busqueda_contrato:
-        usuarios = usuarios.filter(contrato__icontains=busqueda_contrato)
+        usuarios = busqueda_usuarios.filtrar_usuarios(usuarios, busqueda_contrato)
+
+    trabajo = None
+    if request.GET.get('trabajo', '').isdigit():
+        trabajo = TrabajoFacturacion.objects.filter(id=request.GET['trabajo']).first()
     
     return render(request, 'generar_factura.html', {
         'usuarios': usuarios,
         'contrato_preseleccionado': contrato_preseleccionado,
         'busqueda_contrato': busqueda_contrato,
         'fecha_actual': fecha_actual,
+        'trabajo': trabajo,
+    })
+
+@login_required(login_url='login')
+def estado_trabajo(request, trabajo_id):
+    """Progreso de un trabajo de facturación en segundo plano, para consultarlo por polling."""
+    trabajo = get_object_or_404(TrabajoFacturacion, id=trabajo_id)
+    return JsonResponse({
+        'id': trabajo.id,
+        'tipo': trabajo.tipo,
+        'estado': trabajo.estado,
+        'total': trabajo.total,
+        'procesadas': trabajo.procesadas,
+        'fallidas': trabajo.fallidas,
+        'porcentaje_completado': trabajo.porcentaje_completado(),
+        'errores': trabajo.errores,
+        'mensaje': trabajo.mensaje,
+        'descarga_url': reverse('descargar_trabajo', args=[trabajo.id]) if trabajo.archivo else None,
     })
 
+@login_required(login_url='login')
+def descargar_trabajo(request, trabajo_id):
+    trabajo = get_object_or_404(TrabajoFacturacion, id=trabajo_id, estado='completado')
+    if not trabajo.archivo:
+        raise Http404('El trabajo no generó ningún archivo')
+    return FileResponse(trabajo.archivo.open('rb'), as_attachment=True, filename='todas_las_facturas.zip')
+
 def buscar_usuario_por_contrato(request):
     contrato = request.GET.get('contrato', '')
     if contrato:
@@ -178,6 +306,26 @@ def buscar_usuario_por_contrato(request):
             return JsonResponse({'found': False})
     return JsonResponse({'found': False})
 
+def sugerencias_usuarios(request):
+    """Sugerencias para los campos de búsqueda (typeahead): usuarios que coinciden con ?q=, los más relevantes primero."""
+    try:
+        limite = min(int(request.GET.get('limite', 10)), 50)
+    except ValueError:
+        limite = 10
+    usuarios = busqueda_usuarios.buscar_usuarios(request.GET.get('q', ''), max(limite, 1))
+    return JsonResponse({
+        'resultados': [
+            {
+                'id': usuario.id,
+                'contrato': usuario.contrato,
+                'nombre': f"{usuario.name} {usuario.lastname}",
+                'address': usuario.address,
+                'numero_de_medidor': usuario.numero_de_medidor,
+            }
+            for usuario in usuarios
+        ]
+    })
+
 def login_view(request):
     if request.method == 'POST':
         username = request.POST.get('username')
@@ -194,39 +342,23 @@ def logout_view(request):
     logout(request)
     return redirect('login')
 
-def _get_ruta_context():
-    """Fetches active route and calculates completion statistics."""
+def _progreso_ruta(ruta):
+    """Avance de la ruta a partir de sus contadores desnormalizados (sin consultas)."""
+    if ruta is None:
+        return {'total_lecturas': 0, 'lecturas_completadas': 0, 'porcentaje_completado': 0}
+    return {
+        'total_lecturas': ruta.total_ordenes,
+        'lecturas_completadas': ruta.lecturas_completadas,
+        'porcentaje_completado': ruta.porcentaje_completado(),
+    }
+
+def _get_ruta_context(lector=None):
+    """Fetches the reader's active route and calculates completion statistics."""
     try:
-        ruta = Ruta.objects.filter(activa=True).annotate(
-            total_ordenes=Count('ordenruta'),
-            lecturas_completadas_count=Count('ordenruta', filter=Q(ordenruta__lectura_tomada=True))
-        ).prefetch_related(
-            'ordenruta_set__usuario',
-            'ordenruta_set__usuario__lecturas'
-        ).first()
-        
-        # Values for context will now be derived from 'ruta' object itself using its properties or updated method
-        # The model's `porcentaje_completado` method will use the annotated fields.
-        # We can also directly pass annotated values if needed by the template,
-        # but relying on the model method is cleaner if it's correctly updated.
-
-        if ruta:
-            # These specific context variables are used in 'toma_lectura.html' currently.
-            # Let's ensure they are available. The model method handles percentage.
-            context_total_lecturas = ruta.total_ordenes
-            context_lecturas_completadas = ruta.lecturas_completadas_count
-            context_porcentaje_completado = ruta.porcentaje_completado() # Will use annotations
-        else:
-            context_total_lecturas = 0
-            context_lecturas_completadas = 0
-            context_porcentaje_completado = 0
-        
-        return {
-            'ruta_activa': ruta, # The annotated ruta object
-            'total_lecturas': context_total_lecturas,
-            'lecturas_completadas': context_lecturas_completadas,
-            'porcentaje_completado': context_porcentaje_completado
-        }
+        # Solo lo que se muestra: el histórico de cada usuario se carga al abrirlo (historial_lecturas_json)
+        ruta = services.ruta_activa_vista_service(lector)
+        ordenes = services.ordenes_ruta_vista_service(ruta) if ruta else []
+        return {'ruta_activa': ruta, 'ordenes_ruta': ordenes, **_progreso_ruta(ruta)}
     except Exception as e:
         # Propagate the exception to be caught by the main view
         raise Exception(f'Error al cargar la ruta: {str(e)}')
@@ -236,30 +368,22 @@ def _handle_toma_lectura_post(request, ruta_activa):
     mensaje = None
     usuario = None
     historico = None
+    advertencias = []
     contrato = request.POST.get('contrato')
     nueva_lectura = request.POST.get('lectura')
     try:
         usuario = UserAcueducto.objects.get(contrato=contrato)
-        from django.utils import timezone
-        fecha_actual = timezone.now().date()
-
-        HistoricoLectura.objects.create(
-            usuario=usuario,
-            lectura=nueva_lectura,
-            fecha_lectura=fecha_actual
-        )
-
-        usuario.lectura = nueva_lectura
-        usuario.fecha_ultima_lectura = fecha_actual # Renamed field
-        usuario.save()
-
-        if ruta_activa:
-            orden_ruta = ruta_activa.ordenruta_set.filter(usuario=usuario).first()
-            if orden_ruta:
-                orden_ruta.lectura_tomada = True
-                orden_ruta.save()
+        # La orden puede estar en otra de las rutas del lector, no solo en la que se muestra
+        ruta_id = services.ruta_lector_para_usuario(request.user, usuario.pk)
+        historico_nuevo, marcadas = services.registrar_lectura_service(usuario.pk, nueva_lectura, ruta_id)
+        usuario.lectura = historico_nuevo.lectura
+        usuario.fecha_ultima_lectura = historico_nuevo.fecha_lectura
+        if ruta_activa and ruta_activa.pk == ruta_id:
+            ruta_activa.lecturas_completadas += marcadas
 
         mensaje = "Lectura registrada exitosamente"
+        # Consumo negativo o pico: se guarda igual, pero el lector puede verificarla en el sitio
+        advertencias = [anomalia.detalle for anomalia in anomalias_lecturas.revisar_lectura(historico_nuevo)]
         historico = usuario.lecturas.all()[:6]
 
     except UserAcueducto.DoesNotExist:
@@ -269,7 +393,7 @@ def _handle_toma_lectura_post(request, ruta_activa):
         # Or handle specific errors here if needed
         mensaje = f"Error al procesar la lectura: {str(e)}"
 
-    return mensaje, usuario, historico
+    return mensaje, usuario, historico, advertencias
 
 def _handle_toma_lectura_get_contrato(request):
     """Handles the GET request logic when 'contrato' is present for toma_lectura."""
@@ -292,14 +416,17 @@ def toma_lectura(request):
     mensaje = None
     usuario = None
     historico = None
+    advertencias = []
     context = {}
 
     try:
-        ruta_context = _get_ruta_context()
+        ruta_context = _get_ruta_context(request.user)
         context.update(ruta_context) # Add ruta_activa, total_lecturas, etc.
 
         if request.method == 'POST':
-            mensaje, usuario, historico = _handle_toma_lectura_post(request, context.get('ruta_activa'))
+            mensaje, usuario, historico, advertencias = _handle_toma_lectura_post(request, context.get('ruta_activa'))
+            # La lectura recién registrada ya cuenta en el avance
+            context.update(_progreso_ruta(context.get('ruta_activa')))
         
         elif request.method == 'GET':
             if 'contrato' in request.GET:
@@ -309,6 +436,7 @@ def toma_lectura(request):
             'mensaje': mensaje,
             'usuario': usuario,
             'historico': historico,
+            'advertencias': advertencias,
         })
         
         return render(request, 'toma_lectura.html', context)
@@ -327,32 +455,17 @@ def guardar_lectura(request):
         usuario_id = data.get('usuario_id')
         lectura = data.get('lectura')
 
-        usuario = get_object_or_404(UserAcueducto, id=usuario_id)
-        fecha_actual = datetime.now().date()
-
-        # Guardar la lectura en el histórico
-        HistoricoLectura.objects.create(
-            usuario=usuario,
-            lectura=lectura,
-            fecha_lectura=fecha_actual
-        )
-
-        # Actualizar la lectura actual del usuario
-        usuario.lectura = lectura
-        usuario.fecha_ultima_lectura = fecha_actual # Renamed field
-        usuario.save()
-
-        # Actualizar el estado de la lectura en la ruta activa
-        ruta_activa = Ruta.objects.filter(activa=True).first()
-        if ruta_activa:
-            orden_ruta = ruta_activa.ordenruta_set.filter(usuario=usuario).first()
-            if orden_ruta:
-                orden_ruta.lectura_tomada = True
-                orden_ruta.save()
+        # Se registra la lectura y se marca la orden en la ruta del lector que la contiene en una transacción
+        ruta_id = services.ruta_lector_para_usuario(request.user, usuario_id)
+        try:
+            historico, _ = services.registrar_lectura_service(usuario_id, lectura, ruta_id)
+        except UserAcueducto.DoesNotExist:
+            return JsonResponse({'success': False, 'error': 'Usuario no encontrado'}, status=404)
 
         return JsonResponse({
             'success': True,
-            'message': 'Lectura guardada exitosamente'
+            'message': 'Lectura guardada exitosamente',
+            'advertencias': [anomalia.detalle for anomalia in anomalias_lecturas.revisar_lectura(historico)],
         })
 
     except Exception as e:
@@ -361,6 +474,90 @@ def guardar_lectura(request):
             'error': str(e)
         }, status=400)
 
+def historial_lecturas_json(request, usuario_id):
+    """Últimas lecturas de un usuario para desplegar su historial en la toma de lectura."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': 'Debe iniciar sesión'}, status=401)
+    try:
+        limite = min(int(request.GET.get('limite', services.LECTURAS_HISTORIAL)), 100)
+    except ValueError:
+        limite = services.LECTURAS_HISTORIAL
+    lecturas = services.historial_lecturas_service(usuario_id, max(limite, 1))
+    return JsonResponse({
+        'usuario_id': usuario_id,
+        'lecturas': [
+            {'fecha_lectura': lectura['fecha_lectura'].isoformat(), 'lectura': lectura['lectura']}
+            for lectura in lecturas
+        ],
+    })
+
+def _leer_lote_lecturas(request) -> list:
+    """Lecturas del cuerpo: JSON ({"lecturas": [...]} o una lista) o NDJSON (una lectura por línea)"""
+    cuerpo = request.body.decode('utf-8')
+    if request.content_type == 'application/x-ndjson':
+        return [json.loads(linea) for linea in cuerpo.splitlines() if linea.strip()]
+    data = json.loads(cuerpo)
+    if isinstance(data, dict):
+        data = data.get('lecturas')
+    if not isinstance(data, list):
+        raise ValueError('Se esperaba una lista de lecturas')
+    return data
+
+@require_POST
+def registrar_lecturas_lote(request):
+    """
+    Recibe de una vez las lecturas que el lector tomó sin conexión. Se puede reenviar el mismo
+    lote tras un corte: las lecturas ya recibidas vuelven como 'duplicada'.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': 'Debe iniciar sesión'}, status=401)
+    try:
+        items = _leer_lote_lecturas(request)
+    except (ValueError, UnicodeDecodeError) as e:
+        return JsonResponse({'success': False, 'error': f'Lote inválido: {str(e)}'}, status=400)
+    if len(items) > settings.LECTURAS_LOTE_MAX:
+        return JsonResponse({
+            'success': False,
+            'error': f'El lote supera el máximo de {settings.LECTURAS_LOTE_MAX} lecturas'
+        }, status=413)
+
+    ruta_ids = list(services.rutas_activas_lector(request.user).values_list('id', flat=True))
+    resultados = services.registrar_lecturas_lote_service(items, ruta_ids)
+    return JsonResponse({
+        'success': True,
+        'creadas': sum(1 for resultado in resultados if resultado['estado'] == 'creada'),
+        'duplicadas': sum(1 for resultado in resultados if resultado['estado'] == 'duplicada'),
+        'errores': sum(1 for resultado in resultados if resultado['estado'] == 'error'),
+        'resultados': resultados,
+    })
+
+def paquete_ruta(request):
+    """
+    Paquete de la ruta activa para la toma de lectura sin conexión. Responde 304 si el
+    dispositivo ya tiene la versión actual (If-None-Match con el ETag de la última descarga).
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': 'Debe iniciar sesión'}, status=401)
+    paquete = services.paquete_ruta_service(request.GET.get('ruta'), request.user)
+    if paquete is None:
+        return JsonResponse({'success': False, 'error': 'No hay una ruta activa'}, status=404)
+
+    etag = f'"{paquete["version"]}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(paquete)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+def service_worker(request):
+    """Sirve sw.js desde la raíz del sitio para que su alcance cubra la página de toma de lectura."""
+    with open(finders.find('sw.js'), 'rb') as archivo:
+        response = HttpResponse(archivo.read(), content_type='application/javascript')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
 @login_required
 def finalizar_ruta(request):
     if request.method == 'POST':
@@ -389,11 +586,75 @@ def finalizar_ruta(request):
             
     return JsonResponse({'error': 'Método no permitido'}, status=405)
 
+def _meses_tablero(request) -> int:
+    try:
+        return int(request.GET.get('meses', analitica.MESES_POR_DEFECTO))
+    except ValueError:
+        return analitica.MESES_POR_DEFECTO
+
+@login_required(login_url='login')
+def tablero_analitica(request):
+    """Totales de consumo, usuarios, cartera y cobertura de lecturas por zona, categoría y mes."""
+    return render(request, 'analitica.html', {
+        'tablero': analitica.tablero(_meses_tablero(request)),
+        'meses_max': analitica.MESES_MAX,
+        'exportaciones': [('usuarios', 'Usuarios'), ('lecturas', 'Lecturas'), ('facturacion', 'Facturación por mes')],
+    })
+
+def tablero_analitica_json(request):
+    """Los datos del tablero de analítica en JSON (los importes como texto decimal)."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': 'Debe iniciar sesión'}, status=401)
+    return JsonResponse(analitica.tablero(_meses_tablero(request)))
+
+@login_required(login_url='login')
+def exportar(request, tipo):
+    """Exportación de usuarios, lecturas o facturación por mes en CSV o XLSX, enviada mientras se genera."""
+    formato = request.GET.get('formato', 'csv')
+    try:
+        desde = datetime.strptime(request.GET['desde'], '%Y-%m-%d').date() if request.GET.get('desde') else None
+        contenido = exportacion.exportar(tipo, formato, desde)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    response = StreamingHttpResponse(contenido, content_type=exportacion.FORMATOS[formato])
+    response['Content-Disposition'] = f'attachment; filename="{tipo}_{datetime.now():%Y%m%d}.{formato}"'
+    return response
+
+@login_required(login_url='login')
+def importar(request):
+    """Carga de un CSV de usuarios o de lecturas históricas, que se importa en segundo plano."""
+    if request.method == 'POST':
+        archivo = request.FILES.get('archivo')
+        if archivo is None:
+            messages.error(request, 'Seleccione un archivo CSV')
+            return redirect('importar')
+        try:
+            trabajo = services.encolar_importacion_service(
+                request.POST.get('tipo', ''), archivo, actualizar='actualizar' in request.POST
+            )
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect('importar')
+        messages.success(request, 'El archivo se está importando en segundo plano')
+        return redirect(f"{reverse('importar')}?trabajo={trabajo.id}")
+
+    trabajo = None
+    if request.GET.get('trabajo', '').isdigit():
+        trabajo = TrabajoFacturacion.objects.filter(
+            id=request.GET['trabajo'], tipo__in=services.TIPOS_IMPORTACION
+        ).first()
+    return render(request, 'importar.html', {
+        'trabajo': trabajo,
+        'columnas_usuarios': 'contrato, nombre, apellido, email, categoria, telefono, direccion, zona, numero_de_medidor, lectura, credito',
+        'columnas_lecturas': 'contrato, fecha_lectura, lectura',
+    })
+
 @login_required(login_url='login')
 def historico_lecturas(request, contrato):
     try:
         usuario = get_object_or_404(UserAcueducto, contrato=contrato)
-        historico = list(usuario.lecturas.all().order_by('-fecha_lectura'))
+        # Un registro por mes de la tabla de consumo mensual: última lectura del mes y su consumo
+        historico = list(usuario.consumos_mensuales.all())
         
         return render(request, 'historico_lecturas.html', {
             'usuario': usuario,
@@ -129,11 +129,41 @@ STATICFILES_DIRS = [
     BASE_DIR / "acueducto" / "static",
 ]
 
+# Archivos generados por la aplicación (ZIP de facturas de los trabajos en segundo plano)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Usuarios por página en la lista de usuarios y en el selector de la ruta
+LISTA_USUARIOS_TAMANO_PAGINA = 50
+
+# Máximo de lecturas por envío a /lecturas/lote/ (lecturas tomadas sin conexión)
+LECTURAS_LOTE_MAX = 1000
+
+# Máximo de usuarios a los que /rutas/proponer-orden/ calcula el orden de visita en una petición
+RUTA_MAX_PARADAS = 20000
+
+# Facturación
+# Procesos usados para renderizar en paralelo el ZIP con todas las facturas
+FACTURAS_MAX_WORKERS = int(os.environ.get('FACTURAS_MAX_WORKERS', os.cpu_count() or 1))
+
+# Tarifa por categoría de usuario: cargo fijo por factura y valor por m³ consumido (acueducto/facturacion.py)
+FACTURACION_TARIFAS = {
+    'residencial': {'cargo_fijo': '0', 'valor_m3': '1000'},
+    'comercial': {'cargo_fijo': '0', 'valor_m3': '1000'},
+}
+
+# Caché en disco de PDFs de facturas (LRU por tamaño); FACTURAS_CACHE_MAX_BYTES=0 la desactiva
+FACTURAS_CACHE_DIR = os.environ.get('FACTURAS_CACHE_DIR', BASE_DIR / 'cache' / 'facturas')
+FACTURAS_CACHE_MAX_BYTES = int(os.environ.get('FACTURAS_CACHE_MAX_BYTES', 500 * 1024 * 1024))
+
+# Segundos que el tablero de analítica se sirve desde la caché de Django (acueducto/analitica.py); 0 la desactiva
+ANALITICA_CACHE_SEGUNDOS = int(os.environ.get('ANALITICA_CACHE_SEGUNDOS', 300))
+
 # Email configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -143,6 +173,11 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Envío masivo de facturas: mensajes por lote, límite de envíos por minuto y reintentos por destinatario
+EMAIL_MASIVO_TAMANO_LOTE = int(os.environ.get('EMAIL_MASIVO_TAMANO_LOTE', 50))
+EMAIL_MASIVO_MAX_POR_MINUTO = int(os.environ.get('EMAIL_MASIVO_MAX_POR_MINUTO', 60))
+EMAIL_MASIVO_REINTENTOS = int(os.environ.get('EMAIL_MASIVO_REINTENTOS', 2))
+
 # Nota: Por seguridad, es mejor usar variables de entorno para las credenciales
 # import os
 # EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')